@@ -25,6 +25,41 @@ volatile boolean QS = false;        // becomes true when Arduoino finds a beat.
 
 // Regards Serial OutPut  -- Set This Up to your needs
 static boolean serialVisual = false;   // Set to 'false' by Default.  Re-set to 'true' to see Arduino Serial Monitor ASCII Visual Pulse
+static boolean binaryOutput = false;   // Set to 'true' to send one fixed-layout binary frame per sample instead of text lines
+
+// Binary output: one frame per sample, queued by the ISR and sent from loop()
+// Layout must match FRAME in protocol.py (little-endian, packed, 50 bytes)
+#define FRAME_SYNC 0xA5
+#define FRAME_PULSE_REGULAR 0x01
+#define FRAME_BEAT 0x02
+#define FRAME_RESET 0x04
+#define FRAME_QUEUE_LENGTH 8
+struct __attribute__((packed)) Frame {
+    uint8_t sync;
+    uint8_t flags;
+    uint32_t sample_count;
+    int16_t ecg;            // K
+    int16_t edr;            // G
+    uint16_t average_RR2;   // P
+    uint16_t average_RR1;   // O
+    int32_t high_pass;      // F
+    int32_t diff;           // D
+    uint32_t squared;       // Q
+    uint32_t integrated;    // I
+    uint32_t thresh1_i;     // T
+    int32_t thresh1_f;      // Y
+    int32_t thresh2_f;      // H
+    uint16_t beat_offset;   // B, as sample_count - last_R_sample
+    int8_t peak_type;       // W
+    uint32_t reset_diff;    // R
+    uint8_t checksum;       // sum of every byte after sync, mod 256
+};
+volatile Frame frame_queue[FRAME_QUEUE_LENGTH];
+volatile uint8_t frame_head = 0;
+volatile uint8_t frame_tail = 0;
+volatile unsigned long frames_dropped = 0;
+volatile boolean frame_beat_pending = false;
+volatile boolean frame_reset_pending = false;
 
 volatile unsigned long sample_count = 0;          // used to determine pulse timing
 volatile unsigned long last_R_sample = 0;           // used to find IBI
@@ -220,6 +255,9 @@ ISR(TIMER1_COMPA_vect){
         timeout_reset();
         did_reset = true;
     }
+    if (binaryOutput) {
+        queue_frame();
+    }
     sei();                                   // enable interrupts when youre done!
 }// end isr
 
@@ -311,6 +349,7 @@ void beat_happened(long at_sample, int _peak_type){
         prior_max_slope = max_slope;
         max_slope = 0;
         QS = true;
+        frame_beat_pending = true;
         clear_candidate_peaks();
     }
 }
@@ -416,6 +455,63 @@ void serialOutput(){   // Decide How To Output Serial.
 
 }
 
+void queue_frame(){
+    // Called from the ISR, snapshots this sample into the frame queue
+    uint8_t next = (frame_head + 1) % FRAME_QUEUE_LENGTH;
+    if (next == frame_tail) {
+        frames_dropped++;  // the host sees this as a gap in sample_count
+        return;
+    }
+    volatile Frame *frame = &frame_queue[frame_head];
+    frame->sync = FRAME_SYNC;
+    frame->flags = 0;
+    if (average_RR2 == average_RR1 && beat_count > 7) {
+        frame->flags |= FRAME_PULSE_REGULAR;
+    }
+    frame->sample_count = sample_count;
+    frame->ecg = ecg_sample[0];
+    frame->edr = edr_low_pass[0] / 36;
+    frame->average_RR2 = average_RR2;
+    frame->average_RR1 = average_RR1;
+    frame->high_pass = high_pass[0];
+    frame->diff = diff;
+    frame->squared = squared[0];
+    frame->integrated = integrated[0];
+    frame->thresh1_i = thresh1_i;
+    frame->thresh1_f = thresh1_f;
+    frame->thresh2_f = thresh2_f;
+    frame->beat_offset = 0;
+    frame->peak_type = 0;
+    if (frame_beat_pending) {
+        frame->flags |= FRAME_BEAT;
+        frame->beat_offset = sample_count - last_R_sample;
+        frame->peak_type = peak_type;
+        frame_beat_pending = false;
+    }
+    frame->reset_diff = 0;
+    if (did_reset && reset_diff != 0) {
+        frame->flags |= FRAME_RESET;
+        frame->reset_diff = reset_diff;
+        did_reset = false;
+        reset_diff = 0;
+    }
+    frame_head = next;
+}
+
+void sendFramesToSerial(){
+    // Drains the frame queue filled by the ISR, no flush between frames
+    while (frame_tail != frame_head) {
+        uint8_t *bytes = (uint8_t *) &frame_queue[frame_tail];
+        uint8_t checksum = 0;
+        for (uint8_t i = 1; i < sizeof(Frame) - 1; i++) {
+            checksum += bytes[i];
+        }
+        bytes[sizeof(Frame) - 1] = checksum;
+        Serial.write(bytes, sizeof(Frame));
+        frame_tail = (frame_tail + 1) % FRAME_QUEUE_LENGTH;
+    }
+}
+
 //  Decides How To OutPut BPM and IBI Data
 void beat_happened_notify(unsigned long sample_with_beat){
     sendDataToSerial('B',sample_with_beat);   // send the last beat time with a 'B' prefix
@@ -449,6 +545,13 @@ void setup(){
 
 //  Where the Magic Happens
 void loop(){
+    if (binaryOutput) {
+        // every sample (beats and resets included) goes out in the frames
+        sendFramesToSerial();
+        digitalWrite(blinkPin, QS ? HIGH : LOW);
+        QS = false;
+        return;
+    }
     serialOutput();
 
     if (QS == true){     //  A Heartbeat Was Found
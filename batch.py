@@ -0,0 +1,240 @@
+'''Reprocesses a directory of recorded sessions on every core.
+
+    python batch.py <sessions_dir> [--jobs N] [--plots] [--all]
+                    [--output summary.csv] [--force]
+
+Each session is analyzed in a worker of a process pool: its raw columns
+are read CHUNK rows at a time, beats are re-derived from the ECG with
+pantompkins.PanTompkins, and pulse rate, HRV and EDR statistics are
+gathered along the way (see FIELDS), skin conductance by the same
+edr.EDRStage as live. Text sessions only hold every few samples of the
+ECG, too few for PanTompkins, so they are flagged as subsampled and their
+recorded beats are used instead. With --plots the session is also
+rendered like DAQThread.stop() would, see export.export_session.
+
+Results are cached in ``<sessions_dir>/.cache`` under a hash of the
+session's files and the options, so sessions that did not change are not
+read again. The summary table of every session is written as CSV.'''
+from collections import OrderedDict
+import csv
+import hashlib
+import json
+from multiprocessing import Pool, cpu_count
+import os
+import sys
+from time import time
+
+import numpy as np
+
+from channelstore import ChannelStore
+from edr import EDRStage
+import export
+from features import HRV
+from pantompkins import PanTompkins
+from session import Session
+
+CHUNK = 200 * 60  # rows, one minute of samples
+HASH_BLOCK = 1 << 20  # bytes
+CACHE_VERSION = 3  # bump when the analysis changes
+INPUTS = ('header.json', '.bin')  # what a session's hash covers
+
+FIELDS = ('session', 'start_time', 'duration', 'samples', 'subsampled', 'lost_samples', 'resets',
+          'marks', 'recorded_beats', 'beats', 'bpm_mean', 'bpm_min', 'bpm_max',
+          'sdnn', 'rmssd', 'pnn50', 'lf_hf', 'edr_mean', 'edr_min', 'edr_max',
+          'edr_saturated', 'scr_count', 'scl_mean')
+NAN = float('nan')
+
+
+class Summary(object):
+    '''Count, mean and range of the valid (non-negative) values of a
+        channel, a chunk at a time'''
+
+    def __init__(self):
+        self.count = 0
+        self.invalid = 0
+        self.sum = 0.0
+        self.min = NAN
+        self.max = NAN
+
+    def add(self, values):
+        valid = values[values >= 0]
+        self.invalid += len(values) - len(valid)
+        if not len(valid):
+            return
+        self.count += len(valid)
+        self.sum += float(valid.sum())
+        low = float(valid.min())
+        high = float(valid.max())
+        self.min = low if self.count == len(valid) else min(self.min, low)
+        self.max = high if self.count == len(valid) else max(self.max, high)
+
+    @property
+    def mean(self):
+        if not self.count:
+            return NAN
+        return self.sum / self.count
+
+
+def sessions(directory):
+    '''Session directories in ``directory``, sorted by name'''
+    return [os.path.join(directory, name) for name in sorted(os.listdir(directory))
+            if os.path.isfile(os.path.join(directory, name, 'header.json'))]
+
+
+def content_hash(path, options):
+    '''SHA-1 of the session's input files and the analysis options'''
+    digest = hashlib.sha1(json.dumps([CACHE_VERSION, options]))
+    for name in sorted(os.listdir(path)):
+        if not name.endswith(INPUTS):
+            continue
+        digest.update(name)
+        with open(os.path.join(path, name), 'rb') as f:
+            while True:
+                block = f.read(HASH_BLOCK)
+                if not block:
+                    break
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def subsampled(samples):
+    '''Whether the 'S' counter usually moves by more than one, as it does
+        with text output'''
+    steps = np.diff(np.array(samples[:CHUNK]))
+    steps = steps[steps > 0]
+    return bool(len(steps)) and bool(np.median(steps) > 1)
+
+
+def analyze(path):
+    '''The summary of one session as a dict of FIELDS. lost_samples is
+        None for subsampled sessions, whose counter skips by design.'''
+    session = Session(path)
+    length = len(session)
+    samples = session.column('S')
+    text = subsampled(samples)
+    detector = PanTompkins()
+    hrv = HRV(window=float('inf'))
+    store = ChannelStore(retention=CHUNK)
+    times = store.add('time')
+    kohms = store.add('edr')
+    eda = EDRStage(store, kohms, times)
+    bpm = Summary()
+    edr = Summary()
+    scl = Summary()
+    beats = 0
+    lost = 0
+    last_sample = None
+    duration = 0.0
+    for start in range(0, length, CHUNK):
+        stop = min(start + CHUNK, length)
+        t = session.time(start, stop)
+        duration = float(t[-1])
+        counter = np.array(samples[start:stop])
+        if last_sample is not None:
+            counter = np.concatenate(([last_sample], counter))
+        if not text:
+            gaps = np.diff(counter)
+            lost += int((gaps[gaps > 1] - 1).sum())
+        last_sample = counter[-1]
+        bpm.add(session.channel('bpm1', start, stop))
+        kohm = session.channel('edr', start, stop)
+        edr.add(kohm)
+        times.extend(t)
+        kohms.extend(kohm)
+        eda.update(stop, flush=True)
+        levels = eda.tonic[start:stop]
+        scl.add(levels[levels == levels])
+        if text:
+            continue
+        for beat in detector.feed(np.array(session.column('K')[start:stop])):
+            # may belong to the previous chunk
+            hrv.beat(float(session.time(beat.index, beat.index + 1)[0]))
+            beats += 1
+    if text:
+        for beat in session.beat_times().tolist():
+            hrv.beat(beat)
+        beats = len(session.beats)
+    return OrderedDict([
+        ('session', os.path.basename(os.path.normpath(path))),
+        ('start_time', session.start_time.isoformat()),
+        ('duration', duration),
+        ('samples', length),
+        ('subsampled', text),
+        ('lost_samples', None if text else lost),
+        ('resets', len(session.resets)),
+        ('marks', len(session.marks)),
+        ('recorded_beats', len(session.beats)),
+        ('beats', beats),
+        ('bpm_mean', bpm.mean),
+        ('bpm_min', bpm.min),
+        ('bpm_max', bpm.max),
+        ('sdnn', hrv.sdnn),
+        ('rmssd', hrv.rmssd),
+        ('pnn50', hrv.pnn50),
+        ('lf_hf', hrv.lf_hf),
+        ('edr_mean', edr.mean),
+        ('edr_min', edr.min),
+        ('edr_max', edr.max),
+        ('edr_saturated', edr.invalid),
+        ('scr_count', len(eda.onsets)),
+        ('scl_mean', scl.mean)])
+
+
+def process(job):
+    '''Pool worker: returns (path, summary, seconds taken, cached)'''
+    path, cache_dir, plots, all_data, force = job
+    start = time()
+    key = content_hash(path, [plots, all_data])
+    cache = os.path.join(cache_dir, key + '.json')
+    if not force and os.path.exists(cache):
+        with open(cache) as f:
+            return path, json.load(f, object_pairs_hook=OrderedDict), time() - start, True
+    summary = analyze(path)
+    if plots:
+        export.export_session(path, all_data)
+    # written under a temporary name so a killed run leaves no half file
+    with open(cache + '.tmp', 'w') as f:
+        json.dump(summary, f)
+    os.rename(cache + '.tmp', cache)
+    return path, summary, time() - start, False
+
+
+def run(directory, jobs=None, plots=False, all_data=False, output=None, force=False):
+    '''Analyzes every session in ``directory`` and writes the summary
+        table, returns the summaries'''
+    cache_dir = os.path.join(directory, '.cache')
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    if output is None:
+        output = os.path.join(directory, 'summary.csv')
+    paths = sessions(directory)
+    summaries = dict()
+    pool = Pool(jobs or cpu_count())
+    start = time()
+    try:
+        work = [(path, cache_dir, plots, all_data, force) for path in paths]
+        for path, summary, seconds, cached in pool.imap_unordered(process, work):
+            summaries[path] = summary
+            print '%-30s %8.2f s %s' % (os.path.basename(path), seconds,
+                                        'cached' if cached else '')
+    finally:
+        pool.close()
+        pool.join()
+    with open(output, 'wb') as f:
+        writer = csv.DictWriter(f, FIELDS)
+        writer.writeheader()
+        for path in paths:
+            writer.writerow(summaries[path])
+    print '%d sessions in %.2f s, summary in %s' % (len(paths), time() - start, output)
+    return [summaries[path] for path in paths]
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    jobs = None
+    if '--jobs' in args:
+        jobs = int(args[args.index('--jobs') + 1])
+    output = None
+    if '--output' in args:
+        output = args[args.index('--output') + 1]
+    run(args[0], jobs, '--plots' in args, '--all' in args, output, '--force' in args)
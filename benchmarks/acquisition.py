@@ -0,0 +1,87 @@
+'''Stress-tests DAQThread.run() and the redraw path with SyntheticSource at
+    increasing sample rates and reports where they stop keeping up.
+
+    python benchmarks/acquisition.py [--binary] [--draw] [--seconds N]
+
+    Each step runs acquisition for a few seconds while a second thread
+    takes snapshots like MyFrame.onRedraw, and with --draw
+    also renders the three traces with matplotlib's Agg backend. The
+    generator runs in the same process, so the ceilings include its cost.'''
+import sys
+from threading import Thread
+from time import sleep, time
+
+import common  # puts the repository on sys.path
+from daqthread import DAQThread
+from sources import SyntheticSource
+
+
+class Redrawer(Thread):
+    def __init__(self, daq, draw):
+        super(Redrawer, self).__init__()
+        self.daq = daq
+        self.frames = 0
+        self.busy = 0.0
+        self.keep_running = True
+        self.lines = None
+        if draw:
+            from matplotlib.figure import Figure
+            from matplotlib.backends.backend_agg import FigureCanvasAgg
+            self.fig = Figure((8, 6), 75)
+            self.canvas = FigureCanvasAgg(self.fig)
+            self.lines = [self.fig.add_subplot(3, 1, i).plot([0], [0])[0] for i in (1, 2, 3)]
+
+    def run(self):
+        while self.keep_running:
+            start = time()
+            snapshot = self.daq.snapshot(('ecg', 'bpm2', 'edr'))
+            for i, name in enumerate(('ecg', 'bpm2', 'edr')):
+                snapshot.last(name)
+                if self.lines is not None:
+                    self.lines[i].set_data(snapshot.time, snapshot.channels[name])
+            if self.lines is not None:
+                self.canvas.draw()
+            self.busy += time() - start
+            self.frames += 1
+            sleep(0.01)
+
+
+def run(rate, binary, draw, seconds):
+    source = SyntheticSource(rate=rate, binary=binary)
+    daq = DAQThread(source=source, record_dir=None)
+    daq.be_quiet()
+    redrawer = Redrawer(daq, draw)
+    daq.start()
+    redrawer.start()
+    sleep(seconds)
+    redrawer.keep_running = False
+    redrawer.join()
+    daq.keep_running = False
+    daq.join()
+    samples = len(daq.t)
+    return (samples / float(seconds), source.dropped_bytes, source.inWaiting(),
+            redrawer.frames / float(seconds),
+            1000 * redrawer.busy / max(1, redrawer.frames))
+
+
+if __name__ == '__main__':
+    binary = '--binary' in sys.argv
+    draw = '--draw' in sys.argv
+    seconds = 3
+    if '--seconds' in sys.argv:
+        seconds = float(sys.argv[sys.argv.index('--seconds') + 1])
+    print '%s framing, redraw %s' % ('binary' if binary else 'text',
+                                      'with Agg rendering' if draw else 'data access only')
+    print '%8s %12s %10s %9s %8s %10s' % ('rate', 'samples/s', 'dropped B', 'backlog',
+                                          'frames/s', 'frame ms')
+    ceiling = None
+    for rate in (200, 400, 800, 1600, 3200, 6400, 12800, 25600):
+        achieved, dropped, backlog, fps, frame_ms = run(rate, binary, draw, seconds)
+        print '%8d %12.0f %10d %9d %8.1f %10.2f' % (rate, achieved, dropped, backlog,
+                                                    fps, frame_ms)
+        if dropped:
+            break
+        ceiling = rate
+    achieved, _, _, fps, frame_ms = run(None, binary, draw, seconds)
+    print '%8s %12.0f %10s %9s %8.1f %10.2f' % ('max', achieved, '-', '-', fps, frame_ms)
+    print 'Highest rate without dropped bytes: %s samples/s' % (ceiling, )
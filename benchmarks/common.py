@@ -0,0 +1,77 @@
+'''Shared helpers for the benchmark scripts in this directory.'''
+import math
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def synthetic_capture(seconds, step=7):
+    '''Builds a byte stream shaped like serialOutput(): a full set of
+        prefixed lines every ``step`` samples of the 200 Hz clock, with a
+        B/W pair roughly once per second.'''
+    lines = list()
+    sample = 0
+    last_beat = 0
+    for i in range(int(seconds * 200 / step)):
+        sample += step
+        lines.append('S%d' % sample)
+        lines.append('K%d' % int(300 * math.sin(sample / 10.0)))
+        lines.append('P%d' % 810)
+        lines.append('O%d' % 800)
+        lines.append('G%d' % (480 + (i / 40) % 20))
+        lines.append('N%d' % 1)
+        for prefix in 'FDQITYH':
+            lines.append('%s%d' % (prefix, (i * 37) % 4000))
+        if sample - last_beat >= 160:
+            last_beat = sample
+            lines.append('B%d' % sample)
+            lines.append('W%d' % 0)
+    return '\r\n'.join(lines) + '\r\n'
+
+
+def load_capture(path=None, seconds=600):
+    '''Reads a raw capture of the serial port, or synthesizes one'''
+    if path is None:
+        return synthetic_capture(seconds)
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+class CapturedSerial(object):
+    '''Just enough of the serial.Serial interface to replay a capture
+        at full speed.'''
+
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+        self._open = True
+
+    def open(self):
+        self._open = True
+
+    def close(self):
+        self._open = False
+
+    def isOpen(self):
+        return self._open
+
+    def exhausted(self):
+        return self.pos >= len(self.data)
+
+    def inWaiting(self):
+        return len(self.data) - self.pos
+
+    def read(self, size=1):
+        chunk = self.data[self.pos:self.pos + size]
+        self.pos += len(chunk)
+        return chunk
+
+    def readline(self):
+        # pyserial's readline() is a read(1) loop, so replay it the same way
+        line = ''
+        while True:
+            c = self.read(1)
+            line += c
+            if not c or c == '\n':
+                return line
@@ -0,0 +1,109 @@
+'''Runs DeviceManager against several pseudo-terminals fed at 200 Hz and
+    reports whether every sample of every device arrived.
+
+    python benchmarks/devices.py [--text] [--seconds N] [--devices N ...]
+
+    The streams are generated with SyntheticSource up front and written to
+    the ptys by a separate process, one write per device every 10 ms like
+    a UART that the reading side has to keep up with. A write that does
+    not fit in the pty's buffer is counted as dropped.'''
+from multiprocessing import Process, Queue
+import errno
+import fcntl
+import os
+import re
+import sys
+from time import sleep, time
+
+import common  # puts the repository on sys.path
+from devices import DeviceManager
+from protocol import FRAME
+from sources import PtySource, SyntheticSource
+
+RATE = 200
+TICK = 0.01
+
+
+def stream(binary, samples, seed):
+    '''Bytes of the first ``samples`` samples of a SyntheticSource and the
+        offset at which each sample ends'''
+    source = SyntheticSource(rate=None, binary=binary, seed=seed, chunk=RATE)
+    source.open()
+    chunks = list()
+    while source.sent < samples:
+        chunks.append(source.read(source.inWaiting()))
+    data = ''.join(chunks)
+    if binary:
+        ends = range(FRAME.size, len(data) + 1, FRAME.size)
+    else:
+        ends = [match.start() + 2 for match in re.finditer('\r\nS', data)] + [len(data)]
+    return data, ends[:samples]
+
+
+def feed(fds, streams, seconds, results):
+    for fd in fds:
+        fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+    sent = [0] * len(fds)
+    dropped = [0] * len(fds)
+    start = time()
+    tick = 0
+    while tick * TICK < seconds:
+        tick += 1
+        due = int(tick * TICK * RATE)
+        for i, (fd, (data, ends)) in enumerate(zip(fds, streams)):
+            end = ends[min(due, len(ends)) - 1]
+            chunk = data[sent[i] + dropped[i]:end]
+            written = 0
+            try:
+                written = os.write(fd, chunk)
+            except OSError as e:
+                if e.errno != errno.EAGAIN:
+                    raise
+            sent[i] += written
+            dropped[i] += len(chunk) - written
+        sleep(max(0, start + tick * TICK - time()))
+    results.put((sent, dropped))
+
+
+def run(count, binary, seconds):
+    manager = DeviceManager(record_dir=None)
+    manager.be_quiet()
+    ptys = [PtySource() for i in range(count)]
+    for i, pty in enumerate(ptys):
+        manager.add('pty%d' % (i, ), source=pty)
+    streams = [stream(binary, int(seconds * RATE), i) for i in range(count)]
+    results = Queue()
+    feeder = Process(target=feed, args=([pty._slave for pty in ptys], streams,
+                                        seconds, results))
+    cpu = os.times()
+    manager.start()
+    feeder.start()
+    written, dropped = results.get()
+    feeder.join()
+    sleep(0.5)
+    manager.keep_running = False
+    manager.join()
+    cpu = sum(os.times()[:2]) - sum(cpu[:2])
+    received = [len(manager[name].t) for name in manager.names()]
+    errors = [manager[name].decoder.errors() for name in manager.names()]
+    for daq in manager.devices.values():
+        daq.store.close()
+    for pty in ptys:
+        pty.shutdown()
+    return int(seconds * RATE), min(received), sum(dropped), sum(errors), cpu / seconds
+
+
+if __name__ == '__main__':
+    binary = '--text' not in sys.argv
+    seconds = 10
+    if '--seconds' in sys.argv:
+        seconds = float(sys.argv[sys.argv.index('--seconds') + 1])
+    counts = [1, 2, 4, 8, 16]
+    if '--devices' in sys.argv:
+        counts = [int(x) for x in sys.argv[sys.argv.index('--devices') + 1:]]
+    print '%s framing, %d Hz per device, %g s' % ('binary' if binary else 'text', RATE, seconds)
+    print '%8s %10s %10s %10s %8s %10s' % ('devices', 'sent', 'received', 'dropped B',
+                                           'errors', 'CPU %')
+    for count in counts:
+        sent, received, dropped, errors, cpu = run(count, binary, seconds)
+        print '%8d %10d %10d %10d %8d %10.1f' % (count, sent, received, dropped, errors, 100 * cpu)
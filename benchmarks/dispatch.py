@@ -0,0 +1,100 @@
+'''Measures DAQThread.process() on its own: records are decoded up front so
+    only the per-record dispatch is timed, once with the current table
+    driven process() and once with the dict-of-lambdas version it replaced.
+
+    python benchmarks/dispatch.py [capture_file]'''
+import sys
+from datetime import datetime
+from time import time
+
+from common import load_capture, CapturedSerial
+from daqthread import DAQThread
+from protocol import AutoDecoder
+
+
+class LegacyDAQThread(DAQThread):
+    '''process() as it was before the dispatch table, kept as the baseline'''
+
+    def __init__(self, *args, **kwargs):
+        super(LegacyDAQThread, self).__init__(*args, **kwargs)
+        self.first_drawable = 0
+        self.maxs = {'K': -1000, 'G': -1000, 'P': -1000, 'O': -1000}
+        self.mins = {'K': 10000, 'G': 10000, 'P': 10000, 'O': 10000}
+        self._appendix = {'S': self.t, 'K': self.ecg, 'G': self.edr,
+                          'F': self.hp, 'Q': self.sqr, 'I': self.integrated,
+                          'B': self.beats, 'P': self.bpm2, 'O': self.bpm1,
+                          'T': self.thresh_i_list, 'Y': self.thresh1_f_list,
+                          'W': self.beat_type, 'H': self.thresh2_f_list}
+
+        self._appendage = lambda x: {
+            'S': x, 'K': x, 'G': (x * 220 / (1024 - x) if x < 1024 else -1), 'F': x, 'Q': x,
+            'I': x, 'B': self.t_current + (x - self.samples) * 0.005,
+            'P': ((60000.0 / x) if x != 0 else -1),
+            'O': ((60000.0 / x) if x != 0 else -1),
+            'T': x, 'Y': x, 'W': x, 'H': x}
+
+    def process(self, prefix, value):
+        appendix = self._appendix
+        appendage = self._appendage
+
+        if prefix is None or value is None:
+            return
+        if prefix is 'S':
+            if not self.t:
+                self.samples = value
+                value = 0
+                self.start_time = datetime.utcnow()
+            else:
+                self.t_current = float(self.t[-1] + float(value - self.samples) / 200)
+                self.samples = value
+                value = self.t_current
+                if self.last_drawable is None:
+                    self.last_drawable = 0
+                    self.first_drawable = 0
+                else:
+                    self.last_drawable += 1
+                if self.t[self.first_drawable] < self.t[self.last_drawable] - self.t_drawable:
+                    self.first_drawable += 1
+
+        if self.samples is not None or prefix is 'S':
+            try:
+                appendix[prefix].append(appendage(value)[prefix])
+            except KeyError as e:
+                if prefix is 'N':
+                    if value:
+                        self.pulse_regular = True
+                    else:
+                        self.pulse_regular = False
+                if prefix is 'R':
+                    self.samples -= value
+
+        if prefix in self.maxs:
+            test_value = appendage(value)[prefix]
+            if test_value > self.maxs[prefix]:
+                self.maxs[prefix] = test_value
+            if test_value < self.mins[prefix]:
+                self.mins[prefix] = test_value
+
+
+def dispatch(cls, records):
+    daq = cls(source=CapturedSerial(''), record_dir=None)
+    daq.be_quiet()
+    process = daq.process
+    start = time()
+    for prefix, value in records:
+        process(prefix, value)
+    elapsed = time() - start
+    daq.store.close()
+    return elapsed
+
+
+if __name__ == '__main__':
+    data = load_capture(sys.argv[1] if len(sys.argv) > 1 else None)
+    records = AutoDecoder().feed(data)
+    print 'Dispatching %d records' % (len(records), )
+    results = list()
+    for label, cls in (('before', LegacyDAQThread), ('after', DAQThread)):
+        elapsed = min(dispatch(cls, records) for i in range(3))
+        results.append(elapsed)
+        print '  %-8s %8.3f s  %10.0f lines/s' % (label, elapsed, len(records) / elapsed)
+    print '  speedup  %8.2fx' % (results[0] / results[1], )
@@ -0,0 +1,36 @@
+'''Replays a serial capture through DAQThread's per-line and batched
+    ingestion paths and reports the throughput of each.
+
+    python benchmarks/ingest.py [capture_file]'''
+import sys
+from time import time
+
+from common import load_capture, CapturedSerial
+from daqthread import DAQThread
+
+
+def replay(data, batched, process):
+    daq = DAQThread(source=CapturedSerial(data), batched=batched, record_dir=None)
+    daq.be_quiet()
+    daq.ser.open()
+    if not process:
+        daq.process = lambda prefix, value: None
+    start = time()
+    while not daq.ser.exhausted():
+        if batched:
+            for prefix, value in daq.gather_batch():
+                daq.process(prefix, value)
+        else:
+            daq.process(*daq.gather_sample())
+    return time() - start
+
+
+if __name__ == '__main__':
+    data = load_capture(sys.argv[1] if len(sys.argv) > 1 else None)
+    line_count = data.count('\n')
+    print 'Replaying %d lines (%d bytes)' % (line_count, len(data))
+    for process in (False, True):
+        print 'ingest only' if not process else 'ingest + process'
+        for label, batched in (('readline()', False), ('batched', True)):
+            elapsed = replay(data, batched, process)
+            print '  %-12s %8.3f s  %10.0f lines/s' % (label, elapsed, line_count / elapsed)
@@ -0,0 +1,304 @@
+'''Checks that pantompkins.PanTompkins puts beats on the same samples as
+    the firmware and reports how much faster than real time it runs.
+
+    python benchmarks/pantompkins_conformance.py [capture_file]
+
+    With a capture of the serial port taken with binaryOutput enabled, the
+    firmware's own 'B' records are the reference. Without one, a synthetic
+    ECG is run through FirmwareModel, a line-by-line port of the ISR.'''
+import math
+import random
+import sys
+from collections import Counter
+from time import time
+
+from common import load_capture
+from pantompkins import PanTompkins, SAMPLE_RATE, U32, _int16, _long, _tdiv
+from protocol import AutoDecoder
+
+
+def roll(array, value):
+    array.insert(0, value)
+    array.pop()
+
+
+class FirmwareModel(object):
+    '''Sample-at-a-time transcription of ISR(TIMER1_COMPA_vect) and the
+        functions it calls, kept deliberately close to the C source.'''
+
+    def __init__(self):
+        self.sample_count = 0
+        self.last_R_sample = 0
+        self.beat_count = 0
+        self.ecg_sample = [0] * 13
+        self.low_pass = [0] * 33
+        self.high_pass = [0] * 5
+        self.diff = 0
+        self.last_diff = 0
+        self.squared = [0] * 30
+        self.integrated = [0, 0]
+        self.rr_intervals1 = [0] * 8
+        self.rr_intervals2 = [0] * 8
+        self.average_RR1 = 950
+        self.average_RR2 = 1000
+        self.max_slope = 0
+        self.prior_max_slope = 0
+        self.is_rising_i = False
+        self.was_rising_i = True
+        self.thresh1_i = 30000
+        self.thresh2_i = 15000
+        self.npk_i = 15000
+        self.spk_i = 70000
+        self.candidate_peak_index_i = 0
+        self.candidate_peak_val_i = [15000, 688]
+        self.thresh1_f = 1375
+        self.thresh2_f = 688
+        self.npk_f = 2500
+        self.spk_f = 1000
+        self.candidate_peak_index_f = 0
+        self.candidate_peak_val_f = [15000, 688]
+        self.peak_type = -1
+        self.intervals_skipped = 0
+        self.beats = list()
+
+    def isr(self, ecg):
+        self.is_rising_i = False
+        peak_found_i = False
+        beat_happened_i = False
+        peak_found_f = False
+        beat_happened_f = False
+
+        roll(self.ecg_sample, ecg)
+        self.sample_count += 1
+        x, lp, hp = self.ecg_sample, self.low_pass, self.high_pass
+        roll(lp, 2 * lp[0] - lp[1] + x[0] - 2 * x[6] + x[12])
+        roll(hp, hp[0] + lp[16] - lp[17] + _tdiv(lp[32] - lp[0], 32))
+        self.last_diff = self.diff
+        self.diff = 2 * hp[0] + hp[1] - hp[3] - 2 * hp[4]
+        roll(self.squared, (_long(self.diff * self.diff) & U32) // 64)
+        if self.squared[0] > self.max_slope:
+            self.max_slope = self.squared[0]
+        self.integrated[1] = self.integrated[0]
+        self.integrated[0] = sum(self.squared) // 30
+
+        if self.last_diff > 0 and self.diff < 0 and self.sample_count > 60:
+            peak_found_f = True
+            peak_val_f = hp[1]
+        if peak_found_f:
+            if peak_val_f >= self.thresh1_f:
+                self.spk_f = _tdiv(peak_val_f + 7 * self.spk_f, 8)
+                beat_happened_f = True
+            else:
+                self.npk_f = _tdiv(peak_val_f + 7 * self.npk_f, 8)
+                if peak_val_f & U32 > self.candidate_peak_val_f[1]:
+                    self.candidate_peak_val_f[0] = self.integrated[1]
+                    self.candidate_peak_val_f[1] = peak_val_f & U32
+                    self.candidate_peak_index_f = self.sample_count
+            self.update_thresh_f()
+
+        self.was_rising_i = self.is_rising_i
+        if self.integrated[0] >= self.integrated[1]:
+            self.is_rising_i = True
+        if self.was_rising_i and not self.is_rising_i and self.sample_count > 60:
+            peak_found_i = True
+            peak_val_i = self.integrated[1]
+        if peak_found_i:
+            if peak_val_i >= self.thresh1_i:
+                self.spk_i = ((peak_val_i + 7 * self.spk_i) & U32) // 8
+                beat_happened_i = True
+            else:
+                self.npk_i = ((peak_val_i + 7 * self.npk_i) & U32) // 8
+                if peak_val_i > self.candidate_peak_val_i[0]:
+                    self.candidate_peak_val_i = [peak_val_i, hp[1] & U32]
+                    self.candidate_peak_index_i = self.sample_count
+            self.update_thresh_i()
+
+        if self.sample_count > self.last_R_sample + 40:
+            if (self.sample_count < self.last_R_sample + 72 and
+                    self.max_slope < self.prior_max_slope // 2):
+                beat_happened_i = False
+                beat_happened_f = False
+            if ((beat_happened_f and self.integrated[0] > self.thresh1_i) or
+                    (beat_happened_i and hp[0] > self.thresh1_f)):
+                self.beat_happened(self.sample_count, 0)
+
+        if ((((self.sample_count - self.last_R_sample) & U32) * 500) & U32 >
+                (166 * self.average_RR2) & U32):
+            if self.candidate_peak_index_f != 0 and self.candidate_peak_index_i != 0:
+                offset = _int16(self.candidate_peak_index_i - self.candidate_peak_index_f)
+                if offset * offset < 100:
+                    self.beat_found_on_lookback(
+                        (self.candidate_peak_index_i + self.candidate_peak_index_f) // 2, 1,
+                        self.candidate_peak_val_i[0], self.candidate_peak_val_f[1])
+            else:
+                if self.candidate_peak_index_i != 0 and self.candidate_peak_val_i[1] > self.thresh2_f:
+                    self.beat_found_on_lookback(self.candidate_peak_index_i, 2,
+                                                self.candidate_peak_val_i[0],
+                                                self.candidate_peak_val_i[1])
+                if self.candidate_peak_index_f != 0 and self.candidate_peak_val_f[0] > self.thresh2_i:
+                    self.beat_found_on_lookback(self.candidate_peak_index_f, 3,
+                                                self.candidate_peak_val_f[0],
+                                                self.candidate_peak_val_f[1])
+
+        if self.sample_count > self.last_R_sample + 1000:
+            self.timeout_reset()
+
+    def timeout_reset(self):
+        self.sample_count = 0
+        self.last_R_sample = 0
+        self.beat_count = 0
+        self.average_RR2 = 1000
+        self.average_RR1 = 950
+        self.rr_intervals1 = [0] * 8
+        self.rr_intervals2 = [0] * 8
+        self.ecg_sample = [0] * 13
+        self.low_pass = [0] * 33
+        self.high_pass = [0] * 5
+        self.squared = [0] * 30
+        self.integrated = [0, 0]
+        self.thresh1_i = 9000
+        self.thresh2_i = 4500
+        self.spk_i = 9000
+        self.npk_i = 1500
+        self.thresh1_f = 1375
+        self.thresh2_f = 688
+        self.spk_f = 2500
+        self.npk_f = 1000
+        self.last_diff = 0
+        self.prior_max_slope = 0
+
+    def update_thresh_f(self):
+        self.thresh1_f = self.npk_f + _tdiv(self.spk_f - self.npk_f, 2)
+        self.thresh2_f = self.npk_f
+
+    def update_thresh_i(self):
+        self.thresh1_i = (self.npk_i + ((self.spk_i - self.npk_i) & U32) // 4) & U32
+        self.thresh2_i = self.thresh1_i // 2
+
+    def beat_happened(self, at_sample, peak_type):
+        if at_sample > self.last_R_sample + 40:
+            self.beat_count += 1
+            self.peak_type = peak_type
+            if self.beat_count > 1:
+                self.update_RR_averages(_int16(((at_sample - self.last_R_sample) & U32) * 5))
+            if self.beat_count > 100:
+                self.beat_count = 10
+            self.last_R_sample = at_sample
+            self.prior_max_slope = self.max_slope
+            self.max_slope = 0
+            self.candidate_peak_index_f = 0
+            self.candidate_peak_val_f = [0, self.thresh2_f & U32]
+            self.candidate_peak_index_i = 0
+            self.candidate_peak_val_i = [self.thresh2_i, 0]
+            self.beats.append((at_sample, peak_type))
+
+    def beat_found_on_lookback(self, at_sample, peak_type, peak_val_i, peak_val_f):
+        self.beat_happened(at_sample, peak_type)
+        self.spk_i = ((_long(peak_val_i) + 3 * self.spk_i) & U32) // 4
+        self.update_thresh_i()
+        self.spk_f = _tdiv(_long(peak_val_f) + 3 * self.spk_f, 4)
+        self.update_thresh_f()
+
+    def update_RR_averages(self, current):
+        total = 0
+        count = 0
+        for i in range(7, 0, -1):
+            self.rr_intervals1[i] = self.rr_intervals1[i - 1]
+            if self.rr_intervals1[i] != 0:
+                total += self.rr_intervals1[i]
+                count += 1
+        self.rr_intervals1[0] = current
+        self.average_RR1 = _int16(_tdiv(total + current, count + 1))
+
+        total = 0
+        count = 0
+        if self.beat_count == 2:
+            self.average_RR2 = current
+            self.rr_intervals2[0] = current
+        elif (_int16(current * 100) > _int16(92 * self.average_RR2) and
+              _int16(current * 100) < _int16(116 * self.average_RR2)):
+            for i in range(7, 0, -1):
+                self.rr_intervals2[i] = self.rr_intervals2[i - 1]
+                if self.rr_intervals2[i] != 0:
+                    total += self.rr_intervals2[i]
+                    count += 1
+            self.rr_intervals2[0] = current
+            self.average_RR2 = _int16(_tdiv(total + current, count + 1))
+            self.intervals_skipped = 0
+        else:
+            self.intervals_skipped += 1
+            if self.intervals_skipped > 3:
+                self.average_RR2 = _int16(_tdiv(
+                    _int16(self.average_RR2 + _int16(3 * self.average_RR1)), 4))
+                self.rr_intervals2[0] = 0
+                self.intervals_skipped = 2
+
+
+def synthetic_ecg(seconds, seed=1):
+    '''Raw K samples: PQRST complexes with a wandering heart rate, baseline
+        drift, noise and two lead-off stretches long enough to force the
+        firmware's timeout reset.'''
+    rng = random.Random(seed)
+    n = int(seconds * SAMPLE_RATE)
+    ecg = [0.0] * n
+    waves = ((-0.2, 0.09, 0.025, 25), (-0.04, -0.1, 0.01, 0),
+             (0, 1.0, 0.012, 0), (0.035, -0.25, 0.012, 0), (0.25, 0.3, 0.04, 0))
+    t = 0.5
+    while t < seconds:
+        for offset, amplitude, width, _ in waves:
+            centre = t + offset
+            for i in range(max(0, int((centre - 4 * width) * SAMPLE_RATE)),
+                           min(n, int((centre + 4 * width) * SAMPLE_RATE) + 1)):
+                ecg[i] += 220 * amplitude * math.exp(-((i / float(SAMPLE_RATE) - centre) / width) ** 2)
+        t += 60.0 / (70 + 15 * math.sin(t / 20.0)) * rng.uniform(0.9, 1.1)
+    flat = [(int(n * 0.3), int(n * 0.3) + 1500), (int(n * 0.7), int(n * 0.7) + 2500)]
+    return [0 if any(a <= i < b for a, b in flat) else
+            int(ecg[i] + 30 * math.sin(i / 300.0) + rng.gauss(0, 4))
+            for i in range(n)]
+
+
+def from_capture(data):
+    '''Raw K samples and firmware beat sample numbers from a capture,
+        restricted to the part before the first gap in the sample counter.'''
+    ecg = list()
+    beats = list()
+    last = None
+    for prefix, value in AutoDecoder().feed(data):
+        if prefix == 'S':
+            if last is not None and value != last + 1:
+                break
+            last = value
+        elif prefix == 'K':
+            ecg.append(value)
+        elif prefix == 'B':
+            beats.append(value)
+    return ecg, beats
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        ecg, expected = from_capture(load_capture(sys.argv[1]))
+        # the capture starts mid-session, skip beats found while settling
+        warm_up = 10
+    else:
+        ecg = synthetic_ecg(900)
+        firmware = FirmwareModel()
+        start = time()
+        for value in ecg:
+            firmware.isr(value)
+        print 'Firmware model: %.1fx real time' % (
+            len(ecg) / float(SAMPLE_RATE) / (time() - start), )
+        expected = [sample for sample, _ in firmware.beats]
+        warm_up = 0
+    for chunk in (len(ecg), 40, 7):
+        detector = PanTompkins()
+        found = list()
+        start = time()
+        for i in range(0, len(ecg), chunk):
+            found.extend(beat.sample for beat in detector.feed(ecg[i:i + chunk]))
+        elapsed = time() - start
+        # sample numbers repeat after a timeout reset, so compare as multisets
+        matched = sum((Counter(expected[warm_up:]) & Counter(found)).values())
+        print 'chunk %6d: %5d/%d beats match, %d extra, %.0fx real time' % (
+            chunk, matched, len(expected[warm_up:]), len(found) - matched,
+            len(ecg) / float(SAMPLE_RATE) / elapsed)
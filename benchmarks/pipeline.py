@@ -0,0 +1,215 @@
+'''Stress test of DAQThread's reading under GUI load: a recorded session
+    is replayed into a pseudo-terminal faster than real time while a
+    thread stands in for the wx redraw, and the samples lost with and
+    without the two stage pipeline (see reader.py) are compared.
+
+    python benchmarks/pipeline.py [--text] [--seconds N] [--speed X]
+                                  [--fps N] [--load MS] [--stall MS]
+
+    The replay is produced by ReplaySource up front and written by a
+    separate process every 10 ms like a UART; a write that does not fit in
+    the pty's buffer is counted as dropped, as the UART would drop it. The
+    load thread draws --fps frames a second, each one updating a LiveTrace
+    and then running --load ms of pure Python, which holds the GIL the way
+    matplotlib does. Separately, processing stalls for --stall ms once a
+    second, like a slow write to the SD card. Beforehand the session is
+    replayed once from the middle of its first sample, which must leave
+    every channel as long as the time channel.'''
+from datetime import datetime
+from multiprocessing import Process, Queue
+import errno
+import fcntl
+import os
+import re
+import shutil
+import sys
+import tempfile
+from threading import Thread
+from time import sleep, time
+
+import common  # puts the repository on sys.path
+from common import CapturedSerial
+from daqthread import DAQThread
+from protocol import AutoDecoder, FRAME
+from render import LiveTrace
+from session import SessionWriter
+from sources import PtySource, ReplaySource, SyntheticSource
+
+RATE = 200
+TICK = 0.01
+# one value per sample, so as long as the time channel
+ROW_CHANNELS = ('ecg', 'edr', 'bpm1', 'bpm2', 'hp', 'sqr', 'integrated', 'thresh_i',
+                'thresh1_f', 'thresh2_f')
+
+
+def record(path, seconds):
+    '''Records ``seconds`` of SyntheticSource into a session at path'''
+    source = SyntheticSource(rate=None, binary=True, chunk=RATE)
+    source.open()
+    writer = SessionWriter(path, datetime.utcnow())
+    decoder = AutoDecoder()
+    while source.sent < seconds * RATE:
+        for prefix, value in decoder.feed(source.read(source.inWaiting())):
+            writer.record(prefix, value)
+    writer.close()
+
+
+def replay(path, binary):
+    '''Bytes of a whole session as ReplaySource sends them and the offset
+        at which each sample ends'''
+    source = ReplaySource(path, speed=None, binary=binary)
+    source.open()
+    chunks = list()
+    while not source.exhausted():
+        chunks.append(source.read(source.inWaiting()))
+    data = ''.join(chunks)
+    if binary:
+        ends = range(FRAME.size, len(data) + 1, FRAME.size)
+    else:
+        ends = [match.start() + 2 for match in re.finditer('\r\nS', data)] + [len(data)]
+    return data, ends
+
+
+def feed(fd, data, ends, rate, results):
+    '''Writes ``rate`` samples a second to fd, dropping what does not fit'''
+    fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+    sent = 0
+    dropped = 0
+    start = time()
+    tick = 0
+    while sent + dropped < len(data):
+        tick += 1
+        due = min(int(tick * TICK * rate), len(ends))
+        chunk = data[sent + dropped:ends[due - 1]]
+        written = 0
+        try:
+            written = os.write(fd, chunk)
+        except OSError as e:
+            if e.errno != errno.EAGAIN:
+                raise
+        sent += written
+        dropped += len(chunk) - written
+        sleep(max(0, start + tick * TICK - time()))
+    results.put((sent, dropped))
+
+
+def misaligned(path, binary):
+    '''Replays the session starting in the middle of its first sample,
+        as when the port is opened while the Arduino is already sending,
+        and returns the channels whose length differs from the time
+        channel'''
+    data, ends = replay(path, binary)
+    start = FRAME.size // 2 if binary else data.index('\n') + 1
+    source = CapturedSerial(data[start:])
+    daq = DAQThread(source=source, record_dir=None)
+    daq.be_quiet()
+    daq.start()
+    while not source.exhausted():
+        sleep(0.1)
+    sleep(0.5)
+    daq.stop()
+    return [name for name in ROW_CHANNELS if len(daq.store[name]) != len(daq.t)]
+
+
+class StallingDAQThread(DAQThread):
+    def __init__(self, stall, *args, **kwargs):
+        super(StallingDAQThread, self).__init__(*args, **kwargs)
+        self.stall = stall
+        self._next_stall = time() + 1
+
+    def _process_sample(self, value):
+        super(StallingDAQThread, self)._process_sample(value)
+        if self.stall and time() >= self._next_stall:
+            sleep(self.stall)
+            self._next_stall = time() + 1
+
+
+class Load(Thread):
+    def __init__(self, daq, fps, load):
+        super(Load, self).__init__()
+        self.daemon = True
+        self.daq = daq
+        self.fps = fps
+        self.load = load
+        self.keep_running = True
+        self.frames = 0
+
+    def run(self):
+        trace = LiveTrace(['ecg', 'bpm2', 'edr'], 13)
+        interval = 1.0 / self.fps
+        while self.keep_running:
+            start = time()
+            trace.update(self.daq)
+            for name in trace.names:
+                trace.visible(name, 600)
+            x = 0
+            while time() - start < self.load:
+                for i in xrange(1000):
+                    x += i
+            self.frames += 1
+            sleep(max(0, start + interval - time()))
+
+
+def run(path, binary, speed, fps, load, stall, pipelined):
+    pty = PtySource()
+    daq = StallingDAQThread(stall / 1000.0, source=pty, record_dir=None, pipelined=pipelined)
+    daq.be_quiet()
+    data, ends = replay(path, binary)
+    results = Queue()
+    feeder = Process(target=feed, args=(pty._slave, data, ends, RATE * speed, results))
+    daq.start()
+    gui = Load(daq, fps, load / 1000.0)
+    gui.start()
+    feeder.start()
+    written, dropped = results.get()
+    feeder.join()
+    sleep(1)
+    gui.keep_running = False
+    gui.join()
+    daq.stop()
+    stats = daq.stats()
+    pty.shutdown()
+    return (len(ends), stats['samples'], dropped, stats['overflow_bytes'],
+            stats['parse_errors'], 1000 * stats['processing'].percentile(99), gui.frames)
+
+
+if __name__ == '__main__':
+    binary = '--text' not in sys.argv
+    seconds = 60
+    if '--seconds' in sys.argv:
+        seconds = float(sys.argv[sys.argv.index('--seconds') + 1])
+    speed = 4.0
+    if '--speed' in sys.argv:
+        speed = float(sys.argv[sys.argv.index('--speed') + 1])
+    fps = 10
+    if '--fps' in sys.argv:
+        fps = float(sys.argv[sys.argv.index('--fps') + 1])
+    scenarios = [(0, 0), (90, 0), (0, 800), (90, 800)]
+    if '--load' in sys.argv or '--stall' in sys.argv:
+        load = stall = 0
+        if '--load' in sys.argv:
+            load = float(sys.argv[sys.argv.index('--load') + 1])
+        if '--stall' in sys.argv:
+            stall = float(sys.argv[sys.argv.index('--stall') + 1])
+        scenarios = [(load, stall)]
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, 'session')
+        record(path, seconds)
+        print '%g s of %s replayed at %gx, %g fps' % (
+            seconds, 'binary frames' if binary else 'text', speed, fps)
+        channels = misaligned(path, binary)
+        print 'Started mid-sample: %s' % (
+            'misaligned %s' % (', '.join(channels), ) if channels else 'every channel aligned', )
+        print '%8s %9s %10s %8s %10s %10s %10s %8s %12s' % (
+            'load ms', 'stall ms', 'mode', 'sent', 'received', 'dropped B', 'overflow B',
+            'errors', 'proc p99 ms')
+        for load, stall in scenarios:
+            for pipelined in (False, True):
+                sent, received, dropped, overflow, errors, latency, frames = run(
+                    path, binary, speed, fps, load, stall, pipelined)
+                print '%8g %9g %10s %8d %10d %10d %10d %8d %12.1f' % (
+                    load, stall, 'pipelined' if pipelined else 'direct', sent, received,
+                    dropped, overflow, errors, latency)
+    finally:
+        shutil.rmtree(directory)
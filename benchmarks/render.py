@@ -0,0 +1,109 @@
+'''Measures the cost of preparing one GUI frame as a session grows, for
+    the list based frame onRedraw used to build, the full-window snapshot
+    and render.LiveTrace.
+
+    python benchmarks/render.py [--draw]
+
+    Records at the full 200 Hz are fed straight into DAQThread.process();
+    at each session length a tenth of a second of new data arrives before
+    every frame, like the wx.Timer in main.py at 10 fps. With --draw the
+    three traces are also rendered with matplotlib's Agg backend.'''
+import sys
+from time import time
+
+from common import synthetic_capture, CapturedSerial
+from daqthread import DAQThread
+from protocol import AutoDecoder
+from render import LiveTrace
+
+NAMES = ('ecg', 'bpm2', 'edr')
+WINDOW = 13
+WIDTH = 600
+FRAMES = 50
+
+
+class Canvas(object):
+    def __init__(self):
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        self.fig = Figure((8, 6), 75)
+        self.canvas = FigureCanvasAgg(self.fig)
+        self.lines = [self.fig.add_subplot(3, 1, i).plot([0], [0])[0] for i in (1, 2, 3)]
+
+    def draw(self, data):
+        for line, (t, y) in zip(self.lines, data):
+            line.set_data(t, y)
+        self.canvas.draw()
+
+
+def list_frame(daq, state):
+    '''Python lists over the window and a scan of every beat and mark'''
+    snapshot = daq.snapshot(NAMES, WINDOW)
+    t_max = snapshot.last('time')
+    drawable_time = [x - t_max for x in snapshot.time]
+    t_cutoff = t_max - WINDOW
+    beats = [(x - t_max, 1) for x in daq.beats if x > t_cutoff]
+    marks = [(x - t_max, 1) for x in daq.mark_times if x > t_cutoff]
+    return [(drawable_time, list(snapshot.channels[name])) for name in NAMES]
+
+
+def full_frame(daq, state):
+    snapshot = daq.snapshot(NAMES, WINDOW)
+    t_max = snapshot.last('time')
+    drawable_time = snapshot.time - t_max
+    return [(drawable_time, snapshot.channels[name]) for name in NAMES]
+
+
+def live_frame(daq, state):
+    trace = state.setdefault('trace', LiveTrace(NAMES, WINDOW))
+    trace.update(daq)
+    t_max = trace.last('time')
+    data = list()
+    for name in NAMES:
+        t, y = trace.visible(name, WIDTH)
+        data.append((t - t_max, y))
+    return data
+
+
+def measure(frame, records, rows, lengths, canvas):
+    '''Mean ms per frame once the session is each of ``lengths`` seconds
+        long; ``rows`` holds the index in records of every 'S' '''
+    daq = DAQThread(source=CapturedSerial(''), record_dir=None)
+    daq.be_quiet()
+    fed = 0
+    state = dict()
+    results = list()
+    for seconds in lengths:
+        row = seconds * 200
+        for prefix, value in records[fed:rows[row]]:
+            daq.process(prefix, value)
+        fed = rows[row]
+        daq.add_mark()
+        elapsed = 0.0
+        for i in range(FRAMES):
+            row += 20
+            for prefix, value in records[fed:rows[row]]:
+                daq.process(prefix, value)
+            fed = rows[row]
+            start = time()
+            data = frame(daq, state)
+            if canvas is not None:
+                canvas.draw(data)
+            elapsed += time() - start
+        results.append(1000 * elapsed / FRAMES)
+    daq.store.close()
+    return results
+
+
+if __name__ == '__main__':
+    canvas = Canvas() if '--draw' in sys.argv else None
+    lengths = [60, 600, 1800]
+    records = AutoDecoder().feed(synthetic_capture(lengths[-1] + FRAMES, step=1))
+    rows = [i for i, (prefix, value) in enumerate(records) if prefix == 'S']
+    print 'ms per frame at 200 samples/s, %d s window, %d px%s' % (
+        WINDOW, WIDTH, ', Agg rendering' if canvas else '')
+    print '%10s %12s %12s %12s' % ('session', 'lists', 'snapshot', 'LiveTrace')
+    results = [measure(frame, records, rows, lengths, canvas)
+               for frame in (list_frame, full_frame, live_frame)]
+    for seconds, a, b, c in zip(lengths, *results):
+        print '%8d s %12.2f %12.2f %12.2f' % (seconds, a, b, c)
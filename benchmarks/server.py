@@ -0,0 +1,109 @@
+'''Load test for server.StreamServer: many local clients subscribe to a
+    synthetic 200 Hz device and the fan-out latency is measured.
+
+    python benchmarks/server.py [--seconds N] [--clients N ...]
+
+    The clients run in a separate process and take the time from the
+    server's ``stamp`` to the arrival of each data message. Half of them
+    subscribe to everything, half to a decimated ECG trace. One extra
+    client subscribes and never reads, it should be disconnected without
+    affecting the others.'''
+from multiprocessing import Process, Queue
+import json
+import select
+import socket
+import sys
+from time import time
+
+import numpy as np
+
+import common  # puts the repository on sys.path
+from daqthread import DAQThread
+from server import StreamServer
+from sources import SyntheticSource
+
+
+def subscribe(port, request):
+    sock = socket.create_connection(('127.0.0.1', port))
+    sock.sendall(json.dumps(request) + '\n')
+    return sock
+
+
+def clients(port, count, seconds, results):
+    socks = list()
+    for i in range(count):
+        if i % 2:
+            request = {'subscribe': ['ecg'], 'decimate': 4}
+        else:
+            request = {'subscribe': ['ecg', 'edr', 'bpm1', 'bpm2']}
+        socks.append(subscribe(port, request))
+    buffers = dict((sock, '') for sock in socks)
+    latencies = list()
+    messages = 0
+    dropped = 0
+    # the first second drains what queued up while connecting
+    start = time() + 1
+    end = start + seconds
+    while time() < end:
+        for sock in select.select(socks, [], [], 0.1)[0]:
+            data = sock.recv(65536)
+            now = time()
+            if not data:
+                socks.remove(sock)
+                continue
+            buffers[sock] += data
+            lines = buffers[sock].split('\n')
+            buffers[sock] = lines.pop()
+            for line in lines:
+                message = json.loads(line)
+                if now < start:
+                    continue
+                if message['type'] == 'data':
+                    latencies.append(now - message['stamp'])
+                    messages += 1
+                elif message['type'] == 'dropped':
+                    dropped += message['messages']
+    for sock in socks:
+        sock.close()
+    results.put((messages, latencies, dropped))
+
+
+def run(count, seconds):
+    daq = DAQThread(source=SyntheticSource(binary=True), record_dir=None)
+    daq.be_quiet()
+    server = StreamServer({'synthetic': daq}, port=0, drop_after=2.0)
+    server.be_quiet()
+    daq.start()
+    server.start()
+    stalled = subscribe(server.port, {'subscribe': ['ecg', 'edr', 'bpm1', 'bpm2']})
+    stalled.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+    results = Queue()
+    process = Process(target=clients, args=(server.port, count, seconds, results))
+    process.start()
+    messages, latencies, dropped = results.get()
+    process.join()
+    server.stop()
+    daq.keep_running = False
+    daq.join()
+    daq.store.close()
+    stalled.close()
+    latencies = 1000 * np.array(latencies or [0])
+    return (messages / float(count * seconds), np.percentile(latencies, 50),
+            np.percentile(latencies, 99), latencies.max(), dropped,
+            server.disconnected > 0)
+
+
+if __name__ == '__main__':
+    seconds = 5
+    if '--seconds' in sys.argv:
+        seconds = float(sys.argv[sys.argv.index('--seconds') + 1])
+    counts = [1, 10, 50, 100, 200]
+    if '--clients' in sys.argv:
+        counts = [int(x) for x in sys.argv[sys.argv.index('--clients') + 1:]]
+    print '200 Hz synthetic device, 20 publishes/s, %g s per run' % (seconds, )
+    print '%8s %10s %9s %9s %9s %8s %8s' % ('clients', 'msgs/s', 'p50 ms', 'p99 ms',
+                                            'max ms', 'dropped', 'stalled')
+    for count in counts:
+        rate, p50, p99, worst, dropped, disconnected = run(count, seconds)
+        print '%8d %10.1f %9.2f %9.2f %9.2f %8d %8s' % (
+            count, rate, p50, p99, worst, dropped, 'dropped' if disconnected else 'kept')
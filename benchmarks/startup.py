@@ -0,0 +1,95 @@
+'''Time from starting Python to the first published sample, for the
+    headless and GUI entry points.
+
+    python benchmarks/startup.py [--runs N]
+
+    Every run starts a fresh interpreter that imports the entry point
+    module (its __main__ block does not run), then acquires from a
+    SyntheticSource the way that entry point does until the first sample
+    is published. 'eager' adds the imports DAQThread used to make at
+    startup (matplotlib.pyplot on Agg, export) for comparison. The GUI
+    row needs wx and is skipped without it; it stops short of creating
+    the window, which needs a display.'''
+import os
+import subprocess
+import sys
+from time import time
+
+import common  # puts the repository on sys.path
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY = ('matplotlib', 'wx', 'multiprocessing', 'BaseHTTPServer', 'serial')
+
+CHILD = '''
+import os
+import sys
+from time import sleep, time
+sys.path.insert(0, %(root)r)
+%(preload)s
+import %(module)s
+imported = time()
+from sources import SyntheticSource
+%(start)s
+while daq.version == 0:
+    sleep(0.0005)
+print time(), imported, ' '.join(sorted(set(name.split('.')[0] for name in sys.modules
+                                            if name.split('.')[0] in %(heavy)r)))
+sys.stdout.flush()
+# the acquisition thread never stops on its own
+os._exit(0)
+'''
+
+HEADLESS = '''from devices import DeviceManager
+manager = DeviceManager(record_dir=None)
+manager.be_quiet()
+manager.add('synthetic', source=SyntheticSource(binary=True))
+daq = manager['synthetic']
+manager.start()'''
+
+GUI = '''from daqthread import DAQThread
+daq = DAQThread(source=SyntheticSource(binary=True), record_dir=None)
+daq.be_quiet()
+daq.start()'''
+
+EAGER = '''import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot
+import export'''
+
+ENTRY_POINTS = [('headless', 'headless', HEADLESS, ''),
+                ('headless eager', 'headless', HEADLESS, EAGER),
+                ('gui', 'main', GUI, '')]
+
+
+def run(module, start, preload):
+    '''(seconds to import, seconds to the first sample, heavy modules
+        loaded) or None when the entry point can not be imported'''
+    code = CHILD % {'root': ROOT, 'module': module, 'start': start, 'preload': preload,
+                    'heavy': HEAVY}
+    started = time()
+    child = subprocess.Popen([sys.executable, '-c', code], stdout=subprocess.PIPE,
+                             stderr=subprocess.PIPE)
+    out, err = child.communicate()
+    if child.returncode:
+        if 'ImportError' in err:
+            return None
+        raise RuntimeError(err)
+    fields = out.split()
+    first_sample, imported = float(fields[0]), float(fields[1])
+    return imported - started, first_sample - started, ' '.join(fields[2:])
+
+
+if __name__ == '__main__':
+    runs = 5
+    if '--runs' in sys.argv:
+        runs = int(sys.argv[sys.argv.index('--runs') + 1])
+    print 'best of %d runs, SyntheticSource at 200 Hz' % (runs, )
+    print '%-16s %10s %14s  %s' % ('entry point', 'import s', 'first sample s', 'heavy modules')
+    for label, module, start, preload in ENTRY_POINTS:
+        results = [run(module, start, preload) for i in range(runs)]
+        if None in results:
+            print '%-16s %10s %14s' % (label, '-', '-'), ' %s not importable here' % (module, )
+            continue
+        imported = min(result[0] for result in results)
+        first_sample = min(result[1] for result in results)
+        print '%-16s %10.3f %14.3f  %s' % (label, imported, first_sample, results[0][2] or '-')
@@ -0,0 +1,288 @@
+from collections import namedtuple
+import os
+import numpy as np
+
+DEFAULT_RETENTION = 2 ** 16
+PYRAMID_FACTOR = 8
+PYRAMID_LEVELS = 3  # buckets of 8, 64 and 512 samples
+PYRAMID_CAPACITY = 2 ** 15  # buckets per level, 512 samples cover 23 hours at 200 Hz
+
+
+class RingBuffer(object):
+    '''Preallocated, typed storage for a single channel.
+
+    Indexing is by absolute sample number: ``len()`` is the number of
+    values ever appended, but only the newest ``capacity`` are retained.
+    Every value is written twice (at ``i`` and ``i + capacity``) so that any
+    retained range is contiguous and can be returned as a view.'''
+
+    def __init__(self, capacity, dtype=np.float64, spill=None):
+        self.capacity = int(capacity)
+        self.dtype = np.dtype(dtype)
+        self._data = np.zeros(2 * self.capacity, dtype=self.dtype)
+        self._count = 0
+        self.spill_path = spill
+        self._spill = None
+        self._spilled = 0
+        self._spill_block = max(1, self.capacity // 4)
+        if spill is not None:
+            self._spill = open(spill, 'wb')
+
+    def append(self, value):
+        pos = self._count % self.capacity
+        self._data[pos] = value
+        self._data[pos + self.capacity] = value
+        self._count += 1
+        if self._spill is not None and self._count - self._spilled >= self._spill_block:
+            self._write_spill()
+
+    def extend(self, values):
+        '''Appends a sequence of values with a few slice assignments
+            instead of one append() per value'''
+        values = np.asarray(values, dtype=self.dtype)
+        step = self.capacity if self._spill is None else self._spill_block
+        for i in range(0, len(values), step):
+            self._extend(values[i:i + step])
+
+    def _extend(self, values):
+        count = len(values)
+        pos = self._count % self.capacity
+        head = min(count, self.capacity - pos)
+        self._data[pos:pos + head] = values[:head]
+        self._data[pos + self.capacity:pos + self.capacity + head] = values[:head]
+        tail = count - head
+        if tail:
+            self._data[:tail] = values[head:]
+            self._data[self.capacity:self.capacity + tail] = values[head:]
+        self._count += count
+        if self._spill is not None and self._count - self._spilled >= self._spill_block:
+            self._write_spill()
+
+    def _write_spill(self):
+        '''Writes everything not yet on disk; always called before the
+            oldest unspilled value can be overwritten.'''
+        self[self._spilled:self._count].tofile(self._spill)
+        self._spilled = self._count
+
+    @property
+    def first(self):
+        '''Absolute index of the oldest value still held in memory'''
+        return max(0, self._count - self.capacity)
+
+    @property
+    def available_from(self):
+        '''Absolute index of the oldest value that history() can return'''
+        if self.spill_path is not None:
+            return 0
+        return self.first
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            if key.step not in (None, 1):
+                raise ValueError('RingBuffer slices do not support a step')
+            start, stop = key.start, key.stop
+            if start is None:
+                start = self.first
+            elif start < 0:
+                start += self._count
+            if stop is None:
+                stop = self._count
+            elif stop < 0:
+                stop += self._count
+            start = max(start, self.first)
+            stop = min(stop, self._count)
+            pos = start % self.capacity
+            return self._data[pos:pos + max(0, stop - start)]
+        if key < 0:
+            key += self._count
+        if key < self.first or key >= self._count:
+            raise IndexError('RingBuffer index out of retained range')
+        return self._data[key % self.capacity]
+
+    def history(self, start=0, stop=None):
+        '''Returns the values in [start, stop), reading spilled data from
+            disk when the range reaches past what is held in memory.'''
+        if stop is None:
+            stop = self._count
+        start = max(start, self.available_from)
+        if start >= self.first or self.spill_path is None:
+            return self[start:stop]
+        if self._spill is not None:
+            self._spill.flush()
+        on_disk = np.memmap(self.spill_path, dtype=self.dtype, mode='r',
+                            shape=(self._spilled,))
+        older = on_disk[start:min(stop, self._spilled)]
+        if stop <= self._spilled:
+            return older
+        return np.concatenate((older, self[self._spilled:stop]))
+
+    def close(self):
+        '''Writes any unspilled values and closes the spill file'''
+        if self._spill is not None:
+            self._write_spill()
+            self._spill.close()
+            self._spill = None
+
+
+# buckets of ``size`` samples, bucket i starting at sample i * size
+Level = namedtuple('Level', ['size', 'low', 'high', 'mean'])
+
+
+class Pyramid(object):
+    '''Minimum, maximum and mean of a RingBuffer over ever larger buckets
+        (8, 64 and 512 samples by default), so any stretch of a long
+        session can be drawn from a few thousand values whatever is still
+        retained. update() adds the buckets completed since the last call
+        a whole level at a time, each level built from the one below.'''
+
+    def __init__(self, source, factor=PYRAMID_FACTOR, levels=PYRAMID_LEVELS,
+                 capacity=PYRAMID_CAPACITY):
+        self.source = source
+        self.factor = factor
+        self.levels = [Level(factor ** (i + 1), RingBuffer(capacity), RingBuffer(capacity),
+                             RingBuffer(capacity))
+                       for i in range(levels)]
+
+    def update(self):
+        count = len(self.source)
+        if count - len(self.levels[0].mean) * self.factor < self.factor:
+            return
+        below = None
+        for level in self.levels:
+            done = len(level.mean)
+            if below is None:
+                new = count // level.size - done
+            else:
+                new = len(below.mean) // self.factor - done
+            if new <= 0:
+                break
+            start = done * self.factor
+            stop = start + new * self.factor
+            if below is None:
+                low = high = mean = self._raw(start, stop)
+            else:
+                low, high, mean = [self._below(data, start, stop)
+                                   for data in (below.low, below.high, below.mean)]
+            level.low.extend(low.reshape(new, self.factor).min(axis=1))
+            level.high.extend(high.reshape(new, self.factor).max(axis=1))
+            level.mean.extend(mean.reshape(new, self.factor).mean(axis=1))
+            below = level
+
+    def _raw(self, start, stop):
+        return self._below(self.source, start, stop).astype(np.float64)
+
+    def _below(self, data, start, stop):
+        '''data[start:stop], NaN where it is no longer retained'''
+        if start >= data.first:
+            return data[start:stop]
+        values = np.empty(stop - start, dtype=np.float64)
+        values.fill(np.nan)
+        first = min(data.first, stop)
+        values[first - start:] = data[first:stop]
+        return values
+
+    def _choices(self):
+        '''The source itself as a level of single samples, then the levels'''
+        raw = self.source
+        return [Level(1, raw, raw, raw)] + self.levels
+
+    def view(self, start, stop, columns):
+        '''(size, rows, low, high, mean) of at most ``columns`` buckets
+            covering samples start to stop, from the finest level that
+            needs no more than that; size is its samples per bucket and
+            rows the first sample of every bucket'''
+        columns = max(1, int(columns))
+        for level in self._choices():
+            if level.mean.first * level.size <= start and stop - start <= columns * level.size:
+                break
+        lo = max(start // level.size, level.mean.first)
+        hi = min(-(-stop // level.size), len(level.mean))
+        if hi <= lo:
+            empty = np.zeros(0)
+            return level.size, np.zeros(0, dtype=np.int64), empty, empty, empty
+        low, high, mean = [np.asarray(data[lo:hi], dtype=np.float64)
+                           for data in (level.low, level.high, level.mean)]
+        index = np.arange(lo, hi)
+        per = -(-(hi - lo) // columns)
+        if per > 1:
+            # still too many, merge neighbouring buckets
+            groups = np.arange(0, hi - lo, per)
+            sizes = np.diff(np.append(groups, hi - lo))
+            low = np.minimum.reduceat(low, groups)
+            high = np.maximum.reduceat(high, groups)
+            mean = np.add.reduceat(mean, groups) / sizes
+            index = index[groups]
+        return level.size, index * level.size, low, high, mean
+
+    def starts(self, size, rows):
+        '''The minimum of the buckets of ``size`` samples starting at
+            ``rows`` (ascending), which is their first value for a channel
+            that only rises, such as time. NaN where not retained.'''
+        level = [choice for choice in self._choices() if choice.size == size][0]
+        buckets = np.asarray(rows, dtype=np.int64) // size
+        values = np.repeat(np.nan, len(buckets))
+        kept = (buckets >= level.low.first) & (buckets < len(level.low))
+        if kept.any():
+            lo = buckets[kept][0]
+            values[kept] = level.low[lo:buckets[kept][-1] + 1][buckets[kept] - lo]
+        return values
+
+    def search(self, value):
+        '''For a channel that only rises: the first sample at or above
+            ``value`` while still retained, otherwise the first sample of
+            the first bucket of the finest level that still holds it'''
+        choices = self._choices()
+        for level in choices:
+            first = level.low.first
+            if len(level.low) > first and (level.low[first] <= value or level is choices[-1]):
+                data = level.low[first:]
+                return (first + int(np.searchsorted(data, value, 'left'))) * level.size
+        return 0
+
+
+class ChannelStore(object):
+    '''A named collection of RingBuffers sharing one retention window.
+        If spill_dir is given every channel is also appended to
+        ``<spill_dir>/<name>.bin`` so that the whole session can be
+        read back with RingBuffer.history(). Channels added with
+        pyramid=True also keep a Pyramid for drawing long stretches,
+        brought up to date by update_pyramids().'''
+
+    def __init__(self, retention=DEFAULT_RETENTION, spill_dir=None):
+        self.retention = retention
+        self.spill_dir = spill_dir
+        self.channels = dict()
+        self.pyramids = dict()
+        if spill_dir is not None and not os.path.isdir(spill_dir):
+            os.makedirs(spill_dir)
+
+    def add(self, name, dtype=np.float64, pyramid=False):
+        spill = None
+        if self.spill_dir is not None:
+            spill = os.path.join(self.spill_dir, '%s.bin' % (name, ))
+        self.channels[name] = RingBuffer(self.retention, dtype, spill)
+        if pyramid:
+            self.pyramids[name] = Pyramid(self.channels[name])
+        return self.channels[name]
+
+    def alias(self, name, existing):
+        '''Makes the channel ``existing`` available as ``name`` too'''
+        self.channels[name] = self.channels[existing]
+        return self.channels[name]
+
+    def update_pyramids(self):
+        for pyramid in self.pyramids.values():
+            pyramid.update()
+
+    def __getitem__(self, name):
+        return self.channels[name]
+
+    def __contains__(self, name):
+        return name in self.channels
+
+    def close(self):
+        for channel in self.channels.values():
+            channel.close()
@@ -1,51 +1,115 @@
-from datetime import datetime, timedelta
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
+from bisect import bisect_left
+from collections import namedtuple
+from datetime import datetime
+import os
+import numpy as np
 from threading import Thread
-import serial
+from time import time
+
+from channelstore import ChannelStore, DEFAULT_RETENTION
+from edr import EDRStage
+from events import EventAnalyzer
+from features import FeatureEngine
+from metrics import Metrics
+from protocol import AutoDecoder, edr_kohm, rr_to_bpm
+from reader import ByteRing, SerialReader
+from session import SessionWriter, session_path
+from sources import SerialSource
+from timebase import SAMPLE_RATE, Timebase
+
+
+class Snapshot(namedtuple('Snapshot', ['version', 'start', 'time', 'channels', 'beats',
+                                       'beat_types', 'marks', 'pulse_regular'])):
+    '''A consistent copy of the most recent complete samples. ``time`` and
+        every array in ``channels`` have the same length and hold the
+        samples numbered ``start`` up to ``version``, beats and marks are
+        the times of those reported by the same samples. ``version`` is the number of samples
+        published so far, so an unchanged version means an unchanged
+        snapshot.'''
+    __slots__ = ()
+
+    def last(self, name):
+        '''The newest value of a channel, or of 'time' '''
+        data = self.time if name == 'time' else self.channels[name]
+        if not len(data):
+            return 0
+        return data[-1]
+
 
 class DAQThread(Thread):
-    def __init__(self):
+    def __init__(self, port='/dev/ttyAMA0', retention=DEFAULT_RETENTION,
+                 spill_dir=None, batched=True, source=None, record_dir='sessions',
+                 pipelined=True):
         super(DAQThread, self).__init__()
-        self.hp = list()  # results of the hi-pass filter
-        self.sqr = list() # results of the squaring
-        self.integrated = list() # results of the integration
-        self.thresh_i_list = list()
-        self.thresh1_f_list = list()
-        self.thresh2_f_list = list()
-        self.t = list()
-        self.ecg = list()
-        self.edr = list()
-        self.bpm1 = list()
-        self.bpm2 = list()
-        self.maxs = {'K': -1000, 'G': -1000, 'P': -1000, 'O': -1000}
-        self.mins = {'K': 10000, 'G': 10000, 'P': 10000, 'O': 10000}
-        self.name_to_list = {'time': self.t, 'ecg': self.ecg, 'edr': self.edr,
-                             'bpm1': self.bpm1, 'bpm2': self.bpm2}
-        self.name_to_prefix = {'ecg': 'K', 'edr': 'G',
-                             'bpm1': 'P', 'bpm2': 'O'}
+        self.store = ChannelStore(retention=retention, spill_dir=spill_dir)
+        self.hp = self.store.add('hp', np.int64)  # results of the hi-pass filter
+        self.sqr = self.store.add('sqr', np.int64) # results of the squaring
+        self.integrated = self.store.add('integrated', np.int64) # results of the integration
+        self.thresh_i_list = self.store.add('thresh_i', np.int64)
+        self.thresh1_f_list = self.store.add('thresh1_f', np.int64)
+        self.thresh2_f_list = self.store.add('thresh2_f', np.int64)
+        self.t = self.store.add('time', pyramid=True)  # for overview()
+        self.ticks = self.store.add('tick', np.int64)  # 200 Hz samples since the first row
+        self.beat_count = self.store.add('beat_count', np.int64)  # len(beats) before each row
+        # with pyramids for overview()
+        self.ecg = self.store.add('ecg', np.int32, pyramid=True)
+        self.edr = self.store.add('edr', pyramid=True)
+        self.bpm1 = self.store.add('bpm1', pyramid=True)
+        self.bpm2 = self.store.add('bpm2', pyramid=True)
+        # conductance, tonic, phasic and responses, see edr.py
+        self.edr_stage = EDRStage(self.store, self.edr, self.t)
+        self.features = FeatureEngine(self.store, self.edr_stage)
+        self.timebase = Timebase(self.ticks)
         self.beats = list()
+        self.beat_ticks = list()
         self.beat_type = list()
         self.marks = list()
+        self.events = EventAnalyzer(self.t, self.bpm1, self.edr, timebase=self.timebase)
+        self.mark_times = self.events.times
         self.t_current = 0
-        self.first_drawable = 0
+        self.tick = 0
         self.last_drawable = None
-        self._first_drawable = 0
-        self._last_drawable = None
+        self._published = 0
         self.t_drawable = 12
         self.start_time = None
         self.samples = 0
         self.pulse_found = False
         self.pulse_regular = False
-        self._lock = False
         self.keep_running = True
         self.silent = False
         self._plot_all_data = False
+        self.batched = batched
+        self.pipelined = pipelined
+        self.ring = None
+        self.decoder = AutoDecoder()
+        self._bad_lines = 0
+        self.metrics = Metrics()
+        self._arrival = None
+
+        # prefix -> (converter or None, where the value goes)
+        self._dispatch = {
+            'K': (None, self.ecg.append),
+            'G': (edr_kohm, self.edr.append),
+            'P': (rr_to_bpm, self.bpm2.append),
+            'O': (rr_to_bpm, self.bpm1.append),
+            'F': (None, self.hp.append),
+            'Q': (None, self.sqr.append),
+            'I': (None, self.integrated.append),
+            'T': (None, self.thresh_i_list.append),
+            'Y': (None, self.thresh1_f_list.append),
+            'H': (None, self.thresh2_f_list.append),
+            'B': (self._beat_tick, self._add_beat),
+            'W': (None, self.beat_type.append),
+            'N': (bool, self._set_pulse_regular),
+            'R': (None, self._arduino_reset)}
 
-        self.ser = serial.Serial(port='/dev/ttyAMA0',  # This should maybe be an initialization variable?
-                                 baudrate=115200,
-                                 timeout=1)
+        self.record_dir = record_dir
+        self.recorder = None
+        self.exporter = None
+
+        if source is None:
+            source = SerialSource(port=port)
+        self.ser = source
         self.ser.close()
         self.debug = False
 
@@ -59,6 +123,7 @@ class DAQThread(Thread):
             try:
                 line = self.ser.readline()
             except:
+                self.metrics.read_errors += 1
                 if not self.silent:
                     print 'bad readline()'
             if line:
@@ -66,195 +131,315 @@ class DAQThread(Thread):
                     prefix = line[0]
                     value = long(line[1:])
                 except ValueError as e:
+                    self.metrics.parse_errors += 1
                     if not self.silent:
                         print "line: %s" % (line, )
         return prefix, value
 
+    def gather_batch(self):
+        '''Reads everything waiting in the serial buffer (blocking for at
+            most the serial timeout when it is empty) and returns the list
+            of (prefix, value) records from all complete lines or binary
+            frames; protocol.AutoDecoder works out which one is in use.'''
+        if not self.ser.isOpen():
+            return []
+        try:
+            waiting = self.ser.inWaiting()
+            data = self.ser.read(max(1, waiting))
+        except:
+            self.metrics.read_errors += 1
+            if not self.silent:
+                print 'bad read()'
+            return []
+        self._arrival = time()
+        self.metrics.read(len(data), waiting)
+        return self._decode(data)
+
+    def _waiting(self):
+        '''Whether more input is already waiting to be read'''
+        try:
+            return self.ser.isOpen() and self.ser.inWaiting() > 0
+        except:
+            return False
+
+    def _decode(self, data):
+        records = self.decoder.feed(data)
+        if self.decoder.bad_lines != self._bad_lines:
+            self._bad_lines = self.decoder.bad_lines
+            if not self.silent:
+                print "line: %s" % (self.decoder.last_bad_line, )
+        return records
+
+    def process_batch(self):
+        '''Reads and catalogs everything waiting, see gather_batch()'''
+        self._process_records(self.gather_batch())
+
+    def _process_records(self, records):
+        for prefix, value in records:
+            self.process(prefix, value)
+        if records:
+            # the whole batch, so snapshots of the EDR channels keep up
+            self.edr_stage.update(self._published, flush=True)
+            self.store.update_pyramids()
+            self.metrics.processed(self._arrival, self._published)
+
+    def process_queued(self, block=False):
+        '''Catalogs everything SerialReader queued in the ring, with
+            block=True waiting for something when it is empty'''
+        data, arrival = self.ring.read(block)
+        if not data:
+            return
+        self.metrics.queued.add(len(data))
+        self._arrival = arrival
+        self._process_records(self._decode(data))
+
     def run(self):
-        '''Processes and catalogs the incoming data.'''
+        '''Processes and catalogs the incoming data. When pipelined a
+            SerialReader thread does the reading, see reader.py.'''
         self.ser.open()
-        appendix = {'S': self.t, 'K': self.ecg, 'G': self.edr,
-                    'F': self.hp, 'Q': self.sqr, 'I': self.integrated,
-                    'B': self.beats, 'P': self.bpm2, 'O': self.bpm1,
-                    'T': self.thresh_i_list, 'Y': self.thresh1_f_list,
-                    'W': self.beat_type, 'H': self.thresh2_f_list}
-
-        appendage = lambda x: {
-            'S': x, 'K': x, 'G': (x * 220 / (1024 - x) if x < 1024 else -1), 'F': x, 'Q': x,
-            'I': x, 'B': self.t_current + (x - self.samples) * 0.005,
-            'P': ((60000.0 / x) if x != 0 else -1),
-            'O': ((60000.0 / x) if x != 0 else -1),
-            'T': x, 'Y': x, 'W': x, 'H': x}
-
+        if self.pipelined and self.batched:
+            self.ring = ByteRing()
+            reader = SerialReader(self.ser, self.ring, self.metrics)
+            reader.start()
+            try:
+                while self.keep_running and not self.ring.closed:
+                    self.process_queued(True)
+            finally:
+                reader.stop()
+            self.process_queued()
+            return
         while self.keep_running:
-            prefix, value = self.gather_sample()
-
-            if prefix is None or value is None:
-                continue
-            if prefix is 'S':
-                if not self.t:
-                    self.samples = value
-                    value = 0
-                    self.start_time = datetime.utcnow()
-                else:
-                    self.t_current = float(self.t[-1] + float(value - self.samples) / 200)
-                    self.samples = value
-                    value = self.t_current
-                    if self.debug and not self.silent:
-                        print 'time: %f' % (value, )
-                    if self.last_drawable is None:
-                        self.last_drawable = 0
-                        self.first_drawable = 0
-                    else:
-                        self.last_drawable += 1
-                    if self.t[self.first_drawable] < self.t[self.last_drawable] - self.t_drawable:
-                        self.first_drawable += 1
-
-            if self.samples is not None or prefix is 'S':
-                try:
-                    appendix[prefix].append(appendage(value)[prefix])
-                except KeyError as e:
-                    if prefix is 'N':
-                        if value:
-                            self.pulse_regular = True
-                        else:
-                            self.pulse_regular = False
-                    if prefix is 'R':  # reset counter
-                        if not self.silent:
-                            print "Arduino reset happened!"
-                        self.samples -= value
-
-            if prefix in self.maxs:
-                test_value = appendage(value)[prefix]
-                if test_value > self.maxs[prefix]:
-                    self.maxs[prefix] = test_value
-                if test_value < self.mins[prefix]:
-                    self.mins[prefix] = test_value
-
-
-    def stop(self):
-        '''Closes the data stream and plots the data'''
-        self.ser.close()
-        self.keep_running = False
-        plt.clf()
-
-        y_data = [(self.edr, ), (self.bpm1, self.bpm2), (self.ecg, )]
-        styles = [('b', ), ('b','r'), ('b', )]
-        if self._plot_all_data:
-            y_data.extend([(self.hp, self.thresh1_f_list, self.thresh2_f_list),
-                           (self.sqr, ),
-                           (self.integrated, self.thresh_i_list, [x * 0.5 for x in self.thresh_i_list])])
-            styles.extend([('b', 'r', 'g'),
-                           ('b', ),
-                           ('b', 'r', 'g')])
-        fig, axes = plt.subplots(nrows=len(y_data))
-        draw_marks = [True, True, False, False, False, False]
-        draw_beats = [False, False, True, False, False, False]
-        y_labels = ['EDR [kOhm]', 'Pulse [bpm]', 'ECG', 'Filtered', 'D and squared', 'Integrated']
-        units = ['kOhm', 'bpm', 'V', 'na', 'na', 'na']
+            if self.batched:
+                self.process_batch()
+            else:
+                prefix, value = self.gather_sample()
+                self.process(prefix, value)
+                # a chunk at a time, or whatever is left once caught up
+                self.edr_stage.update(self._published, flush=not self._waiting())
+                self.store.update_pyramids()
+
+    def process(self, prefix, value):
+        '''Catalogs a single (prefix, value) record.'''
+        if prefix is None or value is None:
+            return
+        if not self.t and prefix != 'S':
+            # the port was opened mid-sample, the row has no time
+            return
+        if self.recorder is not None:
+            self.recorder.record(prefix, value)
+        if prefix == 'S':
+            self._process_sample(value)
+            return
+        try:
+            convert, target = self._dispatch[prefix]
+        except KeyError:
+            return
+        if convert is not None:
+            value = convert(value)
+        target(value)
 
+    def _process_sample(self, value):
+        '''Handles the 'S' sample counter that starts every sample'''
+        if not self.t:
+            self.samples = value
+            self.start_time = datetime.utcnow()
+            self.timebase.start(self.start_time)
+            if self.record_dir is not None:
+                self.recorder = SessionWriter(
+                    session_path(self.record_dir, self.start_time), self.start_time)
+                self.recorder.record('S', value)
+            self.beat_count.append(len(self.beats))
+            self._append_row()
+            return
+        # text output only sends every few samples, so only binary frames
+        # (one per sample) show losses in the counter
+        if value - self.samples != 1 and self.decoder.mode == 'binary':
+            self.metrics.gap(value - self.samples)
+        # the HRV of the sample that just completed
+        self.features.sample()
+        # counted in whole samples, so long sessions do not drift
+        self.tick += value - self.samples
+        self.t_current = self.tick / float(SAMPLE_RATE)
+        self.samples = value
         if self.debug and not self.silent:
-            print 'time:'
-            print str(self.t)
+            print 'time: %f' % (self.t_current, )
+        if self.last_drawable is None:
+            self.last_drawable = 0
+        else:
+            self.last_drawable += 1
+        events = self.events
+        if events.pending or events.open:
+            row = self.last_drawable
+            events.sample(row, self.t[row], self.bpm1[-1] if len(self.bpm1) else -1,
+                          self.edr[-1] if len(self.edr) else -1)
+        self.beat_count.append(len(self.beats))
+        # the row before this 'S' is complete, let readers see it
+        self._published = self.last_drawable + 1
+        self._append_row()
+
+    def _append_row(self):
+        self.t.append(self.t_current)
+        self.timebase.append(self.tick)
+
+    def _beat_tick(self, sample):
+        return self.tick + (sample - self.samples)
+
+    def _add_beat(self, tick):
+        time = tick / float(SAMPLE_RATE)
+        self.beat_ticks.append(tick)
+        self.beats.append(time)
+        self.features.beat(time)
+
+    def _set_pulse_regular(self, value):
+        self.pulse_regular = value
+
+    def _arduino_reset(self, value):
         if not self.silent:
-            print str([self.t[x] for x in self.marks])
-        for ax, data_tup, style_tup, draw_mark, draw_beat, y_label, unit in zip(
-                axes, y_data, styles, draw_marks, draw_beats, y_labels, units):
-            y_min = 100000
-            y_max = 0
-            for data, style in zip (data_tup, style_tup):
-                if self.debug and not self.silent:
-                    print 'preparing plot for %s' % (y_label)
-                    print str(data)
-                try:
-                    ax.plot(self.t[:self.last_drawable], data[:self.last_drawable], style)
-                except ValueError:
-                    if not self.silent:
-                        print 'Plotting failed for %s' % (y_label)
-                y_max = max(y_max, max(data[:self.last_drawable]))
-                y_min = min(y_min, min(data[:self.last_drawable]))
-            if draw_mark:
-                for i in range(0, len(self.marks)):
-                    time = self.t[self.marks[i]]
-                    ax.plot([time,time], [y_min,y_max], 'g')
-                    ax.text(time, y_min + (y_max - y_min) * 0.9, '%d' % (i + 1, ))
-                    ax.text(time, y_min + (y_max - y_min) * 0.1, '%.1f %s' % (data_tup[0][self.marks[i]], unit) )
-            if draw_beat:
-                for (time, _type) in zip(self.beats, self.beat_type):
-                    ax.plot([time,time], [y_min,y_max], 'g')
-                    ax.text(time, y_min + (y_max - y_min) * 0.95, '%d' % _type)
-            ax.set_ylabel(y_label)
-
-        plt.gcf().set_size_inches((min(32, 0.5 * self.t[-1]), 8))
-        # plt.savefig('trial_run_at_%s.png' % self.start_time)
-        plt.savefig('trial_run.png')
+            print "Arduino reset happened!"
+        self.metrics.resets += 1
+        self.timebase.reset()
+        self.samples -= value
+
+    def stop(self, plot=None):
+        '''Closes the data stream and, when recording, starts plotting the
+            session in a background process, see export.py. Without a
+            recording nothing is written unless ``plot`` names the image
+            to render the retained data to (the events go next to it).'''
+        self.keep_running = False
+        self.ser.close()
+        if self.ring is not None:
+            # wakes process_queued()
+            self.ring.close()
+        if self.is_alive():
+            self.join()
         if not self.silent:
+            print str(self.mark_times)
+        if self.recorder is not None:
+            # only needed from here on, keeps it out of acquisition startup
+            import export
+            self.recorder.close()
+            self.events.export(os.path.join(self.recorder.path, 'events.csv'))
+            self.exporter = export.in_background(
+                export.export_session, self.recorder.path, self._plot_all_data)
+        elif plot is not None:
+            import export
+            # whole session when spilling to disk, otherwise the retained window
+            names = export.channel_names(self._plot_all_data)
+            channels = [self.store[name] for name in names]
+            first = max(channel.available_from for channel in (self.t, ) + tuple(channels))
+            last = None
+            if self.last_drawable is not None:
+                last = self.last_drawable + 1
+            t = self.t.history(first, last)
+            data = dict((name, channel.history(first, last)[:len(t)])
+                        for name, channel in zip(names, channels))
+            marks = [x - first for x in self.marks if x is not None]
+            count = min(len(self.beats), len(self.beat_type))
+            self.events.export('%s_events.csv' % (os.path.splitext(plot)[0], ))
+            self.exporter = export.in_background(
+                export.render, plot, t, data, self.beats[:count],
+                self.beat_type[:count], marks, self._plot_all_data)
+        self.store.close()
+        if not self.silent and len(self.t):
             print "Average sample time: %f" % (float(self.t[-1]) / len(self.t),)
 
     def add_mark(self):
         '''Adds a mark to the data stream'''
-        self.marks.append(self.last_drawable)
-
-    def get_drawable(self, data_set_name=None):
-        '''Returns the portion of the requested data set that is
-            presently visible in the GUI'''
-        ret_val = None
-        last_drawable = self.last_drawable
-        first_drawable = self.first_drawable
-        if self._lock:
-            last_drawable = self._last_drawable
-            first_drawable = self._first_drawable
-        try:
-            ret_val = self.name_to_list[data_set_name][first_drawable:last_drawable]
-        except KeyError as e:
-            if not self.silent:
-                print "(get_drawable) No data set by name: %s" % str(data_set_name)
-            ret_val = [0,0]
-        except IndexError as e:
-            if not self.silent:
-                print "(get_drawable) Bad range."
-            ret_val = [0,0]
-        except TypeError:
-            ''''''
-        return ret_val
-
-    def get_last(self, data_set_name=None):
-        '''Returns the last sample from the usable portion of the
-            requested data set'''
-        ret_val = None
-        last_drawable = self.last_drawable
-        if self._lock:
-            last_drawable = self._last_drawable
-        try:
-            ret_val = self.name_to_list[data_set_name][last_drawable]
-        except KeyError as e:
-            if not self.silent:
-                print "(get_last) No data set by name: %s" % str(data_set_name)
-            ret_val = 0
-        except IndexError as e:
-            if not self.silent:
-                print "(get_last) Bad range."
-            ret_val = 0
-        except TypeError:
-            ''''''
-        return ret_val
-
-    def redraw_lock(self):
-        '''permits syncronization'''
-        self._lock = True
-        self._last_drawable = self.last_drawable
-        self._first_drawable = self.first_drawable
-
-    def redraw_lock_release(self):
-        self._lock = False
-
-    def get_y_limits(self, data_set_name=None):
-        ret_val = None
-        if data_set_name in self.name_to_prefix:
-            prefix = self.name_to_prefix[data_set_name]
-            offset = float((self.maxs[prefix] - self.mins[prefix]) / 8.0)
-            ret_val = (self.mins[prefix] - offset, self.maxs[prefix] + offset)
-        return ret_val
+        row = self.last_drawable
+        if row is not None:
+            self.events.mark(row)
+            if self.recorder is not None:
+                self.recorder.mark(row, self.t[row])
+        self.marks.append(row)
+
+    @property
+    def version(self):
+        '''The number of complete samples, see Snapshot.version'''
+        return self._published
+
+    def snapshot(self, names=('ecg', 'edr', 'bpm1', 'bpm2'), seconds=None, since=None):
+        '''Returns a Snapshot of the last ``seconds`` (t_drawable by
+            default) of the named channels. Only samples whose every field
+            has arrived are included and the arrays are copies, so this
+            never blocks or races the acquisition thread.
+
+            With ``since`` (the version of an earlier snapshot) only the
+            samples published after it are copied; beats and marks still
+            cover the whole window. Finding the window and its beats and
+            marks takes no search over the samples, see timebase.py.'''
+        if seconds is None:
+            seconds = self.t_drawable
+        stop = self._published
+        channels = [self.store[name] for name in names]
+        first = max(channel.first for channel in (self.t, self.beat_count) + tuple(channels))
+        stop = min([stop] + [len(channel) for channel in channels])
+        start = first
+        window = None
+        if stop > first:
+            start = max(first, self.timebase.index(self.t[stop - 1] - seconds))
+            window = (start, stop)
+        else:
+            stop = start
+        if since is not None:
+            start = min(max(start, since), stop)
+        time = np.array(self.t[start:stop])
+        data = dict((name, np.array(channel[start:stop]))
+                    for name, channel in zip(names, channels))
+
+        count = min(len(self.beats), len(self.beat_type))
+        beats = np.zeros(0)
+        beat_types = np.zeros(0, dtype=np.int64)
+        marks = np.zeros(0)
+        if window is not None:
+            # beats reported by the rows of the window
+            hi = min(self.beat_count[stop], count)
+            lo = min(self.beat_count[window[0]], hi)
+            beats = np.array(self.beats[lo:hi], dtype=np.float64)
+            beat_types = np.array(self.beat_type[lo:hi], dtype=np.int64)
+            rows = self.events.rows
+            count = len(rows)
+            lo = bisect_left(rows, window[0], 0, count)
+            hi = bisect_left(rows, stop, lo, count)
+            marks = np.array(self.mark_times[lo:hi], dtype=np.float64)
+        return Snapshot(stop, start, time, data, beats, beat_types, marks, self.pulse_regular)
+
+    def overview(self, name, start=None, stop=None, width=800):
+        '''(time, values) of a channel added with a pyramid from ``start``
+            to ``stop`` seconds (the whole session by default), reduced to
+            the minimum then the maximum of at most width / 2 stretches, so
+            it draws as width points whatever the range. Rows older than
+            the retention are found and timed from the time channel's
+            pyramid; stretches no longer retained at any level are left
+            out.'''
+        published = self._published
+        if not published:
+            return np.zeros(0), np.zeros(0)
+        time = self.store.pyramids['time']
+        first = 0 if start is None else time.search(start)
+        last = published if stop is None else min(published, time.search(stop) + 1)
+        size, rows, low, high, mean = self.store.pyramids[name].view(first, last, width // 2)
+        times = time.starts(size, rows)
+        kept = ~(np.isnan(low) | np.isnan(times))
+        rows, low, high = rows[kept], low[kept], high[kept]
+        t = np.repeat(times[kept], 2)
+        values = np.empty(2 * len(rows))
+        values[0::2] = low
+        values[1::2] = high
+        return t, values
+
+    def get_y_limits(self, data_set_name=None, seconds=None):
+        '''Limits that fit a channel's last ``seconds`` (t_drawable by
+            default) with an eighth of its range to spare; the GUI uses
+            render.LiveTrace.limits() instead'''
+        if data_set_name not in self.store:
+            return None
+        data = self.snapshot([data_set_name], seconds).channels[data_set_name]
+        if not len(data):
+            return None
+        low = float(data.min())
+        high = float(data.max())
+        offset = (high - low) / 8.0
+        return (low - offset, high + offset)
 
     def plot_all_data(self, value=True):
         '''Sets the application to produce a plot showing all of
@@ -267,5 +452,9 @@ class DAQThread(Thread):
     def be_quiet(self):
         self.silent = True
 
+    def stats(self):
+        '''Acquisition counters and histograms, see metrics.Metrics'''
+        return self.metrics.values(self._published, self.decoder.errors(), self.ring)
+
     def mark_count(self):
         return len(self.marks)
\ No newline at end of file
@@ -0,0 +1,150 @@
+'''Acquisition from several devices in a single thread.
+
+DeviceManager owns one DAQThread per device but never starts them; its
+own thread waits on all of their file descriptors with select() and
+has the matching DAQThread's process_batch() read whatever arrived.
+Each device keeps its own channel store, recorder, snapshots
+and marks, exactly as if it had been started on its own.'''
+from collections import OrderedDict
+import os
+import select
+from threading import Thread
+from time import sleep
+
+from daqthread import DAQThread
+from sources import SerialSource
+
+POLL_INTERVAL = 0.005  # seconds, for sources without a file descriptor
+# a device is dropped after its descriptor is readable this many times
+# in a row with nothing to read, as an unplugged serial port is
+MAX_EMPTY_READS = 100
+
+
+class DeviceManager(Thread):
+    '''Reads any number of sources from one thread. Add every device with
+        add() before start(); stop() stops them all and starts their
+        exports.'''
+
+    def __init__(self, record_dir='sessions', timeout=0.1):
+        super(DeviceManager, self).__init__()
+        self.record_dir = record_dir
+        self.timeout = timeout
+        self.devices = OrderedDict()
+        self.dropped = list()
+        self.keep_running = True
+        self.silent = False
+
+    def add(self, name, source=None, port=None, **kwargs):
+        '''Adds a device reading from source, or from the serial port
+            ``port`` (the name by default). Its sessions are recorded to
+            ``<record_dir>/<name>``; other keyword arguments go to
+            DAQThread. Returns the device's DAQThread.'''
+        if name in self.devices:
+            raise ValueError('Device %s already added' % (name, ))
+        if self.is_alive():
+            raise RuntimeError('Devices must be added before start()')
+        if source is None:
+            source = SerialSource(port=port or name)
+        record_dir = None
+        if self.record_dir is not None:
+            record_dir = os.path.join(self.record_dir, name)
+        daq = DAQThread(source=source, record_dir=record_dir, **kwargs)
+        if self.silent:
+            daq.be_quiet()
+        self.devices[name] = daq
+        return daq
+
+    def __getitem__(self, name):
+        return self.devices[name]
+
+    def __len__(self):
+        return len(self.devices)
+
+    def names(self):
+        return list(self.devices)
+
+    def be_quiet(self):
+        self.silent = True
+        for daq in self.devices.values():
+            daq.be_quiet()
+
+    def snapshot(self, name, *args, **kwargs):
+        '''DAQThread.snapshot() of one device'''
+        return self.devices[name].snapshot(*args, **kwargs)
+
+    def snapshots(self, *args, **kwargs):
+        '''DAQThread.snapshot() of every device, by name'''
+        return OrderedDict((name, daq.snapshot(*args, **kwargs))
+                           for name, daq in self.devices.items())
+
+    def add_mark(self, name=None):
+        '''Marks one device, or all of them at once'''
+        if name is not None:
+            self.devices[name].add_mark()
+            return
+        for daq in self.devices.values():
+            daq.add_mark()
+
+    def _drop(self, name, fds, fd):
+        if not self.silent:
+            print 'Device %s stopped responding, no longer reading it' % (name, )
+        del fds[fd]
+        self.dropped.append(name)
+
+    def run(self):
+        '''Multiplexes the reads of every device'''
+        fds = dict()
+        polled = list()
+        for name, daq in self.devices.items():
+            daq.ser.open()
+            fd = daq.ser.fileno()
+            if fd is None:
+                polled.append(daq)
+            else:
+                fds[fd] = name
+        timeout = self.timeout
+        if polled:
+            timeout = min(timeout, POLL_INTERVAL)
+        empty = dict((fd, 0) for fd in fds)
+        while self.keep_running:
+            if fds:
+                try:
+                    ready = select.select(list(fds), [], [], timeout)[0]
+                except (select.error, ValueError):
+                    # a descriptor was closed under us, stop() is on its way
+                    sleep(timeout)
+                    continue
+            else:
+                ready = []
+                sleep(timeout)
+            for fd in ready:
+                name = fds[fd]
+                daq = self.devices[name]
+                try:
+                    waiting = daq.ser.inWaiting()
+                except (IOError, OSError):
+                    waiting = 0
+                if waiting:
+                    empty[fd] = 0
+                    daq.process_batch()
+                else:
+                    empty[fd] += 1
+                    if empty[fd] >= MAX_EMPTY_READS:
+                        self._drop(name, fds, fd)
+            for daq in polled:
+                if daq.ser.inWaiting():
+                    daq.process_batch()
+
+    def stop(self):
+        '''Stops reading and stops every device, see DAQThread.stop()'''
+        self.keep_running = False
+        if self.is_alive():
+            self.join()
+        for daq in self.devices.values():
+            daq.stop()
+
+    def join_exports(self):
+        '''Waits for every device's background export to finish'''
+        for daq in self.devices.values():
+            if daq.exporter is not None:
+                daq.exporter.join()
@@ -0,0 +1,184 @@
+'''Streaming electrodermal processing.
+
+EDRStage follows DAQThread's EDR channel (skin resistance in kOhm, -1
+while the input is saturated) and turns it into skin conductance in
+microsiemens, low-pass filtered by two moving averages in a row, a slow
+tonic level (the moving average of the last TONIC seconds) and the phasic
+part riding on it. The averages span seconds of the time channel, not a
+number of rows, as text output only sends every few samples. A skin
+conductance response is counted where the phasic part rises through
+SCR_THRESHOLD, and again only after it has fallen below half of that.
+The tonic level doubles as the skin conductance level feature, scl, and
+the responses of the last WINDOW seconds give scr_rate, see features.py.
+
+Everything is worked out with numpy a chunk at a time. DAQThread hands
+over each batch of records it processed whole; reading a record at a
+time, it waits for CHUNK samples or until it has caught up with the
+input, so the channels do not hold back snapshots. Each moving average
+keeps just the values of its window from one chunk to the next, so the
+cost per sample is bounded by the window and does not grow with the
+session. Saturated samples are NaN in every channel, a gap, and
+the filters carry the last good conductance across them.'''
+import numpy as np
+
+from features import WINDOW
+
+SCR_THRESHOLD = 0.05  # microsiemens
+SMOOTH = 0.25  # seconds, each of the two moving averages of the low-pass
+TONIC = 8.0  # seconds
+CHUNK = 20  # samples, fewer cost more in numpy calls than in arithmetic
+
+CHANNELS = ('edr_conductance', 'edr_tonic', 'edr_phasic', 'scr_events')
+
+
+class MovingAverage(object):
+    '''Mean of the values of the last ``seconds`` (after t - seconds, up
+        to t) at every value of a stream that arrives in chunks, each
+        value with its time'''
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self._times = np.zeros(0)
+        self._history = np.zeros(0)
+
+    def filter(self, times, values):
+        times = np.concatenate((self._times, times))
+        data = np.concatenate((self._history, values))
+        sums = np.concatenate(([0.0], np.cumsum(data)))
+        ends = np.arange(len(self._history) + 1, len(data) + 1)
+        # a microsecond short, so rounding does not let in a value that
+        # is exactly ``seconds`` old
+        span = self.seconds - 1e-6
+        starts = np.searchsorted(times, times[ends - 1] - span)
+        keep = np.searchsorted(times, times[-1] - span)
+        self._times = times[keep:]
+        self._history = data[keep:]
+        return (sums[ends] - sums[starts]) / (ends - starts)
+
+
+class EDRStage(object):
+    '''Adds the CHANNELS to ``store`` and fills them from ``edr``, whose
+        samples are at the times in ``time`` (seconds), up to the sample
+        update() is given. scr_events is 1 at the sample where a response
+        starts, 0 elsewhere; onsets lists those samples. Also adds 'scl',
+        another name for edr_tonic, and 'scr_rate', the responses per
+        minute over the ``window`` seconds up to each sample.'''
+
+    def __init__(self, store, edr, time, threshold=SCR_THRESHOLD, chunk=CHUNK,
+                 window=WINDOW):
+        self.edr = edr
+        self.time = time
+        self.chunk = chunk
+        self.threshold = threshold
+        self.window = window
+        self.conductance = store.add('edr_conductance', pyramid=True)
+        self.tonic = store.add('edr_tonic')
+        self.phasic = store.add('edr_phasic')
+        self.events = store.add('scr_events', np.int8)
+        store.alias('scl', 'edr_tonic')
+        self.scr_rate = store.add('scr_rate')
+        self._low_pass = (MovingAverage(SMOOTH), MovingAverage(SMOOTH))
+        self._tonic = MovingAverage(TONIC)
+        self.onsets = list()
+        self._recent = np.zeros(0)  # times of the onsets within the window
+        self.gaps = 0
+        self._last = np.nan  # last good conductance
+        self._valid = True
+        self._armed = True
+        self._above = False
+
+    @property
+    def level(self):
+        '''The newest skin conductance level, NaN in a gap'''
+        return self.tonic[-1] if len(self.tonic) else np.nan
+
+    @property
+    def rate(self):
+        '''The newest scr_rate'''
+        return self.scr_rate[-1] if len(self.scr_rate) else np.nan
+
+    def update(self, stop, flush=False):
+        '''Processes the EDR samples from where the last call stopped up
+            to ``stop``, when that is at least ``chunk`` of them or, with
+            flush=True, any'''
+        start = len(self.conductance)
+        stop = min(stop, len(self.edr), len(self.time))
+        if stop - start < (1 if flush else self.chunk):
+            return
+        lost = max(self.edr.first, self.time.first) - start
+        if lost > 0:
+            # fell behind the retention, the lost stretch is a gap the
+            # filters do not see
+            self._gap(lost)
+            start += lost
+            if start >= stop:
+                return
+        kohm = np.asarray(self.edr[start:stop], dtype=np.float64)
+        times = np.asarray(self.time[start:stop], dtype=np.float64)
+        valid = kohm > 0
+        conductance = np.repeat(np.nan, len(kohm))
+        conductance[valid] = 1000.0 / kohm[valid]
+        self.gaps += np.count_nonzero(~valid & np.concatenate(([self._valid], valid[:-1])))
+        # the filters see the last good conductance through a gap
+        held = np.where(valid, np.arange(len(kohm)), -1)
+        np.maximum.accumulate(held, out=held)
+        filled = np.where(held >= 0, conductance[np.maximum(held, 0)], self._last)
+        if valid.any():
+            self._last = conductance[valid][-1]
+        smooth = self._low_pass[1].filter(times, self._low_pass[0].filter(times, filled))
+        tonic = self._tonic.filter(times, smooth)
+        phasic = smooth - tonic
+        for values in (smooth, tonic, phasic):
+            values[~valid] = np.nan
+        self.conductance.extend(smooth)
+        self.tonic.extend(tonic)
+        self.phasic.extend(phasic)
+        events = self._detect(start, phasic)
+        self.events.extend(events)
+        self.scr_rate.extend(self._rate(times, events))
+        self._valid = bool(valid[-1])
+
+    def _gap(self, count):
+        for channel in (self.conductance, self.tonic, self.phasic, self.scr_rate):
+            channel.extend(np.repeat(np.nan, count))
+        self.events.extend(np.zeros(count, dtype=np.int8))
+        self.gaps += self._valid
+        self._valid = False
+        self._above = False
+
+    def _rate(self, times, events):
+        '''scr_rate for a chunk of samples at ``times``'''
+        recent = np.concatenate((self._recent, times[events > 0]))
+        counts = (np.searchsorted(recent, times, 'right') -
+                  np.searchsorted(recent, times - self.window))
+        self._recent = recent[np.searchsorted(recent, times[-1] - self.window):]
+        return counts * 60.0 / self.window
+
+    def _detect(self, start, phasic):
+        '''scr_events for a chunk of the phasic channel starting at sample
+            ``start``; only the crossings are visited, not every sample'''
+        events = np.zeros(len(phasic), dtype=np.int8)
+        with np.errstate(invalid='ignore'):
+            # a gap is neither
+            above = phasic >= self.threshold
+            below = phasic < self.threshold / 2
+        previous = np.concatenate(([self._above], above[:-1]))
+        rises = np.flatnonzero(above & ~previous)
+        falls = np.flatnonzero(below)
+        armed = self._armed
+        onset = -1  # the newest onset in this chunk
+        for rise in rises:
+            if not armed:
+                # re-armed by a fall since the last onset
+                i = np.searchsorted(falls, onset, 'right')
+                armed = i < len(falls) and falls[i] < rise
+            if armed:
+                events[rise] = 1
+                self.onsets.append(start + int(rise))
+                onset = rise
+                armed = False
+        if not armed:
+            armed = np.searchsorted(falls, onset, 'right') < len(falls)
+        self._armed = armed
+        self._above = bool(above[-1])
+        return events
@@ -0,0 +1,153 @@
+'''Responses to marks, treating every mark as a stimulus event.
+
+An Event summarizes pulse rate and EDR in the ``before`` seconds up to the
+mark, which are known as soon as the mark is added, and in the ``after``
+seconds following it, which EventAnalyzer fills in sample by sample as
+they arrive: mean BPM and EDR, the largest change in EDR from its
+baseline and how long after the mark it happened. Marks are kept by time
+in a sorted list so events in any time range are found with bisect.'''
+from bisect import bisect_left, bisect_right
+from collections import deque
+import csv
+
+import numpy as np
+
+BEFORE = 10.0  # seconds
+AFTER = 20.0  # seconds
+FIELDS = ('number', 'time', 'bpm_before', 'bpm_after', 'edr_before', 'edr_after',
+          'edr_peak_change', 'edr_peak_latency', 'complete')
+NAN = float('nan')
+
+
+def _mean(values):
+    '''Mean of the valid (non-negative) values, NaN without any'''
+    values = values[values >= 0]
+    if not len(values):
+        return NAN
+    return float(values.mean())
+
+
+class Event(object):
+    '''The summary of one mark'''
+
+    def __init__(self, number, time, row, bpm_before, edr_before, after=AFTER):
+        self.number = number
+        self.time = time
+        self.row = row
+        self.bpm_before = bpm_before
+        self.edr_before = edr_before
+        self.end = time + after
+        self.edr_peak_change = NAN
+        self.edr_peak_latency = NAN
+        self.complete = False
+        self._bpm = 0.0
+        self._bpm_count = 0
+        self._edr = 0.0
+        self._edr_count = 0
+
+    def add(self, time, bpm, edr):
+        '''Adds a sample after the mark, returns False once the after
+            window is over'''
+        if time > self.end:
+            self.complete = True
+            return False
+        if bpm >= 0:
+            self._bpm += bpm
+            self._bpm_count += 1
+        if edr >= 0:
+            self._edr += edr
+            self._edr_count += 1
+            change = edr - self.edr_before
+            if not abs(change) <= abs(self.edr_peak_change):
+                self.edr_peak_change = change
+                self.edr_peak_latency = time - self.time
+        return True
+
+    @property
+    def bpm_after(self):
+        if not self._bpm_count:
+            return NAN
+        return self._bpm / self._bpm_count
+
+    @property
+    def edr_after(self):
+        if not self._edr_count:
+            return NAN
+        return self._edr / self._edr_count
+
+    def summary(self):
+        return dict((field, getattr(self, field)) for field in FIELDS)
+
+
+class EventAnalyzer(object):
+    '''Keeps an Event per mark up to date from DAQThread's time, pulse and
+        EDR channels (RingBuffers indexed by sample number). With a
+        timebase (see timebase.py) the window before a mark is found
+        through it rather than by searching the time channel.
+
+        mark() may be called from any thread; sample() is called by the
+        acquisition thread for every complete sample.'''
+
+    def __init__(self, t, bpm, edr, before=BEFORE, after=AFTER, timebase=None):
+        self.t = t
+        self.timebase = timebase
+        self.bpm = bpm
+        self.edr = edr
+        self.before = before
+        self.after = after
+        self.events = list()
+        self.times = list()
+        self.rows = list()
+        self.pending = deque()
+        self.open = list()
+
+    def __len__(self):
+        return len(self.events)
+
+    def mark(self, row):
+        '''Adds an event at the complete sample ``row`` and returns it'''
+        time = self.t[row]
+        first = self.t.first
+        if self.timebase is not None:
+            start = max(first, self.timebase.index(time - self.before))
+        else:
+            t = self.t[first:row + 1]
+            start = first + int(np.searchsorted(t, time - self.before, 'left'))
+        event = Event(len(self.events) + 1, time, row,
+                      _mean(self.bpm[start:row + 1]), _mean(self.edr[start:row + 1]),
+                      self.after)
+        self.events.append(event)
+        self.times.append(time)
+        # after times, so a reader that goes by rows always finds the time
+        self.rows.append(row)
+        self.pending.append(event)
+        return event
+
+    def sample(self, row, time, bpm, edr):
+        '''Adds the complete sample ``row`` to every event still open'''
+        while self.pending:
+            event = self.pending.popleft()
+            # samples completed between the mark and now
+            for i in range(max(event.row + 1, self.t.first), row):
+                if not event.add(self.t[i], self.bpm[i], self.edr[i]):
+                    break
+            if not event.complete:
+                self.open.append(event)
+        if self.open:
+            self.open = [event for event in self.open if event.add(time, bpm, edr)]
+
+    def between(self, start, stop):
+        '''Events marked from start to stop seconds'''
+        count = len(self.times)
+        lo = bisect_left(self.times, start, 0, count)
+        return self.events[lo:bisect_right(self.times, stop, lo, count)]
+
+    def summaries(self):
+        return [event.summary() for event in self.events[:len(self.events)]]
+
+    def export(self, filename):
+        '''Writes one CSV row per event'''
+        with open(filename, 'wb') as f:
+            writer = csv.DictWriter(f, FIELDS)
+            writer.writeheader()
+            writer.writerows(self.summaries())
@@ -0,0 +1,157 @@
+'''Renders a whole session to PNG, optionally tiled into one image per
+page of time, in a background process.
+
+Every trace is reduced to the minimum and maximum of each pixel column
+before it reaches matplotlib, and beats and marks are drawn as a single
+vlines() collection per axis, so the cost depends on the image size
+rather than on the length of the session.
+
+    python export.py <session_dir> [--all] [--page-seconds N]'''
+from multiprocessing import Process
+import os
+import sys
+
+import numpy as np
+
+from render import decimate
+from session import Session
+
+DPI = 100
+HEIGHT = 8  # inches
+MIN_WIDTH = 8  # inches
+MAX_WIDTH = 32  # inches, reached by a 64 s page
+PAGE_SECONDS = 600
+BEAT_LABELS = 200  # most beats per page that still get a peak type label
+
+# (y label, unit, channels, styles, draw marks, draw beats)
+PANELS = [('EDR [kOhm]', 'kOhm', ('edr', ), ('b', ), True, False),
+          ('Pulse [bpm]', 'bpm', ('bpm1', 'bpm2'), ('b', 'r'), True, False),
+          ('ECG', 'V', ('ecg', ), ('b', ), False, True)]
+ALL_DATA_PANELS = [('Filtered', 'na', ('hp', 'thresh1_f', 'thresh2_f'), ('b', 'r', 'g'),
+                    False, False),
+                   ('D and squared', 'na', ('sqr', ), ('b', ), False, False),
+                   ('Integrated', 'na', ('integrated', 'thresh_i', 'thresh_i_half'),
+                    ('b', 'r', 'g'), False, False)]
+
+
+def panels(all_data=False):
+    if all_data:
+        return PANELS + ALL_DATA_PANELS
+    return PANELS
+
+
+def channel_names(all_data=False):
+    '''The channels render() needs for the chosen panels'''
+    names = list()
+    for panel in panels(all_data):
+        names.extend(name for name in panel[2] if name != 'thresh_i_half')
+    return names
+
+
+def page_name(filename, page, pages):
+    if pages == 1:
+        return filename
+    root, ext = os.path.splitext(filename)
+    return '%s_%03d%s' % (root, page + 1, ext)
+
+
+def render(filename, t, data, beats, beat_types, marks, all_data=False,
+           page_seconds=PAGE_SECONDS):
+    '''Plots a session and returns the names of the images written.
+
+        ``data`` maps channel names to arrays aligned with ``t``, ``beats``
+        are times with one peak type each in ``beat_types``, ``marks`` are
+        indices into ``t``. Sessions longer than ``page_seconds`` are
+        split into numbered images next to ``filename``.'''
+    if not len(t):
+        return []
+    if 'thresh_i' in data:
+        data = dict(data, thresh_i_half=data['thresh_i'] * 0.5)
+    beats = np.asarray(beats, dtype=np.float64)
+    beat_types = np.asarray(beat_types)
+    marks = np.asarray(marks, dtype=np.intp)
+    marks = marks[(marks >= 0) & (marks < len(t))]
+    pages = max(1, int(np.ceil((t[-1] - t[0]) / float(page_seconds))))
+    filenames = list()
+    start = 0
+    for page in range(pages):
+        stop = len(t)
+        if page < pages - 1:
+            stop = int(np.searchsorted(t, t[0] + (page + 1) * page_seconds, 'left'))
+        if stop > start:
+            filenames.append(page_name(filename, page, pages))
+            _render_page(filenames[-1], t, data, beats, beat_types, marks,
+                         panels(all_data), start, stop)
+        start = stop
+    return filenames
+
+
+def _render_page(filename, t, data, beats, beat_types, marks, panels, start, stop):
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    page_t = t[start:stop]
+    width = min(MAX_WIDTH, max(MIN_WIDTH, 0.5 * (page_t[-1] - page_t[0])))
+    fig = Figure((width, HEIGHT), DPI)
+    canvas = FigureCanvasAgg(fig)
+    columns = int(width * DPI)
+    in_page = (beats >= page_t[0]) & (beats <= page_t[-1])
+    page_beats = beats[in_page]
+    page_types = beat_types[in_page]
+    mark_numbers = np.flatnonzero((marks >= start) & (marks < stop))
+
+    for i, (y_label, unit, names, styles, draw_mark, draw_beat) in enumerate(panels):
+        ax = fig.add_subplot(len(panels), 1, i + 1)
+        y_min = None
+        y_max = None
+        for name, style in zip(names, styles):
+            y = data[name][start:stop]
+            if not len(y):
+                continue
+            ax.plot(*decimate(page_t, y, columns, start), color=style)
+            y_min = y.min() if y_min is None else min(y_min, y.min())
+            y_max = y.max() if y_max is None else max(y_max, y.max())
+        if y_min is None:
+            y_min, y_max = 0, 1
+        if draw_mark and len(mark_numbers):
+            rows = marks[mark_numbers]
+            ax.vlines(t[rows], y_min, y_max, 'g')
+            first = data[names[0]]
+            for number, row in zip(mark_numbers, rows):
+                ax.text(t[row], y_min + (y_max - y_min) * 0.9, '%d' % (number + 1, ))
+                ax.text(t[row], y_min + (y_max - y_min) * 0.1, '%.1f %s' % (first[row], unit))
+        if draw_beat and len(page_beats):
+            ax.vlines(page_beats, y_min, y_max, 'g')
+            if len(page_beats) <= BEAT_LABELS:
+                for time, _type in zip(page_beats, page_types):
+                    ax.text(time, y_min + (y_max - y_min) * 0.95, '%d' % _type)
+        ax.set_xlim(page_t[0], page_t[-1])
+        ax.set_ylabel(y_label)
+    fig.savefig(filename, dpi=DPI)
+
+
+def export_session(path, all_data=False, page_seconds=PAGE_SECONDS, filename=None):
+    '''Renders a recorded session directory, by default to
+        ``<path>/session.png``'''
+    session = Session(path)
+    if filename is None:
+        filename = os.path.join(path, 'session.png')
+    data = dict((name, session.channel(name)) for name in channel_names(all_data))
+    return render(filename, session.time(), data, session.beat_times(),
+                  session.beats['type'], session.marks['row'], all_data, page_seconds)
+
+
+def in_background(target, *args, **kwargs):
+    '''Runs target (render or export_session) in a child process and
+        returns the started multiprocessing.Process'''
+    process = Process(target=target, args=args, kwargs=kwargs)
+    process.start()
+    return process
+
+
+if __name__ == '__main__':
+    page_seconds = PAGE_SECONDS
+    if '--page-seconds' in sys.argv:
+        page_seconds = float(sys.argv[sys.argv.index('--page-seconds') + 1])
+    for filename in export_session(sys.argv[1], '--all' in sys.argv, page_seconds):
+        print filename
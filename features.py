@@ -0,0 +1,208 @@
+'''Heart rate variability and electrodermal features, updated as beats and
+samples arrive.
+
+HRV keeps the RR intervals of the last ``window`` seconds together with
+running sums, so SDNN, RMSSD and pNN50 cost O(1) per beat, and a
+LombScargle periodogram whose per-frequency sums are updated the same
+way, so LF and HF cost O(frequencies) per beat however long the session
+is. FeatureEngine ties it to DAQThread and publishes the results as
+channels of its ChannelStore; the skin conductance features come from
+edr.EDRStage.'''
+from collections import deque
+import math
+
+import numpy as np
+
+WINDOW = 120.0  # seconds
+MIN_RR = 300  # ms, shorter or longer intervals are treated as artifacts
+MAX_RR = 2000  # ms
+NN50 = 50  # ms
+LF_BAND = (0.04, 0.15)  # Hz
+HF_BAND = (0.15, 0.4)  # Hz
+FREQUENCIES = np.arange(0.04, 0.4 + 1e-9, 0.005)
+RESYNC = 1000  # beats between rebuilding the periodogram sums from scratch
+
+HRV_FEATURES = ('sdnn', 'rmssd', 'pnn50', 'lf', 'hf', 'lf_hf')
+FEATURES = HRV_FEATURES + ('scl', 'scr_rate')
+NAN = float('nan')
+
+
+class LombScargle(object):
+    '''Lomb-Scargle periodogram of a changing set of unevenly spaced
+        (t, y) points. Every term of the periodogram is a sum over the
+        points, so add() and remove() just update those sums.'''
+
+    def __init__(self, frequencies=FREQUENCIES):
+        self.frequencies = frequencies
+        self._omega = 2 * math.pi * frequencies
+        self.clear()
+
+    def clear(self):
+        self.n = 0
+        self._y = 0.0
+        # sums of cos wt, sin wt, y cos wt, y sin wt, cos 2wt, sin 2wt
+        self._sums = np.zeros((6, len(self._omega)))
+
+    def _terms(self, t, y):
+        c = np.cos(self._omega * t)
+        s = np.sin(self._omega * t)
+        return np.array((c, s, y * c, y * s, c * c - s * s, 2 * s * c))
+
+    def add(self, t, y):
+        self._sums += self._terms(t, y)
+        self._y += y
+        self.n += 1
+
+    def remove(self, t, y):
+        self._sums -= self._terms(t, y)
+        self._y -= y
+        self.n -= 1
+
+    def power(self):
+        '''The periodogram at every frequency, None with too few points'''
+        n = self.n
+        if n < 4:
+            return None
+        C, S, YC, YS, C2, S2 = self._sums
+        mean = self._y / n
+        wtau = np.arctan2(S2, C2) / 2
+        c = np.cos(wtau)
+        s = np.sin(wtau)
+        yc = YC - mean * C
+        ys = YS - mean * S
+        cc = c * c * (n + C2) / 2 + c * s * S2 + s * s * (n - C2) / 2
+        ss = n - cc
+        return 0.5 * ((yc * c + ys * s) ** 2 / np.maximum(cc, 1e-12) +
+                      (ys * c - yc * s) ** 2 / np.maximum(ss, 1e-12))
+
+
+class HRV(object):
+    '''Rolling heart rate variability of the beats in the last ``window``
+        seconds. Values are NaN until there are enough beats.'''
+
+    def __init__(self, window=WINDOW, frequencies=FREQUENCIES):
+        self.window = window
+        self.spectrum = LombScargle(frequencies)
+        self._in_lf = (frequencies >= LF_BAND[0]) & (frequencies < LF_BAND[1])
+        self._in_hf = (frequencies >= HF_BAND[0]) & (frequencies < HF_BAND[1])
+        self._df = frequencies[1] - frequencies[0]
+        # (time, rr, difference to the previous rr or None)
+        self.intervals = deque()
+        self._sum = 0.0
+        self._sum2 = 0.0
+        self._differences = 0
+        self._sum_d2 = 0.0
+        self._nn50 = 0
+        self._last_beat = None
+        self._last_rr = None
+        self._added = 0
+        self.lf = NAN
+        self.hf = NAN
+
+    def beat(self, time):
+        '''Adds a beat at ``time`` seconds'''
+        last, self._last_beat = self._last_beat, time
+        if last is None or time <= last:
+            self._last_rr = None
+            return
+        rr = (time - last) * 1000
+        if not MIN_RR <= rr <= MAX_RR:
+            self._last_rr = None
+            self._trim(time)
+            return
+        difference = None
+        if self._last_rr is not None:
+            difference = rr - self._last_rr
+            self._differences += 1
+            self._sum_d2 += difference * difference
+            self._nn50 += abs(difference) > NN50
+        self._last_rr = rr
+        self.intervals.append((time, rr, difference))
+        self._sum += rr
+        self._sum2 += rr * rr
+        self.spectrum.add(time, rr)
+        self._added += 1
+        self._trim(time)
+        if self._added % RESYNC == 0:
+            self.spectrum.clear()
+            for t, y, _ in self.intervals:
+                self.spectrum.add(t, y)
+        self._update_spectrum()
+
+    def _trim(self, time):
+        while self.intervals and self.intervals[0][0] < time - self.window:
+            t, rr, difference = self.intervals.popleft()
+            self._sum -= rr
+            self._sum2 -= rr * rr
+            self.spectrum.remove(t, rr)
+            if difference is not None:
+                self._differences -= 1
+                self._sum_d2 -= difference * difference
+                self._nn50 -= abs(difference) > NN50
+
+    def _update_spectrum(self):
+        power = self.spectrum.power()
+        if power is None:
+            self.lf = self.hf = NAN
+            return
+        # scaled so a band's value approximates its share of the RR variance
+        span = self.intervals[-1][0] - self.intervals[0][0]
+        scale = 2.0 / self.spectrum.n * self._df * span
+        self.lf = power[self._in_lf].sum() * scale
+        self.hf = power[self._in_hf].sum() * scale
+
+    @property
+    def sdnn(self):
+        n = len(self.intervals)
+        if n < 2:
+            return NAN
+        return math.sqrt(max(0.0, (self._sum2 - self._sum * self._sum / n) / (n - 1)))
+
+    @property
+    def rmssd(self):
+        if not self._differences:
+            return NAN
+        return math.sqrt(max(0.0, self._sum_d2 / self._differences))
+
+    @property
+    def pnn50(self):
+        if not self._differences:
+            return NAN
+        return 100.0 * self._nn50 / self._differences
+
+    @property
+    def lf_hf(self):
+        if not self.hf > 0:
+            return NAN
+        return self.lf / self.hf
+
+
+class FeatureEngine(object):
+    '''Feeds DAQThread's beats to HRV and appends the current value of
+        every HRV feature, once per sample, to a channel of the same name
+        in ``store``. scl and scr_rate are channels of ``eda``, the
+        edr.EDRStage, so the live view and the aggregates share one
+        detector of skin conductance responses.'''
+
+    def __init__(self, store, eda, window=WINDOW):
+        self.hrv = HRV(window)
+        self.eda = eda
+        self.channels = [store.add(name) for name in HRV_FEATURES]
+        self._hrv_channels = zip(self.channels, self._hrv_values())
+
+    def _hrv_values(self):
+        hrv = self.hrv
+        return (hrv.sdnn, hrv.rmssd, hrv.pnn50, hrv.lf, hrv.hf, hrv.lf_hf)
+
+    def beat(self, time):
+        self.hrv.beat(time)
+        # HRV only changes with a beat, work it out once here
+        self._hrv_channels = zip(self.channels, self._hrv_values())
+
+    def sample(self):
+        '''Called once per complete sample'''
+        for channel, value in self._hrv_channels:
+            channel.append(value)
+
+    def values(self):
+        return self._hrv_values() + (self.eda.level, self.eda.rate)
@@ -1,6 +1,8 @@
 from time import sleep
 
-from daqthread import DAQThread
+from devices import DeviceManager
+import metrics
+from server import StreamServer, DEFAULT_PORT
 import sys
 import termios
 import fcntl
@@ -30,25 +32,58 @@ def myGetch():
 
     return c
 
+def option(args, flag, default):
+    '''Removes ``flag`` and its optional numeric value from args, returns
+        the value, ``default`` without one or None without the flag'''
+    if flag not in args:
+        return None
+    i = args.index(flag)
+    value = default
+    if i + 1 < len(args) and args[i + 1].replace('.', '', 1).isdigit():
+        value = type(default)(args.pop(i + 1))
+    args.pop(i)
+    return value
+
 def print_instructions():
     print "Press [space] to mark current time on record, press [q] to quit recording"
     return myGetch()
 
 if __name__ == '__main__':
     run_duration = 6
+    args = sys.argv[1:]
+    serve = option(args, '--serve', DEFAULT_PORT)
+    log_interval = option(args, '--metrics', metrics.DEFAULT_INTERVAL)
+    metrics_port = option(args, '--metrics-port', metrics.DEFAULT_PORT)
+    ports = args or ['/dev/ttyAMA0']
     print 'Starting'
-    daqThread = DAQThread()
-    daqThread.be_quiet()
-    daqThread.start()
+    manager = DeviceManager()
+    manager.be_quiet()
+    for port in ports:
+        manager.add(os.path.basename(port), port=port)
+    manager.start()
+    if serve is not None:
+        server = StreamServer(manager.devices, port=serve)
+        server.start()
+        print 'Serving live data on port %d' % (server.port, )
+    if log_interval is not None:
+        logger = metrics.MetricsLogger(manager.devices, log_interval)
+        logger.start()
+    if metrics_port is not None:
+        scraper = metrics.MetricsServer(manager.devices, port=metrics_port)
+        scraper.start()
+        print 'Serving metrics on http://127.0.0.1:%d/metrics' % (scraper.port, )
     print 'Started'
 
     while 1:
         keystroke = print_instructions()
         if keystroke == ' ':
-            daqThread.redraw_lock()
-            daqThread.add_mark()
-            print 'Mark %d added at t=%.1f. \nCurrent pulse rate: %.1f BPM, \nCurrent dermal response: %.1f kOhms' % (daqThread.mark_count(), daqThread.get_last('time'), daqThread.get_last('bpm1'), daqThread.get_last('edr'))
-            daqThread.redraw_lock_release()
+            manager.add_mark()
+            for name, snapshot in manager.snapshots(seconds=0).items():
+                daqThread = manager[name]
+                print '%s: Mark %d added at t=%.1f. \nCurrent pulse rate: %.1f BPM, \nCurrent dermal response: %.1f kOhms' % (name, daqThread.mark_count(), snapshot.last('time'), snapshot.last('bpm1'), snapshot.last('edr'))
+                if len(daqThread.events) > 1:
+                    event = daqThread.events.events[-2]
+                    print 'Response to mark %d: %.1f -> %.1f BPM, EDR peak change %.1f kOhms after %.1f s' % (event.number, event.bpm_before, event.bpm_after, event.edr_peak_change, event.edr_peak_latency)
         if keystroke == 'q' or keystroke == 'Q':
             break
     # minute_count = 0
@@ -61,6 +96,12 @@ if __name__ == '__main__':
     # except KeyboardInterrupt:
     #     ''''''
     print 'Stopping'
-    daqThread.stop()
+    if serve is not None:
+        server.stop()
+    if log_interval is not None:
+        logger.stop()
+    if metrics_port is not None:
+        scraper.stop()
+    manager.stop()
     print 'Exiting'
     exit()
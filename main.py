@@ -1,21 +1,23 @@
-from time import sleep
+import sys
+from time import sleep, time
 import matplotlib
 matplotlib.use('WXAgg')
-import matplotlib.pyplot as plt
 from matplotlib.backends.backend_wxagg import FigureCanvasWxAgg
 from matplotlib.figure import Figure
-from threading import Thread
+import numpy as np
 import wx
 
 from daqthread import DAQThread
+from features import FEATURES
+from render import AxisLimits, LiveTrace, OverviewWindow
 
-myEVT_REDRAW = wx.NewEventType()
-EVT_REDRAW = wx.PyEventBinder(myEVT_REDRAW, 1)
-myEVT_RESTART = wx.NewEventType()
-EVT_RESTART = wx.PyEventBinder(myEVT_RESTART, 1)
+DEFAULT_FPS = 10
+STATS_INTERVAL = 5  # seconds between fps/redraw time reports
+OVERVIEW_INTERVAL = 1  # seconds between overview redraws while nothing moves it
+ZOOM = 1.5  # per mouse wheel step
 
 class MyFrame(wx.Frame):
-    def __init__(self, parent, id):
+    def __init__(self, parent, id, fps=DEFAULT_FPS):
         wx.Frame.__init__(self,parent, id, 'Biometrics Scanner',
                 style=wx.DEFAULT_FRAME_STYLE ^ wx.RESIZE_BORDER,
                 size=(800, 600))
@@ -24,6 +26,8 @@ class MyFrame(wx.Frame):
         self.fig = Figure((5, 4), 75)
 
         self.canvas = FigureCanvasWxAgg(self.panel, -1, self.fig)
+        self.overview_fig = Figure((5, 1), 75)
+        self.overview_canvas = FigureCanvasWxAgg(self.panel, -1, self.overview_fig)
         self.init_plot()
 
         self.start_stop_button = wx.Button(self.panel, -1, "Start");
@@ -50,16 +54,35 @@ class MyFrame(wx.Frame):
         edResponsePanel = wx.Panel(self.panel,-1)
         self.currentEDR = wx.StaticText(edResponsePanel, label='##', style=wx.ALIGN_RIGHT, pos=(10,10))
         self.currentEDR.SetFont(font)
-        wx.StaticText(edResponsePanel, label='kOhms', style=wx.ALIGN_RIGHT, pos=(150,10))
+        wx.StaticText(edResponsePanel, label='uS', style=wx.ALIGN_RIGHT, pos=(150,10))
         aggregates_bar.Add(edResponsePanel, 1, wx.EXPAND)
 
+        featuresPanel = wx.Panel(self.panel, -1)
+        self.currentFeatures = wx.StaticText(featuresPanel, label=self.format_features(None),
+                                             pos=(10, 10))
+        aggregates_bar.Add(featuresPanel, 2, wx.EXPAND)
+
         mainBar = wx.BoxSizer(wx.HORIZONTAL)
         mainBar.Add(self.canvas, 5, wx.EXPAND)
         mainBar.Add(aggregates_bar, 2, wx.EXPAND)
 
+        # the whole session: wheel zooms, dragging scrolls, a double
+        # click shows all of it again
+        self.overview_choice = wx.Choice(self.panel, -1, choices=self.data_labels)
+        self.overview_choice.SetSelection(self.data_sets.index('bpm2'))
+        self.Bind(wx.EVT_CHOICE, self.overview_changed, self.overview_choice)
+        self.overview_canvas.mpl_connect('scroll_event', self.on_overview_scroll)
+        self.overview_canvas.mpl_connect('button_press_event', self.on_overview_press)
+        self.overview_canvas.mpl_connect('motion_notify_event', self.on_overview_drag)
+        self.overview_canvas.mpl_connect('button_release_event', self.on_overview_release)
+        overviewBar = wx.BoxSizer(wx.HORIZONTAL)
+        overviewBar.Add(self.overview_canvas, 5, wx.EXPAND)
+        overviewBar.Add(self.overview_choice, 2, wx.CENTER)
+
         sizer = wx.BoxSizer(wx.VERTICAL)
         sizer.Add(topBar, 0, wx.EXPAND)
         sizer.Add(mainBar, 5, wx.EXPAND)
+        sizer.Add(overviewBar, 1, wx.EXPAND)
 
         self.panel.SetSizer(sizer)
         self.panel.Fit()
@@ -79,8 +102,14 @@ class MyFrame(wx.Frame):
         menuBar.Append(filemenu,"&File") # Adding the "filemenu" to the MenuBar
         self.SetMenuBar(menuBar)  # Adding the MenuBar to the Frame content.
 
-        self.Bind(EVT_REDRAW, self.onRedraw)
-        self.Bind(EVT_RESTART, self.onRestart)
+        self.CreateStatusBar()
+
+        self.fps = fps
+        self.redraw_timer = wx.Timer(self)
+        self.Bind(wx.EVT_TIMER, self.onRedraw, self.redraw_timer)
+        self._redrawing = False
+        self._drawn_version = None
+        self.reset_stats()
 
         self.mark_times = list()
 
@@ -94,113 +123,242 @@ class MyFrame(wx.Frame):
     def init_plot(self):
         self.t_window = 15
         self.t_undrawn = 2
-        self.data_sets = ['ecg', 'bpm2', 'edr']
-        self.data_limits = [(-512, 512), (50, 150), (80, 300)]
+        self.data_sets = ['ecg', 'bpm2', 'edr_conductance']
+        self.data_limits = [(-512, 512), (50, 150), (2, 15)]
         # self.data_limits = [(-10, 10), (50, 55), (150, 200)]
         self.lines = list()
-        self.data_labels = ['ECG', 'Pulse Rate (BPM)', 'EDR (kOhms)']
+        self.data_labels = ['ECG', 'Pulse Rate (BPM)', 'EDR (uS)']
         self.show_beats = [True, False, False]
         self.show_marks = [True, True, True]
         self.axes = [self.fig.add_subplot(len(self.data_sets), 1, x) for x in range(1, len(self.data_sets) + 1)]
+        self.trace = None
+        self.overview_ax = self.overview_fig.add_subplot(1, 1, 1)
+        self.overview_window = OverviewWindow()
+        self._overview_drawn = 0
+        self._overview_drag = None
 
         self.reset_plot()
 
     def reset_plot(self):
         self.beats_drawn = 0
         self.marks_drawn = 0
+        self.trace = LiveTrace(self.data_sets, self.t_window - self.t_undrawn)
+        self.axis_limits = [AxisLimits(limit) for limit in self.data_limits]
+        self.lines = list()
 
         for ax, data_label, data_limit, show_beat, show_mark in zip(
                 self.axes, self.data_labels, self.data_limits, self.show_beats, self.show_marks):
             ax.cla()
             ax.set_ylabel(data_label)
-            data_set_line = ax.plot(0,0)[0]
-            data_point_line = ax.plot(0,-600,'go')[0]
+            # animated artists stay out of canvas.draw() and the backgrounds
+            data_set_line = ax.plot(0,0, animated=True)[0]
+            data_point_line = ax.plot(0,-600,'go', animated=True)[0]
             beat_line = None
             mark_line = None
             if show_beat:
-                beat_line = ax.plot(0,-600, 'ro')[0]
+                beat_line = ax.plot(0,-600, 'ro', animated=True)[0]
             if show_mark:
-                mark_line = ax.plot(0,-600, 'ko')[0]
+                mark_line = ax.plot(0,-600, 'ko', animated=True)[0]
             ax.set_xlim(self.t_undrawn - self.t_window, self.t_undrawn)
             ax.set_ylim(*data_limit)
             self.lines.append((data_set_line, data_point_line, beat_line, mark_line))
 
         self.canvas.draw()
         self.backgrounds = [self.canvas.copy_from_bbox(ax.bbox) for ax in self.axes]
+
+        self.overview_window.clear()
+        self.overview_ax.cla()
+        self.overview_line = self.overview_ax.plot(0, 0)[0]
+        self.overview_marks = self.overview_ax.plot(0, -600, 'ko')[0]
+        # where the live plots are
+        self.overview_span = self.overview_ax.axvspan(0, 0, color='y', alpha=0.3)
+        self.overview_canvas.draw()
     
-    def reset_data_limits(self, ax, background, limits):
-	ax.set_ylim(*limits)
+    def reset_data_limits(self, changed):
+        '''Applies the new limits of the axes numbered in ``changed`` and
+            captures the blit backgrounds again'''
+        for i in changed:
+            self.axes[i].set_ylim(*self.axis_limits[i].limits)
         self.canvas.draw()
-        background = self.canvas.copy_from_bbox(ax.bbox)
+        self.backgrounds = [self.canvas.copy_from_bbox(ax.bbox) for ax in self.axes]
+        self._rescales += 1
             
+    def format_features(self, values):
+        '''Text for the HRV/EDR aggregates, '--' until a value is known'''
+        if values is None:
+            values = dict()
+        def value(name, format):
+            x = values.get(name)
+            if x is None or x != x:
+                return '--'
+            return format % (x, )
+        return '\n'.join([
+            'SDNN %s ms' % value('sdnn', '%.0f'),
+            'RMSSD %s ms' % value('rmssd', '%.0f'),
+            'pNN50 %s %%' % value('pnn50', '%.0f'),
+            'LF/HF %s' % value('lf_hf', '%.2f'),
+            'SCL %s uS' % value('scl', '%.2f'),
+            'SCR %s /min' % value('scr_rate', '%.1f')])
+
+    def reset_stats(self):
+        self._stats_start = time()
+        self._frames = 0
+        self._frames_skipped = 0
+        self._redraw_time = 0.0
+        self._redraw_time_max = 0.0
+        self._rescales = 0
+
+    def report_stats(self):
+        '''Shows the achieved frame rate and redraw times since the last
+            report in the status bar'''
+        now = time()
+        elapsed = now - self._stats_start
+        if elapsed < STATS_INTERVAL:
+            return
+        mean = 1000 * self._redraw_time / max(1, self._frames)
+        latency = 0.0
+        if self.daqThread is not None:
+            latency = 1000 * self.daqThread.metrics.draw_latency.percentile(99)
+        self.SetStatusText('%.1f/%g fps, redraw %.1f ms (max %.1f ms), %d skipped, %d rescaled, latency p99 %.0f ms' % (
+            self._frames / elapsed, self.fps, mean, 1000 * self._redraw_time_max,
+            self._frames_skipped, self._rescales, latency))
+        self.reset_stats()
+
     def onRedraw(self, event):
-        # last_drawable = self.daqThread.last_drawable
-        # first_drawable = self.daqThread.first_drawable
-        self.daqThread.redraw_lock()
-        self.currentBPM.SetLabel('%0.3f' % self.daqThread.get_last('bpm2'))
-        if self.daqThread.pulse_regular:
+        '''Called by redraw_timer; a frame is skipped while the previous
+            one is still being drawn or when no new samples arrived'''
+        if self._redrawing or self.daqThread is None:
+            self._frames_skipped += 1
+            return
+        if self.daqThread.version == self._drawn_version:
+            self._frames_skipped += 1
+            self.report_stats()
+            return
+        self._redrawing = True
+        start = time()
+        try:
+            self.redraw()
+        finally:
+            self._redrawing = False
+        elapsed = time() - start
+        self._frames += 1
+        self._redraw_time += elapsed
+        self._redraw_time_max = max(self._redraw_time_max, elapsed)
+        self.report_stats()
+
+    def redraw(self):
+        snapshot = self.trace.update(self.daqThread)
+        self._drawn_version = snapshot.version
+        if not len(self.trace):
+            return
+        self.currentBPM.SetLabel('%0.3f' % self.trace.last('bpm2'))
+        if snapshot.pulse_regular:
             self.currentBPM.SetForegroundColour((0,255,0))
         else:
             self.currentBPM.SetForegroundColour((255,0,0))
 
-        self.currentEDR.SetLabel('%0.3f' % self.daqThread.get_last('edr'))
-
-        t_max = self.daqThread.get_last('time')
-        drawable_time = [x - t_max for x in self.daqThread.get_drawable('time')]
-
-        t_cutoff = self.t_undrawn - self.t_window + t_max
-        beats_list_x = None
-        beats_list_y = None
-        try:
-            beats_list_x, beats_list_y = zip(
-                *[(x - t_max, 1) for x in self.daqThread.beats if x > t_cutoff])
-        except ValueError:
-            ''''''
-            # print "beats_list unpopulated"
-        marks_list_x = None
-        marks_list_y = None
-        try:
-            marks_list_x, marks_list_y = zip(
-                *[(x - t_max, 1) for x in self.daqThread.marks if x > t_cutoff])
-        except ValueError:
-            ''''''
-        for ax, background, data_set_name, data_label, line_tuple, data_limit in zip(
-                self.axes, self.backgrounds, self.data_sets, self.data_labels, self.lines, self.data_limits):
+        conductance = self.trace.last('edr_conductance')
+        # NaN while saturated
+        self.currentEDR.SetLabel('%0.3f' % conductance if conductance == conductance else '--')
+        features = self.daqThread.snapshot(FEATURES, seconds=0)
+        self.currentFeatures.SetLabel(self.format_features(
+            dict((name, features.last(name)) for name in FEATURES)))
+
+        changed = [i for i, (name, limits) in enumerate(zip(self.data_sets, self.axis_limits))
+                   if limits.update(*self.trace.limits(name))]
+        if changed:
+            self.reset_data_limits(changed)
+
+        t_max = self.trace.last('time')
+        beats_list_x = snapshot.beats - t_max
+        marks_list_x = snapshot.marks - t_max
+        for ax, background, data_set_name, data_label, line_tuple, axis_limits in zip(
+                self.axes, self.backgrounds, self.data_sets, self.data_labels, self.lines, self.axis_limits):
             self.canvas.restore_region(background)
             data_set_line, data_point_line, beat_line, mark_line = line_tuple
-            data_set_line.set_xdata(drawable_time)
-            data_set_line.set_ydata(self.daqThread.get_drawable(data_set_name))
-            # new_data_limit = self.daqThread.get_y_limits(data_set_name)
-            # if new_data_limit[0] < data_limit[0] or new_data_limit[1] > data_limit[1]:
-            #     self.reset_data_limits(ax, background, new_data_limit)
-            
+            data_limit = axis_limits.limits
+            drawable_time, drawable_data = self.trace.visible(data_set_name, int(ax.bbox.width))
+            data_set_line.set_data(drawable_time - t_max, drawable_data)
             ax.draw_artist(data_set_line)
-            data_point_line.set_ydata(self.daqThread.get_last(data_set_name))
+            data_point_line.set_ydata([self.trace.last(data_set_name)])
             ax.draw_artist(data_point_line)
-            if beat_line is not None and beats_list_x is not None:
+            if beat_line is not None:
                 beat_line.set_xdata(beats_list_x);
-                beat_line.set_ydata([y * float(data_limit[1] - (data_limit[1] - data_limit[0]) / 8.0) for y in beats_list_y]);
+                beat_line.set_ydata(np.repeat(float(data_limit[1] - (data_limit[1] - data_limit[0]) / 8.0), len(beats_list_x)));
                 ax.draw_artist(beat_line)
-            if mark_line is not None and marks_list_x is not None:
+            if mark_line is not None:
                 mark_line.set_xdata(marks_list_x)
-                mark_line.set_ydata([y * float(data_limit[0] + (data_limit[1] - data_limit[0]) / 8.0) for y in marks_list_y]);
+                mark_line.set_ydata(np.repeat(float(data_limit[0] + (data_limit[1] - data_limit[0]) / 8.0), len(marks_list_x)));
                 ax.draw_artist(mark_line)
             self.canvas.blit(ax.bbox)
-        self.daqThread.redraw_lock_release()
+        self.daqThread.metrics.drawn(snapshot.version)
+        if time() - self._overview_drawn >= OVERVIEW_INTERVAL:
+            self.redraw_overview()
+
+    def redraw_overview(self):
+        '''Draws the overview channel over the overview window, at most
+            one point per pixel column whatever its length'''
+        self._overview_drawn = time()
+        if self.daqThread is None:
+            return
+        newest = self.trace.last('time')
+        start, stop = self.overview_window.range(newest)
+        name = self.data_sets[self.overview_choice.GetSelection()]
+        ax = self.overview_ax
+        t, y = self.daqThread.overview(name, start, stop, int(ax.bbox.width))
+        self.overview_line.set_data(t, y)
+        ax.set_xlim(start, stop)
+        if len(y):
+            low, high = float(y.min()), float(y.max())
+            span = max(high - low, 1e-9)
+            ax.set_ylim(low - span / 8.0, high + span / 8.0)
+            marks = [x for x in self.daqThread.mark_times[:] if start <= x <= stop]
+            self.overview_marks.set_data(marks, [low] * len(marks))
+        self.overview_span.set_xy([(newest - self.trace.seconds, 0), (newest - self.trace.seconds, 1),
+                                   (newest, 1), (newest, 0), (newest - self.trace.seconds, 0)])
+        self.overview_canvas.draw()
+
+    def overview_changed(self, event):
+        self.redraw_overview()
+
+    def on_overview_scroll(self, event):
+        if self.daqThread is None or event.xdata is None:
+            return
+        factor = 1 / ZOOM if event.button == 'up' else ZOOM
+        self.overview_window.zoom(factor, event.xdata, self.trace.last('time'))
+        self.redraw_overview()
+
+    def on_overview_press(self, event):
+        if self.daqThread is None or event.xdata is None:
+            return
+        if event.dblclick:
+            self.overview_window.clear()
+            self.redraw_overview()
+            return
+        self._overview_drag = event.x
+
+    def on_overview_drag(self, event):
+        if self._overview_drag is None or self.daqThread is None:
+            return
+        ax = self.overview_ax
+        start, stop = ax.get_xlim()
+        seconds = (self._overview_drag - event.x) * (stop - start) / ax.bbox.width
+        self._overview_drag = event.x
+        self.overview_window.scroll(seconds, self.trace.last('time'))
+        self.redraw_overview()
+
+    def on_overview_release(self, event):
+        self._overview_drag = None
 
 
     def OnAbout(self, event):
         """"""
 
-    def onRestart(self, event):
-        if self.running:
-            redrawThread = RedrawThread(self)
-            redrawThread.start()
-
     def start_stop_action(self, event):
         if self.running:
             self.start_stop_button.SetLabel("Processing...")
             self.running = False
+            self.redraw_timer.Stop()
             self.daqThread.stop()
             while self.daqThread.is_alive():
                 sleep(0.1)
@@ -212,8 +370,9 @@ class MyFrame(wx.Frame):
             self.daqThread = DAQThread()
             self.daqThread.t_drawable = self.t_window - self.t_undrawn
             self.daqThread.start()
-            redrawThread = RedrawThread(self)
-            redrawThread.start()
+            self._drawn_version = None
+            self.reset_stats()
+            self.redraw_timer.Start(int(1000.0 / self.fps))
             self.start_stop_button.SetLabel("Stop")
 
     def OnExit(self, event):
@@ -224,30 +383,20 @@ class MyFrame(wx.Frame):
             self.daqThread.add_mark()
 
 
-class RedrawThread(Thread):
-    def __init__(self, parent):
-        ''''''
-        super(RedrawThread, self).__init__()
-        self._parent = parent
-
-    def run(self):
-        redraw_evt = wx.PyCommandEvent(myEVT_REDRAW, -1)
-        wx.PostEvent(self._parent, redraw_evt)
-        sleep(0.35)
-        restart_evt = wx.PyCommandEvent(myEVT_RESTART, -1)
-        wx.PostEvent(self._parent, restart_evt)
-
-
 class MyApp(wx.App):
-    def __init__(self):
+    def __init__(self, fps=DEFAULT_FPS):
+        self.fps = fps
         wx.App.__init__(self)
 
     def OnInit(self):
-        self.frame = MyFrame(parent=None,id=-1)
+        self.frame = MyFrame(parent=None,id=-1, fps=self.fps)
         self.frame.Show()
         self.SetTopWindow(self.frame)
         return True
 
 if __name__ == '__main__':
-    app = MyApp()
+    fps = DEFAULT_FPS
+    if '--fps' in sys.argv:
+        fps = float(sys.argv[sys.argv.index('--fps') + 1])
+    app = MyApp(fps)
     app.MainLoop()
@@ -0,0 +1,239 @@
+'''Counters and histograms of how acquisition is doing.
+
+Every DAQThread has a Metrics: bytes and reads from the source, read and
+parse errors, samples lost to gaps in the 'S' counter of binary frames
+(text output skips samples by design), Arduino resets,
+the serial backlog found at each read, with the two stage pipeline (see
+reader.py) the bytes queued for processing and any that did not fit,
+the time from a read returning to
+its samples being published and, when something draws them (the GUI
+calls drawn()), the time from a read returning to its newest sample being
+drawn. Everything is updated once per read rather than per record, so
+it stays on in the acquisition loop.
+
+MetricsLogger prints one line per device every few seconds and
+MetricsServer answers GET /metrics with all of them in the Prometheus
+text format.'''
+from bisect import bisect_left
+from collections import deque
+from threading import Thread
+from time import sleep, time
+
+LATENCY_BOUNDS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0)  # s
+BACKLOG_BOUNDS = (0, 16, 64, 256, 1024, 4096, 16384, 65536)  # bytes
+QUEUED_BOUNDS = BACKLOG_BOUNDS + (262144, 1048576)  # bytes
+ARRIVALS = 4096  # reads remembered for the draw latency
+DEFAULT_INTERVAL = 10.0  # seconds between log lines
+DEFAULT_PORT = 9108
+
+COUNTERS = ('samples', 'reads', 'bytes', 'read_errors', 'parse_errors', 'lost_samples',
+            'resets', 'frames', 'overflow_bytes', 'backpressure')
+HISTOGRAMS = ('backlog', 'queued', 'processing', 'draw_latency')
+
+
+class Histogram(object):
+    '''Counts of values in the buckets ending at ``bounds``, plus one for
+        anything larger'''
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0
+
+    def add(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    @property
+    def mean(self):
+        if not self.count:
+            return 0.0
+        return self.sum / self.count
+
+    def percentile(self, q):
+        '''Upper bound of the bucket holding the q-th percentile'''
+        if not self.count:
+            return 0.0
+        rank = q / 100.0 * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+
+class Metrics(object):
+    def __init__(self):
+        self.start = time()
+        self.reads = 0
+        self.bytes = 0
+        self.read_errors = 0
+        self.parse_errors = 0
+        self.lost_samples = 0
+        self.resets = 0
+        self.frames = 0
+        self.backlog = Histogram(BACKLOG_BOUNDS)
+        self.queued = Histogram(QUEUED_BOUNDS)
+        self.processing = Histogram(LATENCY_BOUNDS)
+        self.draw_latency = Histogram(LATENCY_BOUNDS)
+        # (samples published once the read was processed, when it returned)
+        self._arrivals = deque(maxlen=ARRIVALS)
+        self._published = 0
+
+    def read(self, size, backlog):
+        '''A read of ``size`` bytes with ``backlog`` bytes waiting'''
+        self.reads += 1
+        self.bytes += size
+        self.backlog.add(backlog)
+
+    def gap(self, gap):
+        '''The 'S' counter moved by ``gap`` instead of 1'''
+        if gap > 1:
+            self.lost_samples += gap - 1
+
+    def processed(self, arrival, published):
+        '''A read that returned at ``arrival`` has been processed and
+            ``published`` samples are now visible'''
+        self.processing.add(time() - arrival)
+        if published != self._published:
+            self._published = published
+            self._arrivals.append((published, arrival))
+
+    def drawn(self, version):
+        '''The samples up to ``version`` (see DAQThread.version) were
+            just drawn'''
+        arrivals = self._arrivals
+        while arrivals and arrivals[0][0] < version:
+            arrivals.popleft()
+        if arrivals:
+            self.frames += 1
+            self.draw_latency.add(time() - arrivals[0][1])
+
+    def values(self, samples, parse_errors, ring=None):
+        '''Every counter and histogram, see COUNTERS and HISTOGRAMS'''
+        values = dict((name, getattr(self, name, 0)) for name in COUNTERS if name != 'samples')
+        values['samples'] = samples
+        values['parse_errors'] += parse_errors
+        if ring is not None:
+            values['overflow_bytes'] = ring.overflow_bytes
+            values['backpressure'] = ring.backpressure
+        values['elapsed'] = time() - self.start
+        for name in HISTOGRAMS:
+            values[name] = getattr(self, name)
+        return values
+
+
+def format_line(name, values, rate):
+    return ('%s: %.1f samples/s, %d lost, %d parse errors, %d read errors, %d resets, '
+            '%d B overflowed, backlog p99 %d B, queued p99 %d B, processing p99 %.1f ms, '
+            'draw p99 %.1f ms' % (
+                name, rate, values['lost_samples'], values['parse_errors'],
+                values['read_errors'], values['resets'], values['overflow_bytes'],
+                values['backlog'].percentile(99), values['queued'].percentile(99),
+                1000 * values['processing'].percentile(99),
+                1000 * values['draw_latency'].percentile(99)))
+
+
+def prometheus(devices):
+    '''The metrics of every device in the Prometheus text format'''
+    lines = list()
+    stats = [(name, daq.stats()) for name, daq in sorted(devices.items())]
+    for counter in COUNTERS:
+        lines.append('# TYPE daq_%s_total counter' % (counter, ))
+        for name, values in stats:
+            lines.append('daq_%s_total{device="%s"} %d' % (counter, name, values[counter]))
+    for histogram in HISTOGRAMS:
+        lines.append('# TYPE daq_%s histogram' % (histogram, ))
+        for name, values in stats:
+            h = values[histogram]
+            seen = 0
+            for bound, count in zip(h.bounds, h.counts):
+                seen += count
+                lines.append('daq_%s_bucket{device="%s",le="%g"} %d' % (histogram, name, bound, seen))
+            lines.append('daq_%s_bucket{device="%s",le="+Inf"} %d' % (histogram, name, h.count))
+            lines.append('daq_%s_sum{device="%s"} %r' % (histogram, name, h.sum))
+            lines.append('daq_%s_count{device="%s"} %d' % (histogram, name, h.count))
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsLogger(Thread):
+    '''Prints a line per device in ``devices`` (a name -> DAQThread
+        mapping) every ``interval`` seconds, with the sample rate achieved
+        since the previous line'''
+
+    def __init__(self, devices, interval=DEFAULT_INTERVAL):
+        super(MetricsLogger, self).__init__()
+        self.daemon = True
+        self.devices = devices
+        self.interval = interval
+        self.keep_running = True
+        self._last = dict()
+
+    def run(self):
+        next_line = time() + self.interval
+        while self.keep_running:
+            sleep(min(0.5, max(0, next_line - time())))
+            if time() < next_line:
+                continue
+            next_line += self.interval
+            for line in self.lines():
+                print line
+
+    def lines(self):
+        lines = list()
+        for name, daq in sorted(self.devices.items()):
+            values = daq.stats()
+            samples, elapsed = self._last.get(name, (0, 0.0))
+            self._last[name] = (values['samples'], values['elapsed'])
+            rate = (values['samples'] - samples) / max(1e-9, values['elapsed'] - elapsed)
+            lines.append(format_line(name, values, rate))
+        return lines
+
+    def stop(self):
+        self.keep_running = False
+        if self.is_alive():
+            self.join()
+
+
+class MetricsServer(Thread):
+    '''Serves prometheus(devices) at http://host:port/metrics. port=0
+        picks a free port, see .port.'''
+
+    def __init__(self, devices, host='127.0.0.1', port=DEFAULT_PORT):
+        from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+        super(MetricsServer, self).__init__()
+        self.daemon = True
+        self.devices = devices
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = prometheus(server.devices)
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = HTTPServer((host, port), Handler)
+        self.port = self.httpd.server_address[1]
+
+    def run(self):
+        self.httpd.serve_forever(poll_interval=0.5)
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
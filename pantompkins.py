@@ -0,0 +1,317 @@
+'''Host-side port of the Pan-Tompkins QRS detector that runs in the ISR of
+Arduino/src/PulseSensorAmped.ino.
+
+The filter stages (low-pass, high-pass, derivative, squaring and moving
+window integration) are evaluated for a whole chunk of raw ``K`` samples at
+a time with NumPy. Only the adaptive threshold logic, which depends on its
+own history, steps through individual samples, and only those where
+something can happen: derivative peaks, searchback and timeouts.
+
+Integer arithmetic follows the firmware, including C's truncating division
+and the 16 bit ``int`` / 32 bit ``long`` wraparound of the ATmega, so beats
+land on the same samples the firmware reports. Two firmware quirks are
+reproduced on purpose:
+
+* ``was_rising_i`` is read after ``is_rising_i`` has been cleared, so peaks
+  of the integrated signal are never detected. Only derivative peaks become
+  beats or searchback candidates, and the integrated-peak state is omitted.
+* a timeout reset restarts ``sample_count`` and the filters but keeps the
+  pending searchback candidate.'''
+from collections import namedtuple
+
+import numpy as np
+
+from protocol import rr_to_bpm
+
+SAMPLE_RATE = 200
+U32 = 0xFFFFFFFF
+LOW_PASS = np.array([1, 2, 3, 4, 5, 6, 5, 4, 3, 2, 1], dtype=np.int64)
+
+# index is the position in the stream fed to the detector, sample is the
+# firmware's sample_count for the beat (what it sends with a 'B' prefix)
+Beat = namedtuple('Beat', 'index sample peak_type average_RR1 average_RR2')
+
+
+def _tdiv(a, b):
+    '''C integer division, which truncates toward zero'''
+    q = abs(a) // abs(b)
+    if (a < 0) != (b < 0):
+        return -q
+    return q
+
+
+def _int16(x):
+    return ((x + 0x8000) & 0xFFFF) - 0x8000
+
+
+def _long(x):
+    return ((x + 0x80000000) & U32) - 0x80000000
+
+
+class PanTompkins(object):
+    '''Streaming detector; feed() it raw ``K`` samples in chunks of any
+        size and it returns the beats completed by each chunk.'''
+
+    def __init__(self):
+        self.index = 0  # stream position of the next sample
+        self._base = -1  # stream position where sample_count was 0
+        self.sample_count = 0
+        self.last_R_sample = 0
+        self.beat_count = 0
+        self.rr_intervals1 = [0] * 8
+        self.rr_intervals2 = [0] * 8
+        self.average_RR1 = 950
+        self.average_RR2 = 1000
+        self.intervals_skipped = 0
+        self.peak_type = -1
+        self.prior_max_slope = 0
+        self.thresh1_i = 30000
+        self.thresh2_i = 15000
+        self.npk_i = 15000
+        self.spk_i = 70000
+        self.thresh1_f = 1375
+        self.thresh2_f = 688
+        self.npk_f = 2500
+        self.spk_f = 1000
+        self.candidate_peak_index_f = 0
+        self.candidate_peak_val_f = [15000, 688]
+        self.resets = 0
+        self._max_slope = 0
+        self._diff = 0
+        self._clear_filters()
+
+    @property
+    def bpm1(self):
+        return rr_to_bpm(self.average_RR1)
+
+    @property
+    def bpm2(self):
+        return rr_to_bpm(self.average_RR2)
+
+    @property
+    def pulse_regular(self):
+        '''What the firmware sends with the 'N' prefix'''
+        return self.average_RR2 == self.average_RR1 and self.beat_count > 7
+
+    def _clear_filters(self):
+        self._ecg = np.zeros(len(LOW_PASS) - 1, dtype=np.int64)
+        self._low_pass = np.zeros(32, dtype=np.int64)
+        self._high_pass = np.zeros(4, dtype=np.int64)
+        self._squared = np.zeros(29, dtype=np.int64)
+        self._integrated = 0
+
+    def feed(self, ecg):
+        '''Runs a chunk of raw ``K`` samples through the detector and
+            returns the list of Beats found while processing it.'''
+        ecg = np.asarray(ecg, dtype=np.int64)
+        beats = list()
+        start = 0
+        while start < len(ecg):
+            start += self._run(ecg[start:], beats)
+        return beats
+
+    def _filter(self, ecg):
+        '''The firmware's filter stages for a chunk, continuing from (and
+            then updating) the saved filter history.'''
+        x = np.concatenate((self._ecg, ecg))
+        low_pass = np.concatenate((self._low_pass, np.convolve(x, LOW_PASS, 'valid')))
+        change = low_pass[:-32] - low_pass[32:]
+        term = low_pass[16:-16] - low_pass[15:-17] + np.sign(change) * (np.abs(change) // 32)
+        high_pass = np.concatenate((self._high_pass, self._high_pass[-1] + np.cumsum(term)))
+        diff = 2 * high_pass[4:] + high_pass[3:-1] - high_pass[1:-3] - 2 * high_pass[:-4]
+        squared = np.concatenate((self._squared, ((diff * diff) & U32) // 64))
+        window = np.concatenate(([0], np.cumsum(squared)))
+        integrated = (window[30:] - window[:-30]) // 30
+        self._ecg = x[-(len(LOW_PASS) - 1):]
+        self._low_pass = low_pass[-32:]
+        self._high_pass = high_pass[-4:]
+        self._squared = squared[-29:]
+        # integrated[1] and last_diff as seen by each sample
+        integrated_prev = np.concatenate(([self._integrated], integrated[:-1]))
+        last_diff = np.concatenate(([self._diff], diff[:-1]))
+        self._integrated = integrated[-1]
+        self._diff = diff[-1]
+        return high_pass[3:-1], squared[29:], integrated, integrated_prev, last_diff, diff
+
+    def _run(self, ecg, beats):
+        '''Processes ecg until it ends or a timeout resets the firmware
+            state, returning the number of samples consumed.'''
+        n = len(ecg)
+        high_pass_prev, squared, integrated, integrated_prev, last_diff, diff = self._filter(ecg)
+        count0 = self.sample_count
+        peaks = np.flatnonzero((last_diff > 0) & (diff < 0))
+        peaks = peaks[peaks + count0 + 1 > 60].tolist()
+        self._squared_chunk = squared
+        self._diff_chunk = diff
+        self._slope_from = 0
+        p = 0
+        j = 0
+        consumed = n
+        while True:
+            at = min(peaks[p] if p < len(peaks) else n,
+                     self._next_searchback(j, count0),
+                     max(j, self.last_R_sample + 1000 - count0))
+            if at >= n:
+                break
+            j = at
+            is_peak = p < len(peaks) and peaks[p] == j
+            if is_peak:
+                p += 1
+            if self._step(j, count0 + j + 1, is_peak, int(high_pass_prev[j]),
+                          int(integrated[j]), int(integrated_prev[j]), beats):
+                consumed = j + 1
+                break
+            j += 1
+        if consumed == n:
+            self._max_slope = self._slope(n - 1)
+            self.sample_count = count0 + n
+        self.index += consumed
+        return consumed
+
+    def _next_searchback(self, j, count0):
+        '''Earliest chunk position at or after j where searchback could
+            find the current candidate'''
+        if self.candidate_peak_index_f == 0 or self.candidate_peak_val_f[0] <= self.thresh2_i:
+            return float('inf')
+        if self.last_R_sample > count0 + j + 1:
+            return j  # sample_count - last_R_sample wraps, check every sample
+        gap = ((166 * self.average_RR2) & U32) // 500 + 1
+        return max(j, self.last_R_sample + gap - count0 - 1)
+
+    def _slope(self, j):
+        '''max_slope as the firmware would hold it after sample j'''
+        window = self._squared_chunk[self._slope_from:j + 1]
+        if len(window):
+            return max(self._max_slope, int(window.max()))
+        return self._max_slope
+
+    def _step(self, j, sample_count, is_peak, peak_val_f, integrated,
+              integrated_prev, beats):
+        '''One pass of the ISR's decision logic; returns True on a timeout
+            reset.'''
+        beat_happened_f = False
+        if is_peak:
+            if peak_val_f >= self.thresh1_f:
+                self.spk_f = _tdiv(peak_val_f + 7 * self.spk_f, 8)
+                beat_happened_f = True
+            else:
+                self.npk_f = _tdiv(peak_val_f + 7 * self.npk_f, 8)
+                if peak_val_f & U32 > self.candidate_peak_val_f[1]:
+                    self.candidate_peak_val_f = [integrated_prev, peak_val_f & U32]
+                    self.candidate_peak_index_f = sample_count
+            self._update_thresh_f()
+
+        if sample_count > self.last_R_sample + 40:
+            if (sample_count < self.last_R_sample + 72 and
+                    self._slope(j) < self.prior_max_slope // 2):
+                beat_happened_f = False  # more like a T-wave than a QRS
+            if beat_happened_f and integrated > self.thresh1_i:
+                self._beat_happened(j, sample_count, 0, beats)
+
+        if ((((sample_count - self.last_R_sample) & U32) * 500) & U32 >
+                (166 * self.average_RR2) & U32):
+            if (self.candidate_peak_index_f != 0 and
+                    self.candidate_peak_val_f[0] > self.thresh2_i):
+                peak_val_i, peak_val = self.candidate_peak_val_f
+                self._beat_happened(j, self.candidate_peak_index_f, 3, beats)
+                self.spk_i = (((peak_val_i + 3 * self.spk_i) & U32) // 4)
+                self._update_thresh_i()
+                self.spk_f = _tdiv(_long(peak_val) + 3 * self.spk_f, 4)
+                self._update_thresh_f()
+
+        if sample_count > self.last_R_sample + 1000:
+            self._timeout_reset(j)
+            return True
+        return False
+
+    def _update_thresh_f(self):
+        self.thresh1_f = self.npk_f + _tdiv(self.spk_f - self.npk_f, 2)
+        self.thresh2_f = self.npk_f
+
+    def _update_thresh_i(self):
+        self.thresh1_i = (self.npk_i + ((self.spk_i - self.npk_i) & U32) // 4) & U32
+        self.thresh2_i = self.thresh1_i // 2
+
+    def _beat_happened(self, j, at_sample, peak_type, beats):
+        if at_sample <= self.last_R_sample + 40:
+            return
+        self.beat_count += 1
+        self.peak_type = peak_type
+        if self.beat_count > 1:
+            self._update_RR_averages(_int16(((at_sample - self.last_R_sample) & U32) * 5))
+        if self.beat_count > 100:
+            self.beat_count = 10
+        self.last_R_sample = at_sample
+        self.prior_max_slope = self._slope(j)
+        self._max_slope = 0
+        self._slope_from = j + 1
+        self.candidate_peak_index_f = 0
+        self.candidate_peak_val_f = [0, self.thresh2_f & U32]
+        beats.append(Beat(self._base + at_sample, at_sample, peak_type,
+                          self.average_RR1, self.average_RR2))
+
+    def _update_RR_averages(self, current):
+        rr1 = self.rr_intervals1
+        rr1[1:] = rr1[:-1]
+        rr1[0] = current
+        older = [rr for rr in rr1[1:] if rr != 0]
+        self.average_RR1 = _int16(_tdiv(sum(older) + current, len(older) + 1))
+
+        if self.beat_count == 2:
+            self.average_RR2 = current
+            self.rr_intervals2[0] = current
+            return
+        scaled = _int16(current * 100)
+        if _int16(92 * self.average_RR2) < scaled < _int16(116 * self.average_RR2):
+            rr2 = self.rr_intervals2
+            rr2[1:] = rr2[:-1]
+            rr2[0] = current
+            older = [rr for rr in rr2[1:] if rr != 0]
+            self.average_RR2 = _int16(_tdiv(sum(older) + current, len(older) + 1))
+            self.intervals_skipped = 0
+        else:
+            self.intervals_skipped += 1
+            if self.intervals_skipped > 3:
+                # not in the original Pan Tompkins; the firmware only clears
+                # the newest interval here
+                self.average_RR2 = _int16(_tdiv(
+                    _int16(self.average_RR2 + _int16(3 * self.average_RR1)), 4))
+                self.rr_intervals2[0] = 0
+                self.intervals_skipped = 2
+
+    def _timeout_reset(self, j):
+        self._max_slope = self._slope(j)
+        self._base = self.index + j
+        self.resets += 1
+        self.sample_count = 0
+        self.last_R_sample = 0
+        self.beat_count = 0
+        self.average_RR2 = 1000
+        self.average_RR1 = 950
+        self.rr_intervals1 = [0] * 8
+        self.rr_intervals2 = [0] * 8
+        self._clear_filters()
+        self.thresh1_i = 9000
+        self.thresh2_i = 4500
+        self.spk_i = 9000
+        self.npk_i = 1500
+        self.thresh1_f = 1375
+        self.thresh2_f = 688
+        self.spk_f = 2500
+        self.npk_f = 1000
+        self.prior_max_slope = 0
+        # last_diff is zeroed but diff is not, so the first sample after a
+        # reset still sees the old diff as last_diff
+        self._diff = int(self._diff_chunk[j])
+
+
+def detect(ecg, chunk=None):
+    '''Runs a whole recording of raw ``K`` samples through a fresh
+        detector, optionally in chunks, and returns its Beats.'''
+    detector = PanTompkins()
+    if chunk is None:
+        return detector.feed(ecg)
+    beats = list()
+    for start in range(0, len(ecg), chunk):
+        beats.extend(detector.feed(ecg[start:start + chunk]))
+    return beats
@@ -0,0 +1,203 @@
+'''Decoding of the serial stream written by Arduino/src/PulseSensorAmped.ino
+
+The firmware speaks one of two framings:
+
+* text, one ``<prefix><decimal>\\r\\n`` line per value
+* binary (``binaryOutput = true``), one fixed-layout FRAME per sample
+
+Both decoders yield the same (prefix, value) records so DAQThread does not
+need to know which one is in use.'''
+import struct
+
+SYNC = '\xa5'
+FLAG_PULSE_REGULAR = 0x01
+FLAG_BEAT = 0x02
+FLAG_RESET = 0x04
+# sync, flags, S, K, G, P, O, F, D, Q, I, T, Y, H, B offset, W, R, checksum
+FRAME = struct.Struct('<BBIhhHHiiIIIiiHbIB')
+FRAME_PREFIXES = 'SKGPONFDQITYH'
+
+
+def edr_kohm(value):
+    '''Skin resistance in kOhm from a 'G' value, -1 when saturated'''
+    if value < 1024:
+        return value * 220 / (1024 - value)
+    return -1
+
+
+def rr_to_bpm(rr):
+    '''Beats per minute from a 'P' or 'O' RR average in milliseconds'''
+    if rr == 0:
+        return -1
+    return 60000.0 / rr
+
+
+class TextDecoder(object):
+    '''Splits the Arduino's ``<prefix><decimal>\\r\\n`` text stream into
+        (prefix, value) records. Bytes may be fed in arbitrary chunks; a
+        partial trailing line is held until the rest of it arrives.'''
+
+    def __init__(self):
+        self._partial = ''
+        self.bad_lines = 0
+        self.last_bad_line = None
+
+    def feed(self, data):
+        '''Returns the records for every line completed by data'''
+        lines = (self._partial + data).split('\n')
+        self._partial = lines.pop()
+        records = list()
+        append = records.append
+        for line in lines:
+            try:
+                append((line[0], long(line[1:])))
+            except (ValueError, IndexError):
+                if line.strip():
+                    self.bad_lines += 1
+                    self.last_bad_line = line
+        return records
+
+
+def frame_checksum(frame):
+    '''Sum of every byte between the sync byte and the checksum, mod 256'''
+    return sum(bytearray(frame[1:-1])) & 0xFF
+
+
+def encode_frame(sample, ecg, edr, rr2, rr1, high_pass, diff, squared,
+                 integrated, thresh1_i, thresh1_f, thresh2_f,
+                 pulse_regular=False, beat=None, peak_type=0, reset=0):
+    '''Packs one sample the way the firmware's queue_frame() does. beat
+        is the sample number of a newly detected beat, if any.'''
+    flags = 0
+    beat_offset = 0
+    if pulse_regular:
+        flags |= FLAG_PULSE_REGULAR
+    if beat is not None:
+        flags |= FLAG_BEAT
+        beat_offset = sample - beat
+    if reset:
+        flags |= FLAG_RESET
+    frame = FRAME.pack(ord(SYNC), flags, sample, ecg, edr, rr2, rr1,
+                       high_pass, diff, squared, integrated, thresh1_i,
+                       thresh1_f, thresh2_f, beat_offset, peak_type, reset, 0)
+    return frame[:-1] + chr(frame_checksum(frame))
+
+
+class BinaryDecoder(object):
+    '''Decodes binary FRAMEs into the same records the text framing would
+        have produced. Bytes that do not start with SYNC count as a framing
+        error (once per resynchronization) and frames whose checksum does
+        not match count as checksum errors.'''
+
+    def __init__(self):
+        self._partial = ''
+        self.frames = 0
+        self.framing_errors = 0
+        self.checksum_errors = 0
+
+    def feed(self, data):
+        buf = self._partial + data
+        size = FRAME.size
+        records = list()
+        extend = records.extend
+        i = 0
+        while len(buf) - i >= size:
+            if buf[i] != SYNC:
+                self.framing_errors += 1
+                i = buf.find(SYNC, i + 1)
+                if i < 0:
+                    i = len(buf)
+                continue
+            frame = buf[i:i + size]
+            if frame_checksum(frame) != ord(frame[-1]):
+                self.checksum_errors += 1
+                i = buf.find(SYNC, i + 1)
+                if i < 0:
+                    i = len(buf)
+                continue
+            i += size
+            self.frames += 1
+            fields = FRAME.unpack(frame)
+            flags = fields[1]
+            if flags & FLAG_RESET:
+                records.append(('R', fields[16]))
+            extend(zip(FRAME_PREFIXES, fields[2:7] + (flags & FLAG_PULSE_REGULAR, ) + fields[7:14]))
+            if flags & FLAG_BEAT:
+                records.append(('B', fields[2] - fields[14]))
+                records.append(('W', fields[15]))
+        self._partial = buf[i:]
+        return records
+
+
+def detect_mode(buf):
+    '''Returns 'binary' or 'text' once buf holds a valid frame or two
+        valid lines, otherwise None.'''
+    i = buf.find(SYNC)
+    while 0 <= i <= len(buf) - FRAME.size:
+        frame = buf[i:i + FRAME.size]
+        if frame_checksum(frame) == ord(frame[-1]):
+            return 'binary'
+        i = buf.find(SYNC, i + 1)
+    text = buf.split(SYNC)[0]
+    decoder = TextDecoder()
+    # the first line is usually only the tail end of one
+    if len(decoder.feed(text[text.find('\n') + 1:])) >= 2 and not decoder.bad_lines:
+        return 'text'
+    return None
+
+
+class AutoDecoder(object):
+    '''Detects whether the firmware is sending text or binary and then
+        delegates to the matching decoder. Detection is repeated if the
+        stream stops decoding, e.g. after the firmware is reflashed.'''
+
+    max_pending = 4096
+    max_misses = 8
+
+    def __init__(self):
+        self.mode = None
+        self.text = TextDecoder()
+        self.binary = BinaryDecoder()
+        self._pending = ''
+        self._misses = 0
+
+    @property
+    def bad_lines(self):
+        return self.text.bad_lines
+
+    @property
+    def last_bad_line(self):
+        return self.text.last_bad_line
+
+    @property
+    def framing_errors(self):
+        return self.binary.framing_errors
+
+    @property
+    def checksum_errors(self):
+        return self.binary.checksum_errors
+
+    def errors(self):
+        return self.text.bad_lines + self.binary.framing_errors + self.binary.checksum_errors
+
+    def feed(self, data):
+        if self.mode is None:
+            self._pending += data
+            self.mode = detect_mode(self._pending)
+            if self.mode is None:
+                self._pending = self._pending[-self.max_pending:]
+                return []
+            data = self._pending
+            self._pending = ''
+        errors = self.errors()
+        records = getattr(self, self.mode).feed(data)
+        if records or self.errors() == errors:
+            self._misses = 0
+        else:
+            self._misses += 1
+            if self._misses > self.max_misses:
+                self.mode = None
+                self._misses = 0
+                self.text._partial = ''
+                self.binary._partial = ''
+        return records
@@ -0,0 +1,132 @@
+'''The reading half of DAQThread's two stage pipeline.
+
+SerialReader is a thread that does nothing but move bytes from a source
+into a ByteRing, so the UART is drained even while parsing and storing
+(or anything else holding the GIL, such as a redraw) falls behind. The
+processing stage takes everything queued in the ring at once and decodes
+it as one batch.
+
+ByteRing is a preallocated ring of bytes for exactly one writer and one
+reader. Each side only ever advances its own position, so no lock is
+needed; a write that does not fit is cut short and counted rather than
+blocking the reader thread.'''
+from collections import deque
+from threading import Event, Thread
+from time import sleep, time
+
+RING_SIZE = 1 << 20  # bytes, about 100 s of binary frames
+HIGH_WATER = 0.75  # fill level counted as backpressure
+
+
+class ByteRing(object):
+    def __init__(self, capacity=RING_SIZE, high_water=HIGH_WATER):
+        self.capacity = capacity
+        self.high_water = int(capacity * high_water)
+        self._buffer = bytearray(capacity)
+        self.written = 0  # only advanced by write()
+        self.consumed = 0  # only advanced by read()
+        self.overflows = 0
+        self.overflow_bytes = 0
+        self.backpressure = 0
+        self.closed = False
+        self.readable = Event()
+        # (position, time) of every write, for the age of the oldest byte
+        self._stamps = deque()
+
+    def __len__(self):
+        return self.written - self.consumed
+
+    def write(self, data):
+        '''Queues as much of data as fits, returns how much that was'''
+        queued = self.written - self.consumed
+        free = self.capacity - queued
+        if len(data) > free:
+            self.overflows += 1
+            self.overflow_bytes += len(data) - free
+            data = data[:free]
+        size = len(data)
+        if not size:
+            return 0
+        if queued + size > self.high_water:
+            self.backpressure += 1
+        start = self.written % self.capacity
+        first = min(size, self.capacity - start)
+        self._buffer[start:start + first] = data[:first]
+        if first < size:
+            self._buffer[:size - first] = data[first:]
+        self._stamps.append((self.written, time()))
+        self.written += size
+        self.readable.set()
+        return size
+
+    def close(self):
+        '''No more writes are coming; a blocked read() returns and later
+            ones do not block'''
+        self.closed = True
+        self.readable.set()
+
+    def read(self, block=False):
+        '''Everything queued, with block=True waiting for a write or
+            close() when there is nothing. Returns the bytes and the time
+            the oldest of them was written, None without any.'''
+        self.readable.clear()
+        # closed is checked after clear(), so a close() in between still
+        # leaves readable set
+        if self.written == self.consumed and block and not self.closed:
+            # without a timeout Python 2 waits on the lock instead of polling
+            self.readable.wait()
+        end = self.written
+        if end == self.consumed:
+            return '', None
+        arrival = None
+        stamps = self._stamps
+        while stamps and stamps[0][0] < end:
+            position, stamp = stamps.popleft()
+            if arrival is None:
+                arrival = stamp
+        start = self.consumed % self.capacity
+        stop = start + end - self.consumed
+        if stop <= self.capacity:
+            data = str(self._buffer[start:stop])
+        else:
+            data = str(self._buffer[start:]) + str(self._buffer[:stop - self.capacity])
+        self.consumed = end
+        return data, arrival
+
+
+class SerialReader(Thread):
+    '''Drains ``source`` into ``ring`` until stopped or the source is
+        closed. Reads and read errors are counted in ``metrics``.'''
+
+    def __init__(self, source, ring, metrics):
+        super(SerialReader, self).__init__()
+        self.daemon = True
+        self.source = source
+        self.ring = ring
+        self.metrics = metrics
+        self.keep_running = True
+
+    def run(self):
+        source = self.source
+        write = self.ring.write
+        metrics = self.metrics
+        while self.keep_running and source.isOpen():
+            try:
+                waiting = source.inWaiting()
+                data = source.read(max(1, waiting))
+            except Exception:
+                if not source.isOpen():
+                    break
+                metrics.read_errors += 1
+                sleep(0.01)
+                continue
+            metrics.read(len(data), waiting)
+            if data:
+                write(data)
+        # lets a blocked reader of the ring notice
+        self.ring.close()
+
+    def stop(self):
+        self.keep_running = False
+        if self.is_alive():
+            self.join()
@@ -0,0 +1,256 @@
+'''Line data for the live plots, kept up to date incrementally.
+
+LiveTrace copies only the samples published since the previous frame
+into preallocated RingBuffers, and decimate() cuts the visible window
+down to about two points per pixel column, so a frame costs the same
+whether the session is one minute or one hour old.
+
+LiveTrace.limits() gives y limits that ignore the odd outlier: the 0.5th
+and 99.5th percentiles of the window, widened to the window's minimum and
+maximum (tracked with monotonic deques, see MovingExtremes) unless those
+are far outside. AxisLimits only moves an axis when the data leaves it or
+shrinks well inside it, so the plot is fully redrawn only then.
+
+OverviewWindow is the stretch of the whole session the overview strip
+shows, drawn from the channel pyramids (see DAQThread.overview()).'''
+from collections import deque
+
+import numpy as np
+
+from channelstore import RingBuffer
+
+MIN_CAPACITY = 256  # rows, LiveTrace doubles it while the window needs more
+PERCENTILES = (0.5, 99.5)
+OUTLIER = 1.0  # extremes further than this many percentile ranges out are ignored
+MARGIN = 0.125  # of the range, added above and below
+SHRINK = 0.5  # limits shrink once the data uses less than this part of them
+MIN_OVERVIEW = 10.0  # seconds, the overview zooms in no further
+
+
+def decimate(t, y, width, start=0):
+    '''Reduces (t, y) to the minimum and maximum of every ``width``-th of
+        the data, in the order they occur, so peaks survive. Columns are
+        aligned to the absolute sample number ``start`` of y[0] so they do
+        not shift from one frame to the next; samples after the last full
+        column are kept as they are.'''
+    count = len(y)
+    if width <= 0 or count <= 2 * width:
+        return t, y
+    per = -(-count // width)
+    offset = (-start) % per
+    columns = (count - offset) // per
+    if columns <= 0:
+        return t, y
+    end = offset + columns * per
+    block = y[offset:end].reshape(columns, per)
+    low = block.argmin(axis=1)
+    high = block.argmax(axis=1)
+    base = offset + np.arange(columns) * per
+    index = np.empty(2 * columns, dtype=np.intp)
+    index[0::2] = base + np.minimum(low, high)
+    index[1::2] = base + np.maximum(low, high)
+    index = np.concatenate((np.arange(offset), index, np.arange(end, count)))
+    return t[index], y[index]
+
+
+class MovingExtremes(object):
+    '''Minimum and maximum of the values of the last ``seconds``, in
+        amortized O(1) per value: each deque holds the (time, value)
+        pairs that can still become the extreme, in the order they
+        arrived. NaN marks a gap (see edr.py), it has no extremes.'''
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self._low = deque()
+        self._high = deque()
+
+    def extend(self, times, values):
+        if not len(times):
+            return
+        low = self._low
+        high = self._high
+        for time, value in zip(times, values):
+            if value != value:
+                continue
+            while low and low[-1][1] >= value:
+                low.pop()
+            low.append((time, value))
+            while high and high[-1][1] <= value:
+                high.pop()
+            high.append((time, value))
+        oldest = times[-1] - self.seconds
+        while low and low[0][0] < oldest:
+            low.popleft()
+        while high and high[0][0] < oldest:
+            high.popleft()
+
+    @property
+    def min(self):
+        return self._low[0][1] if self._low else None
+
+    @property
+    def max(self):
+        return self._high[0][1] if self._high else None
+
+
+class AxisLimits(object):
+    '''Y limits with hysteresis: update() only changes them when the data
+        range goes outside them or covers less than ``shrink`` of them'''
+
+    def __init__(self, limits, margin=MARGIN, shrink=SHRINK):
+        self.limits = tuple(limits)
+        self.margin = margin
+        self.shrink = shrink
+
+    def update(self, low, high):
+        '''Returns True when the limits changed'''
+        if low is None:
+            return False
+        bottom, top = self.limits
+        inside = bottom <= low and high <= top
+        if inside and high - low >= self.shrink * (top - bottom):
+            return False
+        span = max(high - low, 1e-9)
+        self.limits = (low - self.margin * span, high + self.margin * span)
+        return True
+
+
+class LiveTrace(object):
+    '''The newest ``seconds`` of time and the named channels of a
+        DAQThread, plus the beats and marks inside that window. The
+        buffers grow to the number of rows the window turns out to hold,
+        as that depends on the framing (text output sends about 28 rows
+        a second, binary 200).'''
+
+    def __init__(self, names, seconds):
+        self.names = tuple(names)
+        self.seconds = seconds
+        self.capacity = MIN_CAPACITY
+        self.clear()
+
+    def clear(self):
+        self.time = RingBuffer(self.capacity)
+        self.channels = dict((name, RingBuffer(self.capacity)) for name in self.names)
+        self.extremes = dict((name, MovingExtremes(self.seconds)) for name in self.names)
+        self.version = 0
+        self.snapshot = None
+
+    def _reserve(self, rows):
+        '''Makes room for ``rows`` more besides those in the window,
+            copying the window to buffers twice the size when needed'''
+        start = self._start()
+        needed = len(self.time) - start + rows
+        if needed <= self.capacity:
+            return
+        self.capacity = 2 * needed
+        time = RingBuffer(self.capacity)
+        time.extend(self.time[start:])
+        self.time = time
+        for name in self.names:
+            channel = RingBuffer(self.capacity)
+            channel.extend(self.channels[name][start:])
+            self.channels[name] = channel
+
+    def update(self, daq):
+        '''Copies what daq published since the last update, returns the
+            Snapshot it was taken from'''
+        snapshot = daq.snapshot(self.names, self.seconds, since=self.version)
+        if snapshot.version < self.version or snapshot.start > self.version:
+            # restarted, or so far behind that the window moved past us
+            self.clear()
+            snapshot = daq.snapshot(self.names, self.seconds)
+        self._reserve(len(snapshot.time))
+        self.time.extend(snapshot.time)
+        times = snapshot.time.tolist()
+        for name in self.names:
+            values = snapshot.channels[name]
+            self.channels[name].extend(values)
+            self.extremes[name].extend(times, values.tolist())
+        self.version = snapshot.version
+        self.snapshot = snapshot
+        return snapshot
+
+    def __len__(self):
+        return len(self.time) - self._start()
+
+    def _start(self):
+        '''Absolute index of the oldest sample inside the window'''
+        t = self.time[:]
+        if not len(t):
+            return self.time.first
+        return self.time.first + int(np.searchsorted(t, t[-1] - self.seconds, 'left'))
+
+    def last(self, name):
+        data = self.time if name == 'time' else self.channels[name]
+        if not len(data):
+            return 0
+        return data[-1]
+
+    def visible(self, name, width=None):
+        '''(time, values) of a channel over the window, decimated to
+            ``width`` pixel columns when given. The arrays are views or
+            fresh copies and stay valid until the next update().'''
+        start = self._start()
+        t = self.time[start:]
+        y = self.channels[name][start:]
+        if width is not None:
+            return decimate(t, y, width, start)
+        return t, y
+
+    def limits(self, name):
+        '''(low, high) of a channel over the window, robust to outliers
+            (see PERCENTILES and OUTLIER), or (None, None) without data'''
+        t, y = self.visible(name)
+        y = y[~np.isnan(y)]
+        if not len(y) or self.extremes[name].min is None:
+            return None, None
+        low, high = np.percentile(y, PERCENTILES)
+        spread = (high - low) * OUTLIER
+        extremes = self.extremes[name]
+        if extremes.min >= low - spread:
+            low = min(low, extremes.min)
+        if extremes.max <= high + spread:
+            high = max(high, extremes.max)
+        return float(low), float(high)
+
+
+class OverviewWindow(object):
+    '''The stretch of the session the overview strip shows: all of it
+        until zoomed in, then ``seconds`` that follow the newest sample
+        until scrolled back. Scrolling to the end follows again.'''
+
+    def __init__(self, minimum=MIN_OVERVIEW):
+        self.minimum = minimum
+        self.clear()
+
+    def clear(self):
+        self.seconds = None  # None: the whole session
+        self.end = None  # None: following the newest sample
+
+    def range(self, newest):
+        '''(start, stop) in seconds when the newest sample is at
+            ``newest``'''
+        if self.seconds is None:
+            return 0.0, max(newest, self.minimum)
+        end = newest if self.end is None else min(self.end, newest)
+        end = max(end, self.seconds)
+        return end - self.seconds, end
+
+    def zoom(self, factor, at, newest):
+        '''Scales the range by ``factor`` keeping the time ``at`` where
+            it is'''
+        start, stop = self.range(newest)
+        seconds = max((stop - start) * factor, self.minimum)
+        if seconds >= newest:
+            self.clear()
+            return
+        end = at + (stop - at) * seconds / (stop - start)
+        self.seconds = seconds
+        self.end = None if end >= newest else end
+
+    def scroll(self, seconds, newest):
+        '''Moves the range ``seconds`` later (earlier when negative)'''
+        if self.seconds is None:
+            return
+        end = self.range(newest)[1] + seconds
+        self.end = None if end >= newest else max(end, self.seconds)
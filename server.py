@@ -0,0 +1,262 @@
+'''Serves live data to any number of local TCP clients.
+
+The protocol is one JSON object per line in both directions. A client
+subscribes with
+
+    {"subscribe": ["ecg", "edr"], "decimate": 4, "devices": ["ttyAMA0"]}
+
+Any of CHANNELS can be subscribed to, the features.FEATURES and
+edr.CHANNELS included.
+
+(``decimate`` and ``devices`` are optional; the latter defaults to every
+device) and from then on receives, for every device it subscribed to,
+
+    {"type": "data", "device": ..., "start": <first sample number>,
+     "time": [...], "ecg": [...], "edr": [...], "pulse_regular": true,
+     "stamp": <server time>}
+    {"type": "beats", "device": ..., "time": [...], "peak_type": [...]}
+    {"type": "marks", "device": ..., "time": [...]}
+
+``decimate`` keeps every n-th sample, counted from sample 0 so the kept
+samples do not depend on when a message was cut. Each client has a
+bounded queue of messages: when a client does not keep up the oldest
+queued data is discarded (reported in a {"type": "dropped"} message once
+it catches up) and a client that stays full for ``drop_after`` seconds
+is disconnected. Acquisition is never waited on, the server only reads
+DAQThread snapshots.'''
+from collections import deque
+import errno
+import json
+import select
+import socket
+from threading import Thread
+from time import time
+
+from edr import CHANNELS as EDR_CHANNELS
+from features import FEATURES
+
+CHANNELS = ('ecg', 'edr', 'bpm1', 'bpm2') + FEATURES + EDR_CHANNELS
+DEFAULT_PORT = 8765
+
+
+class Client(object):
+    def __init__(self, sock, address, queue_size):
+        self.sock = sock
+        self.address = address
+        self.queue = deque()
+        self.queue_size = queue_size
+        self.out = ''
+        self.incoming = ''
+        self.channels = None
+        self.devices = None
+        self.decimate = 1
+        self.dropped = 0
+        self.full_since = None
+
+    def send(self, message):
+        '''Queues a message, discarding the oldest one when full'''
+        if len(self.queue) >= self.queue_size:
+            self.queue.popleft()
+            self.dropped += 1
+            if self.full_since is None:
+                self.full_since = time()
+        self.queue.append(message)
+
+    def pending(self):
+        return bool(self.out or self.queue)
+
+    def flush(self):
+        '''Writes as much as the socket takes without blocking'''
+        while True:
+            if not self.out:
+                if not self.queue:
+                    self.full_since = None
+                    if self.dropped:
+                        self.out = json.dumps({'type': 'dropped', 'messages': self.dropped}) + '\n'
+                        self.dropped = 0
+                    else:
+                        return
+                else:
+                    self.out = self.queue.popleft()
+            try:
+                sent = self.sock.send(self.out)
+            except socket.error as e:
+                if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return
+                raise
+            self.out = self.out[sent:]
+            if self.out:
+                return
+
+
+class StreamServer(Thread):
+    '''Streams the devices in ``devices`` (a name -> DAQThread mapping such
+        as DeviceManager.devices) to TCP clients, publishing ``rate`` times
+        a second. port=0 picks a free port, see .port.'''
+
+    def __init__(self, devices, host='127.0.0.1', port=DEFAULT_PORT, rate=20,
+                 queue_size=64, drop_after=5.0):
+        super(StreamServer, self).__init__()
+        self.daemon = True
+        self.devices = devices
+        self.rate = rate
+        self.queue_size = queue_size
+        self.drop_after = drop_after
+        self.clients = dict()
+        self.disconnected = 0
+        self.keep_running = True
+        self.silent = False
+        self._versions = dict()
+        self._beats = dict()
+        self._marks = dict()
+        self._listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._listener.bind((host, port))
+        self._listener.listen(64)
+        self._listener.setblocking(False)
+        self.port = self._listener.getsockname()[1]
+
+    def be_quiet(self):
+        self.silent = True
+
+    def run(self):
+        interval = 1.0 / self.rate
+        next_tick = time()
+        while self.keep_running:
+            readers = [self._listener] + [client.sock for client in self.clients.values()]
+            writers = [client.sock for client in self.clients.values() if client.pending()]
+            timeout = max(0, next_tick - time())
+            readable, writable, _ = select.select(readers, writers, [], timeout)
+            for sock in readable:
+                if sock is self._listener:
+                    self._accept()
+                elif sock in self.clients:
+                    self._receive(self.clients[sock])
+            for sock in writable:
+                if sock in self.clients:
+                    self._flush(self.clients[sock])
+            if time() >= next_tick:
+                next_tick += interval
+                if next_tick < time():
+                    next_tick = time() + interval
+                self.publish()
+        for client in self.clients.values():
+            client.sock.close()
+        self._listener.close()
+
+    def stop(self):
+        self.keep_running = False
+        if self.is_alive():
+            self.join()
+
+    def _accept(self):
+        try:
+            sock, address = self._listener.accept()
+        except socket.error:
+            return
+        sock.setblocking(False)
+        self.clients[sock] = Client(sock, address, self.queue_size)
+        self.clients[sock].send(json.dumps({
+            'type': 'hello', 'devices': list(self.devices), 'channels': list(CHANNELS)}) + '\n')
+
+    def _disconnect(self, client, reason=None):
+        if reason and not self.silent:
+            print 'Disconnecting %s:%d, %s' % (client.address[0], client.address[1], reason)
+        del self.clients[client.sock]
+        client.sock.close()
+        self.disconnected += 1
+
+    def _receive(self, client):
+        try:
+            data = client.sock.recv(4096)
+        except socket.error:
+            data = ''
+        if not data:
+            self._disconnect(client)
+            return
+        client.incoming += data
+        while '\n' in client.incoming:
+            line, client.incoming = client.incoming.split('\n', 1)
+            try:
+                request = json.loads(line)
+                channels = [str(name) for name in request['subscribe']]
+                devices = [str(name) for name in request.get('devices', self.devices)]
+                decimate = max(1, int(request.get('decimate', 1)))
+            except (ValueError, KeyError, TypeError):
+                client.send(json.dumps({'type': 'error', 'line': line}) + '\n')
+                continue
+            client.channels = [name for name in channels if name in CHANNELS]
+            client.devices = [name for name in devices if name in self.devices]
+            client.decimate = decimate
+
+    def _flush(self, client):
+        try:
+            client.flush()
+        except socket.error:
+            self._disconnect(client)
+
+    def publish(self):
+        '''Queues what every device published since the last call for
+            every subscribed client'''
+        now = time()
+        for name, daq in self.devices.items():
+            # clients get what is published from the first tick on
+            since = self._versions.get(name, daq.version)
+            snapshot = daq.snapshot(CHANNELS, since=since)
+            if snapshot.version < since:
+                # the device restarted
+                snapshot = daq.snapshot(CHANNELS, since=0)
+            self._versions[name] = snapshot.version
+            count = min(len(daq.beats), len(daq.beat_type))
+            beats = (daq.beats[self._beats.get(name, count):count],
+                     daq.beat_type[self._beats.get(name, count):count])
+            self._beats[name] = count
+            count = len(daq.mark_times)
+            marks = daq.mark_times[self._marks.get(name, count):count]
+            self._marks[name] = count
+            self._fan_out(name, snapshot, beats, marks, now)
+        for client in self.clients.values():
+            if client.full_since is not None and now - client.full_since > self.drop_after:
+                self._disconnect(client, 'not keeping up')
+            elif client.pending():
+                self._flush(client)
+
+    def _fan_out(self, name, snapshot, beats, marks, now):
+        encoded = dict()
+        beat_message = None
+        mark_message = None
+        if beats[0]:
+            beat_message = json.dumps({'type': 'beats', 'device': name, 'time': beats[0],
+                                       'peak_type': beats[1]}) + '\n'
+        if marks:
+            mark_message = json.dumps({'type': 'marks', 'device': name, 'time': marks}) + '\n'
+        for client in self.clients.values():
+            if client.channels is None or name not in client.devices:
+                continue
+            if len(snapshot.time):
+                key = (tuple(client.channels), client.decimate)
+                if key not in encoded:
+                    encoded[key] = self._encode(name, snapshot, client.channels,
+                                                client.decimate, now)
+                if encoded[key] is not None:
+                    client.send(encoded[key])
+            if beat_message is not None:
+                client.send(beat_message)
+            if mark_message is not None:
+                client.send(mark_message)
+
+    def _encode(self, name, snapshot, channels, decimate, now):
+        offset = (-snapshot.start) % decimate
+        if offset >= len(snapshot.time):
+            return None
+        message = {'type': 'data', 'device': name, 'start': snapshot.start + offset,
+                   'time': snapshot.time[offset::decimate].tolist(),
+                   'pulse_regular': bool(snapshot.pulse_regular), 'stamp': now}
+        for channel in channels:
+            values = snapshot.channels[channel][offset::decimate]
+            if channel in FEATURES or channel in EDR_CHANNELS:
+                # JSON has no NaN, features not known yet and EDR gaps are null
+                message[channel] = [None if x != x else x for x in values.tolist()]
+            else:
+                message[channel] = values.tolist()
+        return json.dumps(message) + '\n'
@@ -0,0 +1,205 @@
+'''Append-only, columnar recording of everything the Arduino sends.
+
+A session is a directory holding
+
+* ``header.json`` with the start time and the column layout
+* one ``<prefix>.bin`` file of little-endian int64 per per-sample prefix
+  (``S``, ``K``, ``G``, ...), one row per sample, raw values as received
+* ``beats.bin``, ``resets.bin`` and ``marks.bin``, small structured arrays
+  keyed by the row they occurred in
+
+Rows are buffered and appended in blocks, so a crash loses at most one
+block. Session reads the files back with np.memmap.'''
+from datetime import datetime
+import errno
+import json
+import os
+
+import numpy as np
+
+COLUMNS = 'SKGPONFDQITYH'
+BEAT = np.dtype([('row', '<i8'), ('sample', '<i8'), ('type', '<i8')])
+RESET = np.dtype([('row', '<i8'), ('value', '<i8')])
+MARK = np.dtype([('row', '<i8'), ('time', '<f8')])
+TIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+SAMPLE_RATE = 200
+
+# DAQThread's channel names for the raw columns
+CHANNELS = {'ecg': 'K', 'edr': 'G', 'bpm2': 'P', 'bpm1': 'O',
+            'pulse_regular': 'N', 'hp': 'F', 'diff': 'D', 'sqr': 'Q',
+            'integrated': 'I', 'thresh_i': 'T', 'thresh1_f': 'Y',
+            'thresh2_f': 'H'}
+
+
+def session_path(record_dir, start_time):
+    '''Creates and returns a new, empty session directory named after
+        start_time, with a _2, _3, ... suffix when a session started in
+        the same second'''
+    if not os.path.isdir(record_dir):
+        try:
+            os.makedirs(record_dir)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+    name = os.path.join(record_dir, start_time.strftime('%Y-%m-%d_%H-%M-%S'))
+    path = name
+    suffix = 1
+    while True:
+        try:
+            os.mkdir(path)
+            return path
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        suffix += 1
+        path = '%s_%d' % (name, suffix)
+
+
+class SessionWriter(object):
+    '''Streams (prefix, value) records into a session directory. A row is
+        completed by the next 'S'; a prefix missing from a row keeps the
+        value it had in the row before.'''
+
+    def __init__(self, path, start_time, block=200):
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self.path = path
+        self.rows = 0
+        self._columns = dict((prefix, i) for i, prefix in enumerate(COLUMNS))
+        self._block = np.zeros((len(COLUMNS), block), dtype=np.int64)
+        self._buffered = 0
+        self._row = np.zeros(len(COLUMNS), dtype=np.int64)
+        self._started = False
+        self._beat = None
+        self._files = [open(self._file('%s.bin' % (prefix, )), 'ab') for prefix in COLUMNS]
+        self._beats = open(self._file('beats.bin'), 'ab')
+        self._resets = open(self._file('resets.bin'), 'ab')
+        self._marks = open(self._file('marks.bin'), 'ab')
+        with open(self._file('header.json'), 'w') as f:
+            json.dump({'version': 1,
+                       'start_time': start_time.strftime(TIME_FORMAT),
+                       'sample_rate': SAMPLE_RATE,
+                       'columns': list(COLUMNS),
+                       'dtype': '<i8'}, f)
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def record(self, prefix, value):
+        column = self._columns.get(prefix)
+        if column is not None:
+            if column == 0:
+                if self._started:
+                    self._end_row()
+                self._started = True
+            self._row[column] = value
+        elif prefix == 'B':
+            if self._beat is not None:
+                self._write_beat(-1)
+            self._beat = value
+        elif prefix == 'W':
+            self._write_beat(value)
+        elif prefix == 'R':
+            self._write(self._resets, RESET, (self.rows, value))
+
+    def mark(self, row, time):
+        self._write(self._marks, MARK, (row, time))
+
+    def _write_beat(self, peak_type):
+        if self._beat is not None:
+            self._write(self._beats, BEAT, (self.rows, self._beat, peak_type))
+            self._beat = None
+
+    def _write(self, f, dtype, record):
+        np.array([record], dtype=dtype).tofile(f)
+        f.flush()
+
+    def _end_row(self):
+        self._block[:, self._buffered] = self._row
+        self._buffered += 1
+        self.rows += 1
+        if self._buffered == self._block.shape[1]:
+            self.flush()
+
+    def flush(self):
+        for column, f in enumerate(self._files):
+            self._block[column, :self._buffered].tofile(f)
+            f.flush()
+        self._buffered = 0
+
+    def close(self):
+        if self._started:
+            self._end_row()
+            self._started = False
+        self._write_beat(-1)
+        self.flush()
+        for f in self._files + [self._beats, self._resets, self._marks]:
+            f.close()
+
+
+class Session(object):
+    '''Read access to a recorded session. Raw columns are memory mapped,
+        converted channels are computed for just the rows asked for.'''
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'header.json')) as f:
+            self.header = json.load(f)
+        self.start_time = datetime.strptime(self.header['start_time'], TIME_FORMAT)
+        self.sample_rate = self.header['sample_rate']
+        self.columns = self.header['columns']
+        self.length = min(os.path.getsize(self._file('%s.bin' % (prefix, ))) // 8
+                          for prefix in self.columns)
+        self.beats = self._events('beats.bin', BEAT)
+        self.resets = self._events('resets.bin', RESET)
+        self.marks = self._events('marks.bin', MARK)
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def _events(self, name, dtype):
+        return np.fromfile(self._file(name), dtype=dtype)
+
+    def __len__(self):
+        return self.length
+
+    def column(self, prefix):
+        '''The raw values sent with prefix, one per row'''
+        if self.length == 0:
+            return np.zeros(0, dtype=np.int64)
+        return np.memmap(self._file('%s.bin' % (prefix, )), dtype='<i8',
+                         mode='r', shape=(self.length, ))
+
+    def time(self, start=0, stop=None):
+        '''Seconds since the first sample, accounting for Arduino resets
+            the way DAQThread does'''
+        samples = self.column('S')
+        if not len(samples):
+            return np.zeros(0)
+        if stop is None or stop > self.length:
+            stop = self.length
+        rows = np.arange(start, stop)
+        offsets = np.concatenate(([0], np.cumsum(self.resets['value'])))
+        # a reset recorded in row r applies from row r + 1 onwards
+        applied = np.searchsorted(self.resets['row'], rows, side='left')
+        return (samples[start:stop] - samples[0] + offsets[applied]) / float(self.sample_rate)
+
+    def channel(self, name, start=0, stop=None):
+        '''A DAQThread channel, converted from the raw column'''
+        if name == 'time':
+            return self.time(start, stop)
+        raw = self.column(CHANNELS[name])[start:stop]
+        if name == 'edr':
+            raw = raw.astype(np.float64)
+            return np.where(raw < 1024, np.floor(raw * 220 / np.maximum(1024 - raw, 1)), -1)
+        if name in ('bpm1', 'bpm2'):
+            return np.where(raw != 0, 60000.0 / np.where(raw != 0, raw, 1), -1)
+        return raw
+
+    def beat_times(self):
+        '''Beat times in seconds, converted the same way as DAQThread'''
+        if not len(self.beats):
+            return np.zeros(0)
+        rows = self.beats['row']
+        return (self.time()[rows] +
+                (self.beats['sample'] - self.column('S')[rows]) / float(self.sample_rate))
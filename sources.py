@@ -0,0 +1,375 @@
+'''Data sources DAQThread can read from.
+
+A source is anything with the part of the serial.Serial interface that
+DAQThread uses: open(), close(), isOpen(), inWaiting(), read() and
+readline(). SerialSource is the Gertboard's UART; the others stand in for
+it so that acquisition, plotting and the GUI can run without hardware.'''
+import math
+import os
+import select
+from time import sleep, time
+
+import numpy as np
+
+from protocol import encode_frame
+from session import Session, COLUMNS, SAMPLE_RATE
+
+
+class Source(object):
+    '''Interface for DAQThread data sources'''
+
+    timeout = 1
+
+    def open(self):
+        raise NotImplementedError
+
+    def close(self):
+        raise NotImplementedError
+
+    def isOpen(self):
+        raise NotImplementedError
+
+    def inWaiting(self):
+        '''Number of bytes that read() can return without blocking'''
+        raise NotImplementedError
+
+    def read(self, size=1):
+        '''Returns up to size bytes, blocking at most timeout seconds'''
+        raise NotImplementedError
+
+    def readline(self):
+        # the same read(1) loop pyserial uses
+        line = ''
+        while not line.endswith('\n'):
+            c = self.read(1)
+            if not c:
+                break
+            line += c
+        return line
+
+    def fileno(self):
+        '''A file descriptor for select(), or None if there is none'''
+        return None
+
+
+class SerialSource(Source):
+    '''A real serial port'''
+
+    def __init__(self, port='/dev/ttyAMA0', baudrate=115200, timeout=1):
+        import serial
+        self.timeout = timeout
+        self.serial = serial.Serial(port=port, baudrate=baudrate, timeout=timeout)
+
+    def open(self):
+        self.serial.open()
+
+    def close(self):
+        self.serial.close()
+
+    def isOpen(self):
+        return self.serial.isOpen()
+
+    def inWaiting(self):
+        return self.serial.inWaiting()
+
+    def read(self, size=1):
+        return self.serial.read(size)
+
+    def readline(self):
+        return self.serial.readline()
+
+    def fileno(self):
+        return self.serial.fileno()
+
+
+class PtySource(Source):
+    '''Reads from the master side of a pseudo-terminal. Anything that can
+        write to a serial port (another process, socat, a simulator) can
+        write to ``port`` instead, or in-process callers can use write().'''
+
+    def __init__(self, timeout=1):
+        import pty
+        import tty
+        self.timeout = timeout
+        self._master, self._slave = pty.openpty()
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+        self._open = False
+
+    def open(self):
+        self._open = True
+
+    def close(self):
+        self._open = False
+
+    def shutdown(self):
+        '''Closes both ends of the pseudo-terminal'''
+        self._open = False
+        os.close(self._master)
+        os.close(self._slave)
+
+    def isOpen(self):
+        return self._open
+
+    def inWaiting(self):
+        import fcntl
+        import struct
+        import termios
+        waiting = fcntl.ioctl(self._master, termios.FIONREAD, struct.pack('I', 0))
+        return struct.unpack('I', waiting)[0]
+
+    def read(self, size=1):
+        if not select.select([self._master], [], [], self.timeout)[0]:
+            return ''
+        return os.read(self._master, size)
+
+    def write(self, data):
+        return os.write(self._slave, data)
+
+    def fileno(self):
+        return self._master
+
+
+class BufferedSource(Source):
+    '''Base for sources that produce their bytes on demand. Subclasses
+        implement _fill(), which appends whatever is due to _buffer, and
+        _wait(), the number of seconds until more will be due.'''
+
+    def __init__(self, timeout=1):
+        self.timeout = timeout
+        self._buffer = ''
+        self._open = False
+        self._started = None
+
+    def open(self):
+        self._open = True
+        if self._started is None:
+            self._started = time()
+
+    def close(self):
+        self._open = False
+
+    def isOpen(self):
+        return self._open
+
+    def exhausted(self):
+        return False
+
+    def _fill(self):
+        raise NotImplementedError
+
+    def _wait(self):
+        raise NotImplementedError
+
+    def inWaiting(self):
+        self._fill()
+        return len(self._buffer)
+
+    def read(self, size=1):
+        deadline = time() + self.timeout
+        self._fill()
+        while not self._buffer and not self.exhausted():
+            now = time()
+            if now >= deadline:
+                break
+            sleep(max(0, min(self._wait(), deadline - now)))
+            self._fill()
+        data = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return data
+
+
+class ReplaySource(BufferedSource):
+    '''Plays a recorded session back as the byte stream the Arduino sent.
+        speed=1 replays in real time, larger values faster, and speed=None
+        produces data as fast as it is read. With binary=True the rows are
+        sent as binary frames instead of text lines.'''
+
+    def __init__(self, path, speed=1.0, binary=False, timeout=1, chunk_rows=256):
+        super(ReplaySource, self).__init__(timeout)
+        self.session = Session(path)
+        self.speed = speed
+        self.binary = binary
+        self.chunk_rows = chunk_rows
+        self._columns = [self.session.column(prefix) for prefix in COLUMNS]
+        self._times = self.session.time()
+        self._beats = dict((int(beat['row']), beat) for beat in self.session.beats)
+        self._resets = dict((int(reset['row']), int(reset['value']))
+                            for reset in self.session.resets)
+        self._row = 0
+
+    def exhausted(self):
+        return self._row >= len(self.session) and not self._buffer
+
+    def _due(self):
+        '''Number of rows that should have been sent by now'''
+        if self.speed is None:
+            if self._buffer:
+                return self._row
+            return min(self._row + self.chunk_rows, len(self.session))
+        elapsed = (time() - self._started) * self.speed
+        return int(np.searchsorted(self._times, elapsed, side='right'))
+
+    def _wait(self):
+        if self.speed is None or self._row >= len(self.session):
+            return 0
+        return self._times[self._row] / self.speed - (time() - self._started)
+
+    def _fill(self):
+        due = self._due()
+        if due > self._row:
+            self._buffer += ''.join(self._encode(row) for row in xrange(self._row, due))
+            self._row = due
+
+    def _encode(self, row):
+        values = [int(column[row]) for column in self._columns]
+        beat = self._beats.get(row)
+        reset = self._resets.get(row - 1, 0)
+        if self.binary:
+            s, k, g, p, o, n = values[:6]
+            kwargs = dict(pulse_regular=n, reset=reset)
+            if beat is not None and 0 <= s - beat['sample'] < 0x10000:
+                kwargs.update(beat=int(beat['sample']), peak_type=int(beat['type']))
+            return encode_frame(s, k, g, p, o, *values[6:], **kwargs)
+        lines = list()
+        if reset:
+            lines.append('R%d\r\n' % (reset, ))
+        lines.extend('%s%d\r\n' % (prefix, value) for prefix, value in zip(COLUMNS, values))
+        if beat is not None:
+            lines.append('B%d\r\nW%d\r\n' % (beat['sample'], beat['type']))
+        return ''.join(lines)
+
+
+def _ecg_template():
+    '''One PQRST complex in raw K units, sampled at 200 Hz around the R peak'''
+    t = np.arange(-0.35, 0.55, 1.0 / SAMPLE_RATE)
+    waves = ((-0.2, 0.09, 0.025), (-0.04, -0.1, 0.01), (0, 1.0, 0.012),
+             (0.035, -0.25, 0.012), (0.25, 0.3, 0.04))
+    return sum(220 * a * np.exp(-((t - c) / w) ** 2) for c, a, w in waves)
+
+
+class SyntheticSource(BufferedSource):
+    '''Generates a realistic stream (PQRST complexes with heart rate
+        variability, a drifting skin resistance with spontaneous skin
+        conductance responses, beats and RR averages) in the firmware's
+        text or binary framing.
+
+        rate is the number of samples sent per second of wall clock (None
+        for as fast as they are read) and may be many times 200 Hz; step is
+        how far the firmware's 200 Hz sample counter advances per sample
+        sent (the text firmware sends roughly every 7th sample). channels
+        selects the prefixes sent in text mode. Like a UART, at most
+        max_buffer unread bytes are held and the rest are dropped and
+        counted in dropped_bytes.'''
+
+    def __init__(self, rate=200, step=1, channels=COLUMNS, binary=False,
+                 heart_rate=70, seed=0, timeout=1, max_buffer=4096, chunk=64):
+        super(SyntheticSource, self).__init__(timeout)
+        self.rate = rate
+        self.step = step
+        self.channels = channels
+        self.binary = binary
+        self.heart_rate = heart_rate
+        self.max_buffer = max_buffer
+        self.chunk = chunk
+        self.sent = 0
+        self.dropped_bytes = 0
+        self._random = np.random.RandomState(seed)
+        self._template = _ecg_template()
+        self._r_offset = int(0.35 * SAMPLE_RATE)
+        self._beats = list()
+        self._next_beat = SAMPLE_RATE // 2
+        self._reported = 0
+        self._rr = list()
+        self._scrs = list()
+        self._next_scr = 5 * SAMPLE_RATE
+        self._last_f = 0
+        self._format = ''.join('%s%%d\r\n' % (prefix, ) for prefix in channels)
+        self._columns = [COLUMNS.index(prefix) for prefix in channels]
+
+    def _due(self):
+        if self.rate is None:
+            return self.sent + (0 if self._buffer else self.chunk)
+        return int((time() - self._started) * self.rate)
+
+    def _wait(self):
+        if self.rate is None:
+            return 0
+        return (self.sent + 1) / float(self.rate) - (time() - self._started)
+
+    def _fill(self):
+        due = self._due()
+        while self.sent < due:
+            count = min(self.chunk, due - self.sent)
+            data = self._generate(count)
+            room = len(data)
+            if self.max_buffer is not None and self.rate is not None:
+                room = max(0, self.max_buffer - len(self._buffer))
+            self._buffer += data[:room]
+            self.dropped_bytes += len(data) - min(room, len(data))
+
+    def _schedule(self, until):
+        '''Extends the beat and skin conductance response schedules'''
+        while self._next_beat < until:
+            self._beats.append(self._next_beat)
+            rate = self.heart_rate + 6 * math.sin(self._next_beat / (SAMPLE_RATE * 12.0))
+            self._next_beat += int(60.0 * SAMPLE_RATE / rate * self._random.uniform(0.95, 1.05))
+        while self._next_scr < until:
+            self._scrs.append((self._next_scr, self._random.uniform(10, 40)))
+            self._next_scr += int(SAMPLE_RATE * self._random.uniform(15, 40))
+
+    def _generate(self, count):
+        n = (self.sent + np.arange(count)) * self.step + 1
+        self._schedule(n[-1] + len(self._template))
+        ecg = 30 * np.sin(n / 300.0) + self._random.normal(0, 4, count)
+        clean = np.zeros(count)
+        for beat in self._beats:
+            offset = n - beat + self._r_offset
+            inside = (offset >= 0) & (offset < len(self._template))
+            clean[inside] += self._template[offset[inside]]
+        ecg += clean
+        edr = 520 - 40 * np.sin(n / (SAMPLE_RATE * 90.0)) + self._random.normal(0, 0.5, count)
+        for onset, amplitude in self._scrs:
+            dt = np.maximum(n - onset, 0) / (2.0 * SAMPLE_RATE)
+            # conductance rises, so the measured resistance falls
+            edr -= amplitude * dt * np.exp(1 - dt)
+        high_pass = (36 * clean).astype(np.int64)
+        diff = np.diff(np.concatenate(([self._last_f], high_pass)))
+        self._last_f = high_pass[-1]
+        squared = ((diff * diff) & 0xFFFFFFFF) // 64
+        integrated = np.convolve(squared, np.ones(30) / 30.0)[:count].astype(np.int64)
+        ecg = np.clip(ecg, -512, 511).astype(np.int64)
+        edr = np.clip(edr, 0, 1023).astype(np.int64)
+
+        out = list()
+        for i in range(count):
+            beat = None
+            while (self._reported < len(self._beats) and
+                   self._beats[self._reported] + 20 <= n[i]):
+                beat = self._beats[self._reported]
+                if self._reported:
+                    self._rr.append((beat - self._beats[self._reported - 1]) * 5)
+                    self._rr = self._rr[-8:]
+                self._reported += 1
+            rr1 = int(np.mean(self._rr)) if self._rr else 950
+            rr2 = int(np.median(self._rr)) if self._rr else 1000
+            regular = len(self._rr) == 8 and abs(rr1 - rr2) < rr2 / 12
+            values = (int(n[i]), int(ecg[i]), int(edr[i]), rr2, rr2 if regular else rr1,
+                      int(regular), int(high_pass[i]), int(diff[i]), int(squared[i]),
+                      int(integrated[i]), 9000, 1375, 688)
+            if self.binary:
+                out.append(encode_frame(values[0], values[1], values[2], values[3],
+                                        values[4], *values[6:], pulse_regular=values[5],
+                                        beat=beat, peak_type=0))
+            else:
+                out.append(self._format % tuple(values[c] for c in self._columns))
+                if beat is not None:
+                    out.append('B%d\r\nW0\r\n' % (beat, ))
+        self.sent += count
+        # forget beats and responses that can no longer contribute
+        horizon = n[-1] - len(self._template)
+        while len(self._beats) > 1 and self._reported > 1 and self._beats[0] < horizon:
+            self._beats.pop(0)
+            self._reported -= 1
+        self._scrs = [(onset, a) for onset, a in self._scrs if onset > n[-1] - 30 * SAMPLE_RATE]
+        return ''.join(out)
@@ -0,0 +1,113 @@
+'''Sample rows to times and back.
+
+DAQThread counts time in ticks of the firmware's 200 Hz sample counter,
+an integer that keeps going across Arduino resets, and keeps each row's
+tick in the store's 'tick' channel; a row's time is just tick / rate.
+Ticks only ever increase, so the row for a time is found by a search of
+that channel. When every row of the newest segment has advanced by the
+same step, as with binary frames, it is found arithmetically instead.
+
+A new Segment starts at the first row, after an Arduino reset and at a
+real gap, a step more than GAP times the segment's usual one (text
+output skips a varying few samples per row, which is not a gap). Each
+segment records the wall clock time it began. Segments that ended
+before the oldest retained row are dropped.'''
+from collections import namedtuple
+from datetime import timedelta
+import math
+
+import numpy as np
+
+SAMPLE_RATE = 200
+GAP = 1.5  # times the usual step
+
+Segment = namedtuple('Segment', ['row', 'tick', 'wall', 'reset'])
+
+
+class Timebase(object):
+    def __init__(self, ticks, rate=SAMPLE_RATE):
+        self.ticks = ticks
+        self.rate = rate
+        self.start_time = None
+        self.segments = list()
+        # (the newest segment, its usual step once known, whether every
+        # step since was that one), replaced as a whole for readers
+        self._newest = (None, None, True)
+        self._last = None
+        self._reset = False
+
+    def __len__(self):
+        return len(self.ticks)
+
+    @property
+    def step(self):
+        '''The usual step between rows of the newest segment, None until
+            it has two rows'''
+        return self._newest[1]
+
+    def start(self, start_time):
+        '''Anchors tick 0 to the wall clock time start_time'''
+        self.start_time = start_time
+
+    def reset(self):
+        '''The Arduino reset, the next row starts a new segment'''
+        self._reset = True
+
+    def append(self, tick):
+        '''Adds the next row, which is at ``tick``'''
+        row = len(self.ticks)
+        last, self._last = self._last, tick
+        segment, step, uniform = self._newest
+        if last is None or self._reset:
+            self._begin(row, tick)
+        elif step is None:
+            self._newest = (segment, tick - last, True)
+        elif tick - last != step:
+            if tick - last > GAP * step:
+                self._begin(row, tick)
+            elif uniform:
+                self._newest = (segment, step, False)
+        self.ticks.append(tick)
+
+    def _begin(self, row, tick):
+        segments = self.segments
+        first = self.ticks.first
+        while len(segments) > 1 and segments[1].row <= first:
+            segments.pop(0)
+        segment = Segment(row, tick, self.wall_time(tick), self._reset)
+        segments.append(segment)
+        self._newest = (segment, None, True)
+        self._reset = False
+
+    def time(self, row):
+        '''Seconds since the first row, for a retained row'''
+        return self.ticks[row] / float(self.rate)
+
+    def wall_time(self, tick):
+        '''The wall clock time of ``tick``, None before start()'''
+        if self.start_time is None:
+            return None
+        return self.start_time + timedelta(seconds=tick / float(self.rate))
+
+    def index(self, time):
+        '''The first row at or after ``time`` seconds (len(self) when
+            there is none, the oldest retained row for earlier times).
+            O(1) in a newest segment with a constant step, a binary
+            search of the retained ticks otherwise.'''
+        segment, step, uniform = self._newest
+        count = len(self.ticks)
+        if not count or segment is None:
+            return 0
+        tick = time * self.rate
+        nearest = round(tick)
+        if abs(tick - nearest) < 1e-6:
+            tick = nearest
+        first = self.ticks.first
+        if tick >= segment.tick and (step is None or (uniform and step > 0)):
+            row = segment.row
+            if tick > segment.tick:
+                # past the only row when the step is not known yet
+                row += int(math.ceil((tick - segment.tick) / float(step or 1)))
+            return max(first, min(row, count))
+        ticks = self.ticks[first:count]
+        return first + int(np.searchsorted(ticks, tick, 'left'))